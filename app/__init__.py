@@ -1,45 +1,65 @@
 from flask import Flask
 from .config import config_by_name
+from .jsonprovider import ORJSONProvider
 from flask_cors import CORS
-import openai
 from .api import api_bp
-import os
-import logging
+from .log import init_logging
+from .metrics import init_metrics
+from .querylog import init_querylog
+from .timing import init_timing
+from .usage import init_usage
+from .analytics import init_analytics
+from .ratelimit import init_rate_limiting
+from .quota import init_quota
+from .profiling import init_profiling
+from .replica import init_replica
+from .catalog import init_catalog
+from .semantic import init_semantic
+from .compression import init_compression
 from flask_migrate import Migrate
-from flasgger import Swagger
+from .commands import register_commands
 
 def create_app(config_name):
-    print(config_name)
     app = Flask(__name__)
-    Swagger(app)
     app.config.from_object(config_by_name[config_name])
+    app.json = ORJSONProvider(app)
+    if app.config.get("SWAGGER_ENABLED", True):
+        # Imported here so workers with the docs turned off never load flasgger
+        from flasgger import Swagger
+        Swagger(app)
     CORS(app)
     app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024  # for 20MB limit
-    openai.api_key = app.config["OPENAI_API_KEY"]
 
-    handler = logging.FileHandler('flask_app.log')  # You can specify the path to your log file
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-    # Configure logging
-    if os.environ.get('FLASK_ENV') == 'development':
-        handler.setLevel(logging.DEBUG)  # Or another level like logging.DEBUG or logging.ERROR
-    else:
-        handler.setLevel(logging.ERROR)
-
-    handler.setFormatter(formatter)
-    app.logger.addHandler(handler)
-    app.logger.debug('Debug logging is enabled.')
+    # JSON logs are queued and written by a listener thread, see app/log.py
+    init_logging(app)
+    app.logger.debug('Debug logging is enabled.', extra={"config_name": config_name})
+    init_metrics(app)
+    init_querylog(app)
+    init_timing(app)
+    init_usage(app)
+    init_analytics(app)
+    init_rate_limiting(app)
+    init_quota(app)
+    init_profiling(app)
+    init_replica(app)
+    init_catalog(app)
+    init_semantic(app)
+    # Registered last: a rejected body is still logged and timed by the hooks
+    # before it, and responses are compressed before those hooks add headers.
+    init_compression(app)
 
     from .model import db
     # Initialize Flask-Migrate
-    print(app.config["DBPORT"])
     migrate = Migrate(app, db, render_as_batch=True)
     db.init_app(app)
 
-    # Create database within app context if needed
-    with app.app_context():
-        db.create_all()
+    # Tests run against a fresh in-memory database. Everywhere else the schema
+    # is managed by migrations (`flask db upgrade`).
+    if app.config.get("TESTING"):
+        with app.app_context():
+            db.create_all(bind_key=None)  # Never the read replica
 
     app.register_blueprint(api_bp)
-    
-    return app
\ No newline at end of file
+    register_commands(app)
+
+    return app
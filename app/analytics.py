@@ -0,0 +1,323 @@
+"""
+analytics.py
+------------
+
+Usage analytics for admins: request counts, token totals and latency
+percentiles per hour, day, user, vendor and/or model, over any time range.
+
+Computing those from the token usage ledger would read every row in the range,
+so the ledger is rolled up per hour, user, vendor and model into `usage_rollup`.
+Each rollup row has a latency sketch in `usage_latency_bucket`: the number of
+calls per logarithmic latency bucket. Buckets are about 4% wide, so a
+percentile read from a sketch is within 2% of the exact value (the DDSketch
+scheme). Sketches merge by adding counts, so a range query is two GROUP BY
+queries over the rollups, however many calls are behind them.
+
+An hour is rolled up once it is over and ANALYTICS_ROLLUP_DELAY seconds have
+passed for the usage flusher to write its last rows. A background thread does
+this in each worker every ANALYTICS_ROLLUP_INTERVAL seconds; `flask
+analytics-rollup` does it from cron, or rebuilds past hours. Each hour is
+rebuilt from the ledger and committed together with the watermark, which is
+locked while doing so, so workers do not conflict and an interrupted run
+resumes where it stopped. Queries add the hours past the watermark straight
+from the ledger, so results include the latest calls.
+
+Functions:
+- `latency_bucket(ms)`: The sketch bucket a latency falls in.
+- `bucket_latency(bucket)`: The latency a bucket stands for.
+- `percentiles(buckets, quantiles)`: Latency percentiles of a sketch.
+- `rollup_usage(now, since)`: Rolls up the finished hours past the watermark.
+- `usage_analytics(start, end, group_by)`: Totals and latency percentiles per group.
+- `init_analytics(app)`: Starts the rollup job with the app's first request.
+
+Objects:
+- `rollup_job`: The process-wide `RollupJob`.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+
+from .model import RollupWatermark, TokenUsage, UsageLatencyBucket, UsageRollup, db
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_GROUPS = ("user", "model", "vendor", "day", "hour")
+# Result key of each group
+GROUP_LABELS = {"user": "user_id", "model": "model_api_name", "vendor": "api_vendor", "day": "day", "hour": "hour"}
+PERCENTILES = (50, 90, 95, 99)
+TOKEN_COLUMNS = ("input_tokens", "output_tokens", "thinking_tokens", "cached_tokens")
+WATERMARK = "usage"
+HOUR = timedelta(hours=1)
+
+# Relative accuracy of the latency sketch
+SKETCH_ACCURACY = 0.02
+_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+def latency_bucket(ms):
+    """Bucket i holds latencies in (gamma^(i-1), gamma^i] ms; bucket 0 everything up to 1 ms."""
+    if ms <= 1:
+        return 0
+    return math.ceil(math.log(ms) / _LOG_GAMMA)
+
+
+def bucket_latency(bucket):
+    return 2 * _GAMMA ** bucket / (_GAMMA + 1)
+
+
+def percentiles(buckets, quantiles=PERCENTILES):
+    """
+    Returns {"p50": ms, ...} for a sketch given as {bucket: count}, with None
+    values if it is empty.
+    """
+    total = sum(buckets.values())
+    if not total:
+        return {f"p{quantile}": None for quantile in quantiles}
+    ordered = sorted(buckets.items())
+    result = {}
+    for quantile in quantiles:
+        rank = quantile / 100 * (total - 1)
+        seen = 0
+        for bucket, count in ordered:
+            seen += count
+            if seen > rank:
+                break
+        result[f"p{quantile}"] = round(bucket_latency(bucket), 1)
+    return result
+
+
+def _hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _new_group():
+    return {"requests": 0, **dict.fromkeys(TOKEN_COLUMNS, 0), "buckets": Counter()}
+
+
+def _ledger_groups(start, end):
+    """Aggregates the ledger rows from `start` to `end` (either may be None) per hour, user, vendor and model."""
+    statement = select(TokenUsage.timestamp, TokenUsage.user_id, TokenUsage.api_vendor,
+                       TokenUsage.model_api_name, TokenUsage.latency_ms,
+                       *(getattr(TokenUsage, column) for column in TOKEN_COLUMNS))
+    if start is not None:
+        statement = statement.where(TokenUsage.timestamp >= start)
+    if end is not None:
+        statement = statement.where(TokenUsage.timestamp < end)
+    groups = {}
+    for row in db.session.execute(statement.execution_options(yield_per=1000)):
+        key = (_hour(row.timestamp), row.user_id, row.api_vendor, row.model_api_name)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = _new_group()
+        group["requests"] += 1
+        for column in TOKEN_COLUMNS:
+            group[column] += getattr(row, column) or 0
+        if row.latency_ms is not None:
+            group["buckets"][latency_bucket(row.latency_ms)] += 1
+    return groups
+
+
+def _rollup_hour(hour):
+    hour_rollups = select(UsageRollup.id).where(UsageRollup.hour == hour)
+    db.session.execute(delete(UsageLatencyBucket).where(UsageLatencyBucket.rollup_id.in_(hour_rollups)))
+    db.session.execute(delete(UsageRollup).where(UsageRollup.hour == hour))
+    for (_, user_id, api_vendor, model_api_name), group in _ledger_groups(hour, hour + HOUR).items():
+        db.session.add(UsageRollup(
+            hour=hour, user_id=user_id, api_vendor=api_vendor, model_api_name=model_api_name,
+            requests=group["requests"], **{column: group[column] for column in TOKEN_COLUMNS},
+            latency_buckets=[UsageLatencyBucket(bucket=bucket, count=count)
+                             for bucket, count in group["buckets"].items()],
+        ))
+
+
+def rollup_usage(now=None, since=None):
+    """
+    Rolls up every hour past the watermark that ended ANALYTICS_ROLLUP_DELAY
+    seconds before `now`, in one transaction per hour. Hours without usage
+    are skipped. `since` first moves the watermark back to rebuild the hours
+    from then on. Returns the number of hours rolled up.
+    """
+    delay = timedelta(seconds=current_app.config.get("ANALYTICS_ROLLUP_DELAY", 120))
+    cutoff = _hour((now or datetime.utcnow()) - delay)
+    rolled = 0
+    while True:
+        watermark = db.session.get(RollupWatermark, WATERMARK, with_for_update=True)
+        if watermark is None:
+            first = db.session.scalar(select(func.min(TokenUsage.timestamp)))
+            if first is None:
+                db.session.rollback()
+                return rolled
+            watermark = RollupWatermark(name=WATERMARK, rolled_until=_hour(first))
+            db.session.add(watermark)
+        if since is not None:
+            watermark.rolled_until = min(watermark.rolled_until, _hour(since))
+            since = None
+
+        next_call = db.session.scalar(
+            select(func.min(TokenUsage.timestamp)).where(TokenUsage.timestamp >= watermark.rolled_until))
+        hour = _hour(next_call) if next_call is not None else cutoff
+        if hour >= cutoff:
+            watermark.rolled_until = max(watermark.rolled_until, cutoff)
+            db.session.commit()
+            return rolled
+        _rollup_hour(hour)
+        watermark.rolled_until = hour + HOUR
+        db.session.commit()
+        rolled += 1
+
+
+def _add_group(groups, key, totals, buckets=None):
+    group = groups.get(key)
+    if group is None:
+        group = groups[key] = _new_group()
+    for column in ("requests", *TOKEN_COLUMNS):
+        group[column] += totals[column] or 0
+    if buckets:
+        group["buckets"].update(buckets)
+
+
+def _group_value(group, value):
+    if value is None:
+        return None
+    if group == "day":
+        return str(value)
+    if group == "hour":
+        return value.isoformat()
+    return value
+
+
+def usage_analytics(start=None, end=None, group_by=("day", "model")):
+    """
+    Request counts, token totals and latency percentiles.
+
+    Args:
+        start (datetime): Inclusive lower bound, rounded down to the hour, or None.
+        end (datetime): Exclusive upper bound, rounded up to the hour, or None.
+        group_by (iterable): Any of "user", "model", "vendor", "day" and "hour".
+
+    Returns:
+        dict: `rolledUntil`, the end of the rolled up hours (later calls are read
+        from the ledger), and `groups`: one dict per group with the group keys,
+        the request count, the summed tokens and `latency_ms` percentiles.
+    """
+    start = _hour(start) if start is not None else None
+    if end is not None and end != _hour(end):
+        end = _hour(end) + HOUR
+    watermark = db.session.get(RollupWatermark, WATERMARK)
+    rolled_until = watermark.rolled_until if watermark else None
+
+    groups = {}
+    if rolled_until is not None and (start is None or start < rolled_until):
+        columns = {
+            "user": UsageRollup.user_id,
+            "model": UsageRollup.model_api_name,
+            "vendor": UsageRollup.api_vendor,
+            "day": func.date(UsageRollup.hour),
+            "hour": UsageRollup.hour,
+        }
+        group_columns = [columns[group].label(GROUP_LABELS[group]) for group in group_by]
+        conditions = [UsageRollup.hour < (min(end, rolled_until) if end is not None else rolled_until)]
+        if start is not None:
+            conditions.append(UsageRollup.hour >= start)
+
+        totals = select(*group_columns, func.sum(UsageRollup.requests).label("requests"),
+                        *(func.sum(getattr(UsageRollup, column)).label(column) for column in TOKEN_COLUMNS)
+                        ).where(*conditions)
+        sketches = (select(*group_columns, UsageLatencyBucket.bucket, func.sum(UsageLatencyBucket.count).label("count"))
+                    .select_from(UsageRollup).join(UsageLatencyBucket, UsageLatencyBucket.rollup_id == UsageRollup.id)
+                    .where(*conditions).group_by(*group_columns, UsageLatencyBucket.bucket))
+        if group_columns:
+            totals = totals.group_by(*group_columns)
+
+        for row in db.session.execute(totals):
+            if row.requests is not None:
+                _add_group(groups, tuple(_group_value(group, row[index]) for index, group in enumerate(group_by)),
+                           row._mapping)
+        for row in db.session.execute(sketches):
+            key = tuple(_group_value(group, row[index]) for index, group in enumerate(group_by))
+            groups[key]["buckets"][row.bucket] += row.count
+
+    # Hours past the watermark are read from the ledger
+    ledger_start = start
+    if rolled_until is not None:
+        ledger_start = max(start, rolled_until) if start is not None else rolled_until
+    if end is None or ledger_start is None or ledger_start < end:
+        for (hour, user_id, api_vendor, model_api_name), group in _ledger_groups(ledger_start, end).items():
+            values = {"user": user_id, "model": model_api_name, "vendor": api_vendor,
+                      "day": hour.date().isoformat(), "hour": hour.isoformat()}
+            _add_group(groups, tuple(values[group_name] for group_name in group_by), group, group["buckets"])
+
+    results = []
+    for key in sorted(groups, key=lambda key: [(value is None, value) for value in key]):
+        group = groups[key]
+        result = dict(zip((GROUP_LABELS[group_name] for group_name in group_by), key))
+        result.update({column: group[column] for column in ("requests", *TOKEN_COLUMNS)})
+        result["latency_ms"] = percentiles(group["buckets"])
+        results.append(result)
+    return {"rolledUntil": rolled_until.isoformat() if rolled_until else None, "groups": results}
+
+
+class RollupJob:
+    """
+    Calls `rollup_usage` every `interval` seconds from a daemon thread. The
+    thread is started by the first request a worker handles, and again after a
+    fork, since threads do not survive it.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def configure(self, app):
+        self.app = app
+        self.interval = app.config.get("ANALYTICS_ROLLUP_INTERVAL", 300)
+
+    def run_once(self):
+        with self.app.app_context():
+            try:
+                rollup_usage()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Usage rollup failed")
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.run_once()
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="usage-rollup", daemon=True)
+            self._thread.start()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+rollup_job = RollupJob()
+
+
+def init_analytics(app):
+    rollup_job.configure(app)
+    if rollup_job.interval > 0:
+        app.before_request(rollup_job.ensure_started)
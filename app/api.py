@@ -1,36 +1,53 @@
+import logging
 import os
+from datetime import datetime
 from functools import partial, wraps
 
-import openai
+import orjson
 import requests
-from anthropic import Anthropic
 from dotenv import load_dotenv
-from flask import Blueprint, abort, jsonify, render_template, request
-
-from .model import (APIKey, APIVendor, ConversationHistory, Model,
+from flask import (Blueprint, Response, abort, current_app, g, jsonify, render_template, request, send_file,
+                   stream_with_context)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, selectinload
+
+from .analytics import ANALYTICS_GROUPS, usage_analytics
+from .apikeys import find_api_key
+from .bulk import NDJSON_MIMETYPE, BulkImportError, export_rows, import_rows, parse_rows
+from .catalog import catalog_response
+from .export import export_conversations
+from .jsonprovider import dumps_bytes
+from .metrics import observe_vendor
+from .profiling import list_profiles, profile_path
+from .quota import admit
+from .ratelimit import rate_limit
+from .replica import read_replica
+from .search import MAX_SEARCH_PAGE_SIZE, search_conversations
+from .semantic import semantic_enabled, semantic_search
+from .timing import span, timed
+from .usage import USAGE_GROUPS, aggregate_usage
+from .vendors import openai_sdk
+from .model import (APIVendor, ConversationHistory, ConversationMessage, Model,
                     OutputFormat, Persona, RenderType, Users, UserSettings, db)
-from .utils import (api_vendors_json, generate_random_password, models_json,
-                    output_formats_json, personas_json, render_types_json,
-                    get_summary_model, anthropic_request, openai_request, google_request,
-                    system_prompt_dict)
+from .utils import (generate_random_password, get_or_create_user_settings, get_summary_model,
+                    anthropic_request, openai_request, google_request, system_prompt_dict,
+                    openai_usage)
 
 api_bp = Blueprint('api', __name__)
 load_dotenv()
-
-openai.api_key = os.environ.get("OPENAI_API_KEY")
-anthropic_client = Anthropic()
+logger = logging.getLogger(__name__)
 
 
 def get_token_from_header():
     auth_header = request.headers.get('Authorization')
     if auth_header and auth_header.startswith('Bearer '):
         return auth_header.split(' ', 1)[1]
-    print("No auth header token")
+    logger.debug("No auth header token")
     return None
 
 
 def get_api_key_or_abort(token):
-    key_object = APIKey.query.filter_by(key=token).first()
+    key_object = find_api_key(token)
     if not key_object:
         abort(401, description="Invalid or missing API key")
     return key_object
@@ -42,76 +59,127 @@ def require_api_key(f):
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = get_token_from_header()
-        get_api_key_or_abort(token)
+        with span("auth"):
+            token = get_token_from_header()
+            g.api_key_id = get_api_key_or_abort(token).id
         return f(*args, **kwargs)
     return decorated_function
 
 
-def require_clerk_session(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        clerk_secret = os.environ.get("CLERK_SECRET")
+def get_clerk_user(data):
+    """
+    Verify the Clerk session named in a request body and return the matching
+    user, creating it on first sight. Aborts with 400/401 if verification fails.
+    """
+    clerk_secret = os.environ.get("CLERK_SECRET")
+
+    if not clerk_secret:
+        # api_bp.logger.debug('Clerk API Key Missing')
+        abort(401, description="Clerk API Key Missing")
+
+    # Retrieve session_id from the JSON body
+    session_id = data.get("sessionId")
+    user_id = data.get("userId")
+    email = data.get("email")
+    if not session_id:
+        # api_bp.logger.debug('No session id')
+        abort(400, description="Session ID required")
+
+    # Prepare the request
+    headers = {
+        'Authorization': f'Bearer {clerk_secret}',
+        'Content-Type': 'application/json'
+    }
+    # Assuming session_id needs to be a part of the URL
+    clerk_api_url = os.environ.get("CLERK_API_URL", "https://api.clerk.com/v1")
+    url = f'{clerk_api_url}/sessions/{session_id}'
+    # api_bp.logger.debug(url)
 
-        if not clerk_secret:
-            # api_bp.logger.debug('Clerk API Key Missing')
-            abort(401, description="Clerk API Key Missing")
+    # Send a request to the Clark API
+    with span("clerk"):
+        response = requests.get(url, headers=headers)
 
-        # Retrieve session_id from the JSON body
-        data = request.get_json()
-        session_id = data.get("sessionId")
-        user_id = data.get("userId")
-        email = data.get("email")
-        if not session_id:
-            # api_bp.logger.debug('No session id')
-            abort(400, description="Session ID required")
-
-        # Prepare the request
-        headers = {
-            'Authorization': f'Bearer {clerk_secret}',
-            'Content-Type': 'application/json'
-        }
-        # Assuming session_id needs to be a part of the URL
-        url = f'https://api.clerk.com/v1/sessions/{session_id}'
-        # api_bp.logger.debug(url)
+    # Check if the response is okay and the status is active
+    if response.status_code == 200:
+        response_json = response.json()
+        if response_json.get('status') != 'active':
+            abort(401, description="Session is not active")
+        verified_user_id = response_json.get('user_id')
+        if not verified_user_id or verified_user_id == "":
+            # api_bp.logger.debug('Clerk User not found')
+            abort(401, description="User not found")
 
-        # Send a request to the Clark API
-        response = requests.get(url, headers=headers)
+        # api_bp.logger.debug(f"recieved user: {user_id} clerk verified user: {verified_user_id}")
 
-        # Check if the response is okay and the status is active
-        if response.status_code == 200:
-            response_json = response.json()
-            if response_json.get('status') != 'active':
-                abort(401, description="Session is not active")
-            verified_user_id = response_json.get('user_id')
-            if not verified_user_id or verified_user_id == "":
-                # api_bp.logger.debug('Clerk User not found')
-                abort(401, description="User not found")
+        if user_id != verified_user_id:
+            abort(401, f"Mismatched Users {user_id} {verified_user_id}")
 
-            # api_bp.logger.debug(f"recieved user: {user_id} clerk verified user: {verified_user_id}")
+        user = Users.query.filter_by(username=user_id).first()
 
-            if user_id != verified_user_id:
-                abort(401, f"Mismatched Users {user_id} {verified_user_id}")
+        if not user:
+            # api_bp.logger.debug('Adding user')
+            password = generate_random_password()
+            user = Users(username=user_id, password=password, email=email)
+            db.session.add(user)
+            db.session.commit()
 
-            user = Users.query.filter_by(username=user_id).first()
+    else:
+        # api_bp.logger.debug('Clerk User not found')
+        abort(401, description="Failed to verify session with Clerk API")
 
-            if not user:
-                # api_bp.logger.debug('Adding user')
-                password = generate_random_password()
-                user = Users(username=user_id, password=password, email=email)
-                db.session.add(user)
-                db.session.commit()
+    # api_bp.logger.debug('All good. Auth successful')
+    g.user_id = user.id
+    return user
 
-        else:
-            # api_bp.logger.debug('Clerk User not found')
-            abort(401, description="Failed to verify session with Clerk API")
 
-        # api_bp.logger.debug('All good. Auth successful')
+def require_clerk_session(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user = get_clerk_user(request.get_json())
         return partial(f, user=user)(*args, **kwargs)
 
     return decorated_function
 
 
+def optional_clerk_session(f):
+    """
+    Like require_clerk_session, but only verifies the session when the body
+    carries a sessionId, and does not pass the user to the view. Lets API-key
+    routes attribute rate limits and quotas to the Clerk user when known.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        data = request.get_json(silent=True) or {}
+        if data.get("sessionId"):
+            get_clerk_user(data)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def require_admin(f):
+    """
+    A decorator that only lets admin users through. Must be applied below
+    require_clerk_session, which supplies the user.
+    """
+    @wraps(f)
+    def decorated_function(*args, user, **kwargs):
+        if not user.is_admin:
+            abort(403, description="Admin access required")
+        return f(*args, user=user, **kwargs)
+    return decorated_function
+
+
+def parse_datetime_arg(value, name):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(400, description=f"Invalid '{name}' timestamp, expected ISO 8601")
+
+
+@timed("prompt-build")
 def ai_request(post_request):
     """
     Process a POST request for an AI model, preparing data for the request.
@@ -135,7 +203,13 @@ def ai_request(post_request):
     }
     # Dall-E only uses the prompt, so ignore the rest if Dall-E
     if model != "dall-e-3":
-        response_history = request_json["responseHistory"]
+        conversation = None
+        if request_json.get("conversationId") is not None:
+            conversation = load_conversation_or_abort(request_json["conversationId"])
+            user_turn = {"role": "user", "content": prompt}
+            response_history = conversation_messages(conversation.id) + [user_turn]
+        else:
+            response_history = request_json["responseHistory"]
         persona_id = request_json["personaId"]
         output_format_id = request_json["outputFormatId"]
         image_data = request_json["imageData"]
@@ -161,9 +235,58 @@ def ai_request(post_request):
             "budget_tokens": budget_tokens,
         }
         request_dict.update(request_dict_additions)
+        if conversation is not None:
+            request_dict["conversation"] = {"id": conversation.id,
+                                            "base_sequence": conversation.message_count,
+                                            "user_turn": user_turn}
 
     return request_dict
 
+
+def load_conversation_or_abort(conversation_id):
+    """The caller's saved conversation, for /api/chat requests sent with a conversationId."""
+    user_id = g.get("user_id")
+    if user_id is None:
+        abort(401, description="A sessionId is required to chat in a saved conversation")
+    conversation = ConversationHistory.query.filter_by(id=conversation_id, user_id=user_id).first()
+    if conversation is None:
+        abort(404, description="Conversation not found")
+    return conversation
+
+
+def conversation_messages(conversation_id):
+    """The stored messages of a conversation in order, read without loading the ORM rows."""
+    rows = db.session.execute(
+        db.select(ConversationMessage.message)
+        .where(ConversationMessage.conversation_id == conversation_id)
+        .order_by(ConversationMessage.sequence))
+    return [orjson.loads(message) for message, in rows]
+
+
+def store_chat_turn(conversation, message):
+    """
+    Appends the user turn and the model's reply to the conversation they were
+    sent in and returns the reply with the conversation's new message count.
+    Responds 409 (with the reply) if the conversation grew while the model was
+    answering, so the client can resync instead of storing turns out of order.
+    """
+    reply = dict(message)
+    stored = ConversationHistory.query.filter_by(id=conversation["id"]) \
+        .with_for_update().populate_existing().first()
+    if stored is None or stored.message_count != conversation["base_sequence"]:
+        db.session.rollback()
+        return jsonify({"message": "The conversation changed while the reply was generated",
+                        "reply": reply,
+                        "messageCount": stored.message_count if stored else None}), 409
+    stored.append_messages([conversation["user_turn"], reply])
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "The conversation changed while the reply was generated",
+                        "reply": reply}), 409
+    return jsonify({**reply, "conversationId": stored.id, "messageCount": stored.message_count})
+
 # Routing
 
 
@@ -175,6 +298,7 @@ def index():
 @api_bp.route('/api/current_user', methods=['POST'])
 @require_api_key
 @require_clerk_session
+@rate_limit("default")
 def api_clerk_test(user):
     user_json = {
         "id": user.id,
@@ -192,6 +316,8 @@ def api_clerk_test(user):
 
 @api_bp.route('/api/personas', methods=["GET"])
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_personas():
     """
     Get All Personas
@@ -212,14 +338,15 @@ def api_personas():
       401:
         description: Unauthorized, invalid or missing API key
     """
-    personas = Persona.query.all()
-    return personas_json(personas)
+    return catalog_response("personas")
 
 # Get single persona
 
 
 @api_bp.route('/api/personas/<int:id>', methods=["GET"])
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_persona(id):
     """
     Get Single Persona
@@ -260,6 +387,7 @@ def api_persona(id):
 
 @api_bp.route("/api/personas", methods=["POST"])
 @require_api_key
+@rate_limit("default")
 def api_add_persona():
     """
     Add Persona
@@ -279,6 +407,8 @@ def api_add_persona():
           application/json: {"message": "success"}
       401:
         description: Unauthorized, invalid or missing API key
+      409:
+        description: A persona with this name already exists
       500:
         description: An unexpected error occurred
     """
@@ -296,6 +426,9 @@ def api_add_persona():
         db.session.commit()
 
         return jsonify({"message": "Success"}), 201
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "A persona with this name already exists."}), 409
     except Exception as e:
         return jsonify({"message": "An unexpected error occurred."}), 500
 
@@ -304,6 +437,7 @@ def api_add_persona():
 
 @api_bp.route("/api/personas/<int:persona_id>", methods=["PUT"])
 @require_api_key
+@rate_limit("default")
 def api_update_persona(persona_id):
     """
     Update Persona
@@ -336,6 +470,8 @@ def api_update_persona(persona_id):
         description: The requested persona is not found
         examples:
             application/json: {"message": "Persona not found"}
+      409:
+        description: A persona with this name already exists
       500:
         description: An unexpected error occurred
         examples:
@@ -362,6 +498,9 @@ def api_update_persona(persona_id):
     try:
         db.session.commit()
         return jsonify({"message": "Persona updated successfully"}), 200
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "A persona with this name already exists."}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "An unexpected error occurred."}), 500
@@ -371,6 +510,7 @@ def api_update_persona(persona_id):
 
 @api_bp.route("/api/personas/<int:id>", methods=["DELETE"])
 @require_api_key
+@rate_limit("default")
 def api_delete_persona(id):
     """
     Delete Persona
@@ -417,6 +557,8 @@ def api_delete_persona(id):
 
 @api_bp.route('/api/models')
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_models():
     """
     Get All Models
@@ -437,14 +579,15 @@ def api_models():
       401:
         description: Unauthorized, invalid or missing API key
     """
-    models = Model.query.order_by(Model.id).all()
-    return models_json(models)
+    return catalog_response("models")
 
 # Get single model
 
 
 @api_bp.route('/api/models/<int:id>', methods=["GET"])
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_model(id):
     """
     Get Single Model by ID
@@ -484,6 +627,7 @@ def api_model(id):
 
 
 @api_bp.route('/api/models/api_name/<string:api_name>')
+@read_replica
 def api_model_api_name(api_name):
     """
     Get Single Model by API Name
@@ -521,6 +665,7 @@ def api_model_api_name(api_name):
 
 @api_bp.route('/api/models', methods=['POST'])
 @require_api_key
+@rate_limit("default")
 def api_add_model():
     """
     Add a New Model
@@ -565,6 +710,8 @@ def api_add_model():
         description: Invalid input
       401:
         description: Unauthorized, invalid or missing API key
+      409:
+        description: A model with this api_name and name already exists
       500:
         description: An unexpected error occurred
     """
@@ -593,6 +740,9 @@ def api_add_model():
         db.session.commit()
 
         return jsonify({"message": "Model created successfully", "model": new_model.to_dict()}), 201
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "A model with this api_name and name already exists."}), 409
     except Exception as e:
         return jsonify({"message": "An unexpected error occurred."}), 500
 
@@ -601,6 +751,7 @@ def api_add_model():
 
 @api_bp.route('/api/models/<int:model_id>', methods=['PUT'])
 @require_api_key
+@rate_limit("default")
 def api_update_model(model_id):
     """
     Update an existing Model
@@ -645,6 +796,8 @@ def api_update_model(model_id):
         description: Invalid input
       401:
         description: Unauthorized, invalid or missing API key
+      409:
+        description: A model with this api_name and name already exists
       500:
         description: An unexpected error occurred
     """
@@ -675,9 +828,11 @@ def api_update_model(model_id):
         model.is_thinking = is_thinking
         model.api_vendor_id = api_vendor_id
 
-        print(is_vision)
         db.session.commit()
         return jsonify({"message": "Model created successfully", "model": model.to_dict()}), 201
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "A model with this api_name and name already exists."}), 409
     except Exception as e:
         return jsonify({"message": "An unexpected error occurred."}), 500
 
@@ -687,6 +842,7 @@ def api_update_model(model_id):
 
 @api_bp.route("/api/models/<int:id>", methods=["DELETE"])
 @require_api_key
+@rate_limit("default")
 def api_delete_model(id):
     """
     Delete a Model
@@ -730,6 +886,8 @@ def api_delete_model(id):
 
 @api_bp.route('/api/output-formats')
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_output_formats():
     """
     Get All Output Formats
@@ -753,15 +911,15 @@ def api_output_formats():
     # if not current_user.is_admin:
     #    return redirect(url_for('index'))
 
-    output_formats = OutputFormat.query.order_by(OutputFormat.id).all()
-    # personas_json = json.dumps([ob.__dict__ for ob in personas])
-    return output_formats_json(output_formats)
+    return catalog_response("output_formats")
 
 # Get Single Output Format
 
 
 @api_bp.route('/api/output-formats/<int:id>', methods=["GET"])
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_output_format(id):
     """
     Get Single Output Format
@@ -802,6 +960,7 @@ def api_output_format(id):
 
 @api_bp.route("/api/output-formats", methods=["POST"])
 @require_api_key
+@rate_limit("default")
 def api_add_output_formats():
     """
     Add Output Format
@@ -821,6 +980,8 @@ def api_add_output_formats():
           application/json: {"message": "success"}
       401:
         description: Unauthorized, invalid or missing API key
+      409:
+        description: An output format with this name already exists
       500:
         description: An unexpected error occurred
     """
@@ -840,6 +1001,9 @@ def api_add_output_formats():
         db.session.commit()
 
         return jsonify({"message": "Success"}), 201
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "An output format with this name already exists."}), 409
     except Exception as e:
         return jsonify({"message": "An unexpected error occurred."}), 500
 
@@ -848,6 +1012,7 @@ def api_add_output_formats():
 
 @api_bp.route("/api/output-formats/<int:output_format_id>", methods=["PUT"])
 @require_api_key
+@rate_limit("default")
 def api_update_output_format(output_format_id):
     """
     Update Output Format
@@ -880,6 +1045,8 @@ def api_update_output_format(output_format_id):
         description: The requested persona is not found
         examples:
             application/json: {"message": "Persona not found"}
+      409:
+        description: An output format with this name already exists
       500:
         description: An unexpected error occurred
         examples:
@@ -909,6 +1076,9 @@ def api_update_output_format(output_format_id):
     try:
         db.session.commit()
         return jsonify({"message": "Success"}), 200
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "An output format with this name already exists."}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "An unexpected error occurred."}), 500
@@ -918,6 +1088,7 @@ def api_update_output_format(output_format_id):
 
 @api_bp.route("/api/output-formats/<int:id>", methods=["DELETE"])
 @require_api_key
+@rate_limit("default")
 def api_delete_output_format(id):
     """
     Delete Output Format
@@ -957,12 +1128,115 @@ def api_delete_output_format(id):
     except Exception as e:
         return jsonify({"message": "An unexpected error occurred."}), 500
 
+# Bulk import and export of personas, models and output formats, matched on
+# natural keys (see app/bulk.py)
+
+
+@api_bp.route('/api/<any(personas, models, "output-formats"):catalog>/bulk', methods=["GET"])
+@require_api_key
+@rate_limit("default")
+@read_replica
+def api_export_catalog(catalog):
+    """
+    Export a Catalog
+    ---
+    tags:
+      - Bulk
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - name: catalog
+        in: path
+        type: string
+        enum: [personas, models, output-formats]
+        required: true
+      - name: Accept
+        in: header
+        type: string
+        description: application/x-ndjson streams one row per line, otherwise a JSON array is returned
+    responses:
+      200:
+        description: The catalog's rows, in the format the import takes
+        examples:
+          application/x-ndjson: |
+            {"api_name":"gpt-4o","name":"GPT-4o","is_vision":false,"is_image_generation":false,"is_thinking":false,"api_vendor":"openai"}
+      401:
+        description: Unauthorized, invalid or missing API key
+    """
+    rows = export_rows(catalog)
+    if request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        lines = (dumps_bytes(row) + b"\n" for row in rows)
+        return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+    return jsonify(list(rows))
+
+
+@api_bp.route('/api/<any(personas, models, "output-formats"):catalog>/bulk', methods=["POST"])
+@require_api_key
+@rate_limit("default")
+def api_import_catalog(catalog):
+    """
+    Import a Catalog
+    ---
+    tags:
+      - Bulk
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - name: catalog
+        in: path
+        type: string
+        enum: [personas, models, output-formats]
+        required: true
+      - in: body
+        name: body
+        description: >
+          A JSON array of rows, or one row per line with Content-Type application/x-ndjson.
+          Rows matching an existing row's natural key (name; api_name and name for models)
+          update it, the others are inserted. References are given by name (api_vendor,
+          render_type) or id (api_vendor_id, render_type_id).
+        required: true
+        schema:
+          type: array
+          items:
+            type: object
+          example:
+            - name: "Coder"
+              prompt: "You are an expert programmer."
+    responses:
+      200:
+        description: The batch was written in one transaction; rows identical to the stored ones are left unchanged
+        examples:
+          application/json: {"inserted": 3, "updated": 1, "unchanged": 0}
+      400:
+        description: Nothing was written; every invalid row is listed with its 1-based position
+        examples:
+          application/json: {"message": "Invalid rows", "errors": [{"row": 2, "errors": ["'prompt' is required"]}]}
+      401:
+        description: Unauthorized, invalid or missing API key
+    """
+    try:
+        result = import_rows(catalog, parse_rows(request.get_data(), request.mimetype))
+    except BulkImportError as e:
+        return jsonify({"message": "Invalid rows", "errors": e.errors}), 400
+    return jsonify(result)
+
 # Render Types
 # Get all Render Types
 
 
 @api_bp.route('/api/render-types', methods=["GET"])
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_render_types():
     """
     Get All Render Types
@@ -983,12 +1257,13 @@ def api_render_types():
       401:
         description: Unauthorized, invalid or missing API key
     """
-    render_types = RenderType.query.all()
-    return render_types_json(render_types)
+    return catalog_response("render_types")
 
 
 @api_bp.route('/api/api-vendors', methods=["GET"])
 @require_api_key
+@rate_limit("catalog")
+@read_replica
 def api_api_vendors():
     """
     Get All API Vendors
@@ -1009,14 +1284,16 @@ def api_api_vendors():
       401:
         description: Unauthorized, invalid or missing API key
     """
-    api_vendors = APIVendor.query.all()
-    return api_vendors_json(api_vendors)
+    return catalog_response("api_vendors")
 
-# The main chat/conversation endpoint
+# The main chat/conversation endpoint. Clients either send the whole history in
+# responseHistory, or the conversationId of a saved chat and just the new prompt.
 
 
 @api_bp.route('/api/chat', methods=['POST'])
 @require_api_key
+@optional_clerk_session
+@rate_limit("chat")
 def api_chat():
     """
     Generate a chat response from selected AI model
@@ -1052,6 +1329,21 @@ def api_chat():
                         type: string
             imageData:
               type: string
+            maxTokens:
+              type: integer
+            budgetTokens:
+              type: integer
+            conversationId:
+              type: integer
+              description: >
+                Optional saved conversation (see /api/save_chat) to continue. The server
+                supplies the stored messages in place of responseHistory, then stores the
+                prompt and the reply. Requires sessionId.
+            sessionId:
+              type: string
+              description: Optional Clerk session, attributes rate limits and token quotas to the user
+            userId:
+              type: string
           example:
             model: "gpt-3.5-turbo"
             prompt: "Testing the API. Respond with a test message."
@@ -1068,7 +1360,7 @@ def api_chat():
         description: API key (Bearer Token)
     responses:
       200:
-        description: Returns an object with role and content
+        description: Returns an object with role and content, plus conversationId and messageCount when sent with a conversationId
         examples:
           application/json: > 
             {
@@ -1077,6 +1369,12 @@ def api_chat():
             }
       401:
         description: Unauthorized, invalid or missing API key
+      404:
+        description: Model or conversation not found
+      409:
+        description: The conversation changed while the reply was generated. The reply is returned under "reply".
+      429:
+        description: Rate limit or token quota exceeded
       500:
         description: An unexpected error occurred
     """
@@ -1089,12 +1387,15 @@ def api_chat():
 
     api_vendor_name = model.api_vendor.name
 
-    print("Is the model a vision model?")
-    print(model.is_vision)
+    # Reserve the estimated token cost against the caller's quota before dispatch
+    admit(request_dict["model"], request_dict["messages"],
+          request_dict["max_tokens"], request_dict["budget_tokens"])
+
+    logger.debug("Chat request for model %s (vendor %s, vision %s)",
+                 model.api_name, api_vendor_name, model.is_vision)
 
     # If a file was uploaded and the model is a vision model, use the vision API and override the system prompt
     if request_dict["image_data"] and request_dict["image_data"] != '' and model.is_vision:
-        print("Is a vision model")
         prompt = request_dict['prompt']
         image_data = request_dict["image_data"]
         content = [
@@ -1111,13 +1412,17 @@ def api_chat():
         messages = [{"role": "system", "content": system_prompt}]
         messages += [{"role": "user", "content": content}]
         request_dict["messages"] = messages
-
-        response = openai.ChatCompletion.create(
-            model=request_dict["model"],
-            messages=request_dict["messages"],
-            max_tokens=1024
-        )
-        return jsonify(response["choices"][0]["message"])
+        if "conversation" in request_dict:
+            request_dict["conversation"]["user_turn"] = {"role": "user", "content": content}
+
+        with observe_vendor("openai", request_dict["model"]) as call:
+            response = openai_sdk().ChatCompletion.create(
+                model=request_dict["model"],
+                messages=request_dict["messages"],
+                max_tokens=1024
+            )
+            call.record_usage(openai_usage(response))
+        message = response["choices"][0]["message"]
 
     # Use the Anthropic client if the API vendor is Anthropic
     elif api_vendor_name.lower() == 'anthropic':
@@ -1137,7 +1442,6 @@ def api_chat():
         # We need to convert Anthropic's chat response to be in OpenAI's format
         # message = {"role": "assistant",
         #           "content": response.content[0].text}
-        return jsonify(message)
 
     # If the API vendor is OpenAI, we simply pass it our model and messages object
     elif api_vendor_name.lower() == 'openai':
@@ -1147,16 +1451,20 @@ def api_chat():
         #    messages=request_dict["messages"]
         # )
         # return jsonify(response["choices"][0]["message"])
-        return jsonify(message)
     elif api_vendor_name.lower() == "google":
         message = google_request(request_dict)
-        return jsonify(message)
+
+    # In a saved conversation the server keeps the history, so store this turn
+    if "conversation" in request_dict:
+        return store_chat_turn(request_dict["conversation"], message)
+    return jsonify(message)
 
 # DALLE-3 image generation API
 
 
 @api_bp.route('/api/dalle', methods=['POST'])
 @require_api_key
+@rate_limit("dalle")
 def api_dalle():
     """
     Generate an image using DALLE-3
@@ -1203,13 +1511,14 @@ def api_dalle():
     """
     request_dict = ai_request(request)
     prompt = request_dict["prompt"]
-    response = openai.Image.create(
-        model="dall-e-3",
-        prompt=prompt,
-        size="1024x1024",
-        quality="standard",
-        n=1
-    )
+    with observe_vendor("openai", "dall-e-3"):
+        response = openai_sdk().Image.create(
+            model="dall-e-3",
+            prompt=prompt,
+            size="1024x1024",
+            quality="standard",
+            n=1
+        )
     # DALL-E-3 returns a response that includes an image URL. The front-end knows what to do with it.
     return jsonify(response)
 
@@ -1219,34 +1528,216 @@ def api_dalle():
 @api_bp.route('/api/history', methods=['POST'])
 @require_api_key
 @require_clerk_session
+@rate_limit("default")
+@read_replica
 def api_history(user):
     # api_bp.logger.debug(f'fetching history for user id: {user.id}')
-    history = ConversationHistory.query.filter_by(user_id=user.id).order_by(
-        ConversationHistory.timestamp.desc()).all()
+    history = ConversationHistory.query.filter_by(user_id=user.id).options(
+        selectinload(ConversationHistory.messages)).order_by(ConversationHistory.timestamp.desc()).all()
     histories = []
     for h in history:
         histories.append(h.to_dict())
         # api_bp.logger.debug(h.title)
     return jsonify(histories)
 
-# Save chat as a history object
+# Export all of the current user's chats as NDJSON
 
 
-@api_bp.route('/api/save_chat', methods=['POST'])
+@api_bp.route('/api/history/export', methods=['POST'])
 @require_api_key
 @require_clerk_session
-def save_chat(user):
-    request_json = request.get_json()
-    chat_json = jsonify(request_json)
-    chat_json_string = chat_json.get_data(as_text=True)
+@rate_limit("default")
+@read_replica
+def api_history_export(user):
+    """
+    Export Saved Chats
+    ---
+    tags:
+      - History
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - name: Accept-Encoding
+        in: header
+        type: string
+        description: gzip (or br, zstd where installed) to receive the export compressed
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            sessionId:
+              type: string
+            userId:
+              type: string
+    responses:
+      200:
+        description: The user's chats, newest first, one JSON object per line. The response is streamed.
+        examples:
+          application/x-ndjson: |
+            {"id":12,"title":"Planning the database migration","timestamp":"2025-01-16T16:04:00","message_count":2,"messages":[{"role":"user","content":"..."},{"role":"assistant","content":"..."}]}
+      401:
+        description: Unauthorized, invalid or missing API key
+    """
+    response = Response(stream_with_context(export_conversations(user.id)), mimetype=NDJSON_MIMETYPE)
+    response.headers["Content-Disposition"] = "attachment; filename=history.ndjson"
+    return response
+
+# Full-text search over the user's saved chats
+
 
+@api_bp.route('/api/history/search', methods=['POST'])
+@require_api_key
+@require_clerk_session
+@rate_limit("default")
+def api_history_search(user):
+    """
+    Search Saved Chats
+    ---
+    tags:
+      - History
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            sessionId:
+              type: string
+            userId:
+              type: string
+            query:
+              type: string
+              description: Words to find in chat titles and messages
+            page:
+              type: integer
+              default: 1
+            perPage:
+              type: integer
+              default: 20
+    responses:
+      200:
+        description: Matching chats, best match first, with highlighted snippets
+        examples:
+          application/json: {"results": [{"id": 12, "title": "Planning the database migration", "timestamp": "2025-01-16T16:04:00", "rank": 0.6, "snippet": "...add an index in the <mark>migration</mark>..."}], "page": 1, "perPage": 20, "hasMore": false}
+      400:
+        description: Missing query or invalid paging
+      401:
+        description: Unauthorized, invalid or missing API key
+    """
+    request_json = request.get_json() or {}
+    query = request_json.get("query")
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({"message": "query is required"}), 400
+    try:
+        page = int(request_json.get("page", 1))
+        per_page = int(request_json.get("perPage", 20))
+    except (TypeError, ValueError):
+        return jsonify({"message": "page and perPage must be integers"}), 400
+    if page < 1 or not 1 <= per_page <= MAX_SEARCH_PAGE_SIZE:
+        return jsonify({"message": f"page must be >= 1 and perPage between 1 and {MAX_SEARCH_PAGE_SIZE}"}), 400
+
+    # One extra row tells whether there is a next page without counting all matches.
+    results = search_conversations(user.id, query, limit=per_page + 1, offset=(page - 1) * per_page)
+    return jsonify({"results": results[:per_page], "page": page, "perPage": per_page,
+                    "hasMore": len(results) > per_page})
+
+# Semantic search: chats about the same topic, even without shared keywords
+
+
+@api_bp.route('/api/history/semantic-search', methods=['POST'])
+@require_api_key
+@require_clerk_session
+@rate_limit("default")
+def api_history_semantic_search(user):
+    """
+    Semantic Search Over Saved Chats
+    ---
+    tags:
+      - History
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            sessionId:
+              type: string
+            userId:
+              type: string
+            query:
+              type: string
+              description: A description of the chat to find
+            limit:
+              type: integer
+              default: 10
+    responses:
+      200:
+        description: The most similar chats, best match first
+        examples:
+          application/json: {"results": [{"id": 12, "title": "Planning the database migration", "timestamp": "2025-01-16T16:04:00", "score": 0.42}]}
+      400:
+        description: Missing query or invalid limit
+      401:
+        description: Unauthorized, invalid or missing API key
+      404:
+        description: Semantic search is not enabled
+    """
+    if not semantic_enabled():
+        return jsonify({"message": "Semantic search is not enabled"}), 404
+    request_json = request.get_json() or {}
+    query = request_json.get("query")
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({"message": "query is required"}), 400
+    try:
+        limit = int(request_json.get("limit", 10))
+    except (TypeError, ValueError):
+        return jsonify({"message": "limit must be an integer"}), 400
+    if not 1 <= limit <= MAX_SEARCH_PAGE_SIZE:
+        return jsonify({"message": f"limit must be between 1 and {MAX_SEARCH_PAGE_SIZE}"}), 400
+
+    # Extra candidates make up for deleted chats, which stay in the index until a reindex.
+    matches = semantic_search(user.id, query, limit=limit * 2)
+    conversations = {conversation.id: conversation for conversation in ConversationHistory.query.filter(
+        ConversationHistory.user_id == user.id,
+        ConversationHistory.id.in_([conversation_id for conversation_id, _ in matches]),
+    ).options(load_only(ConversationHistory.title, ConversationHistory.timestamp))}
+    results = [{
+        "id": conversation_id,
+        "title": conversations[conversation_id].title,
+        "timestamp": conversations[conversation_id].timestamp.isoformat(),
+        "score": round(score, 6),
+    } for conversation_id, score in matches if conversation_id in conversations]
+    return jsonify({"results": results[:limit]})
+
+# Title a new saved chat with the user's summary model
+
+
+def generate_chat_title(user, chat_json_string):
+    """Asks the user's summary model for a one sentence title. Returns the title and the model used."""
     summary_model = get_summary_model(user.id)
     if summary_model:
         summary_model_name = summary_model.api_name
         api_vendor = summary_model.api_vendor.name
     else:
         summary_model_name = "gpt-4o-mini"
-        api_vendor_name = "openai"
+        api_vendor = "openai"
 
     # Ask ChatGPT to summerize the conversation as a single sentence and use for the conversation title.
     system_prompt = "You are an expert at taking in OpenAI API JSON chat requests and coming up with a brief one sentance title for the chat history."
@@ -1265,17 +1756,63 @@ def save_chat(user):
         response = openai_request(request_dict)
     elif api_vendor.lower() == "google":
         response = google_request(request_dict)
-    title = response["content"]
-
-    # Save the conversation
-    conversation_history_entry = ConversationHistory(
-        user_id=user.id,
-        title=title,
-        conversation=chat_json_string  # Or however you want to format the content
-    )
-    db.session.add(conversation_history_entry)
-    db.session.commit()
-    return jsonify({"message": f"Successfully saved chat: {title} using {summary_model_name}"}), 201
+    return response["content"], summary_model_name
+
+
+# Save chat as a history object. Without a conversationId a new conversation is
+# created and titled. With one, only the messages past the stored ones are
+# appended: either send the whole chat, or send just the new messages together
+# with baseSequence, the number of messages the client knows to be stored.
+
+
+@api_bp.route('/api/save_chat', methods=['POST'])
+@require_api_key
+@require_clerk_session
+@rate_limit("default")
+def save_chat(user):
+    request_json = request.get_json()
+    messages = request_json.get("messages")
+    if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+        return jsonify({"message": "messages must be a list of message objects"}), 400
+
+    conversation_id = request_json.get("conversationId")
+    if conversation_id is None:
+        # The body as the client sent it, rather than re-encoding the parsed JSON
+        title, summary_model_name = generate_chat_title(user, request.get_data(as_text=True))
+
+        conversation_history_entry = ConversationHistory(user_id=user.id, title=title)
+        conversation_history_entry.append_messages(messages)
+        db.session.add(conversation_history_entry)
+        db.session.commit()
+        return jsonify({"message": f"Successfully saved chat: {title} using {summary_model_name}",
+                        "conversationId": conversation_history_entry.id,
+                        "messageCount": conversation_history_entry.message_count}), 201
+
+    # Locks the row so concurrent saves of one chat append in turn (PostgreSQL)
+    conversation = ConversationHistory.query.filter_by(id=conversation_id, user_id=user.id) \
+        .with_for_update().first()
+    if conversation is None:
+        return jsonify({"message": "Conversation not found"}), 404
+    base_sequence = request_json.get("baseSequence")
+    if base_sequence is None:
+        new_messages = messages[conversation.message_count:]
+    elif base_sequence == conversation.message_count:
+        new_messages = messages
+    else:
+        db.session.rollback()
+        return jsonify({"message": "baseSequence does not match the stored conversation",
+                        "messageCount": conversation.message_count}), 409
+
+    conversation.append_messages(new_messages)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another save appended the same sequence numbers first
+        db.session.rollback()
+        return jsonify({"message": "The conversation was saved concurrently, retry"}), 409
+    return jsonify({"message": f"Successfully saved chat: {conversation.title}",
+                    "conversationId": conversation.id,
+                    "messageCount": conversation.message_count}), 200
 
 # Delete a histroy object
 
@@ -1283,6 +1820,7 @@ def save_chat(user):
 @api_bp.route("/api/history/delete/<int:id>", methods=["POST"])
 @require_api_key
 @require_clerk_session
+@rate_limit("default")
 def api_delete_history(id, user):
     try:
         chat = ConversationHistory.query.get(id)
@@ -1303,9 +1841,8 @@ def api_delete_history(id, user):
 @api_bp.route('/api/user-settings', methods=['POST'])
 @require_api_key
 @require_clerk_session
+@rate_limit("default")
 def api_get_user_settings(user):
-    print("Fetching user settings")
-    print(user.id)
     """
     Get User Settings
     ---
@@ -1330,12 +1867,7 @@ def api_get_user_settings(user):
         description: An unexpected error occurred
     """
     try:
-        settings = UserSettings.query.filter_by(user_id=user.id).first()
-        if not settings:
-            settings = UserSettings(user_id=user.id)
-            db.session.add(settings)
-            db.session.commit()
-            settings = UserSettings.query.filter_by(user_id=user.id).first()
+        settings = get_or_create_user_settings(user.id)
         return jsonify(settings.to_dict()), 200
     except Exception as e:
         return jsonify({"message": "An unexpected error occurred."}), 500
@@ -1346,6 +1878,7 @@ def api_get_user_settings(user):
 @api_bp.route('/api/user-settings/<int:setting_id>', methods=['PUT'])
 @require_api_key
 # @require_clerk_session
+@rate_limit("default")
 def api_update_user_settings(setting_id):
     """
     Create or Update User Settings
@@ -1381,12 +1914,10 @@ def api_update_user_settings(setting_id):
       500:
         description: An unexpected error occurred
     """
-    print("Updating user settings")
-    print(request)
     try:
-        print(request)
         request_json = request.get_json()
-        print(request_json)
+        logger.debug("Updating user settings %s: %s", setting_id,
+                     sorted(request_json) if request_json else None)
 
         if not request_json:
             return jsonify({"message": "No input data provided"}), 400
@@ -1405,3 +1936,237 @@ def api_update_user_settings(setting_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "An unexpected error occurred."}), 500
+
+# Admin
+
+# Token usage totals from the usage ledger
+
+
+@api_bp.route('/api/admin/usage', methods=['POST'])
+@require_api_key
+@require_clerk_session
+@rate_limit("default")
+@require_admin
+@read_replica
+def api_admin_usage(user):
+    """
+    Get Token Usage Totals
+    ---
+    tags:
+      - Admin
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - in: body
+        name: body
+        description: Clerk session of an admin user plus optional filters
+        required: true
+        schema:
+          type: object
+          properties:
+            sessionId:
+              type: string
+            userId:
+              type: string
+            start:
+              type: string
+              description: ISO 8601 timestamp, inclusive
+            end:
+              type: string
+              description: ISO 8601 timestamp, exclusive
+            groupBy:
+              type: array
+              items:
+                type: string
+                enum: [user, model, vendor, day]
+          example:
+            sessionId: "sess_123"
+            userId: "user_123"
+            start: "2025-01-01T00:00:00"
+            groupBy: ["user", "model"]
+    responses:
+      200:
+        description: Returns token totals per group. Usage is written in batches, so the last few seconds may be missing.
+        examples:
+          application/json: [{"user_id": 1, "model_api_name": "gpt-4o", "requests": 12, "input_tokens": 5400, "output_tokens": 2100, "thinking_tokens": 0, "cached_tokens": 0}]
+      400:
+        description: Invalid filters
+      401:
+        description: Unauthorized, invalid or missing API key
+      403:
+        description: The user is not an admin
+    """
+    request_json = request.get_json()
+    group_by = request_json.get("groupBy") or ["user", "model"]
+    if any(group not in USAGE_GROUPS for group in group_by):
+        return jsonify({"message": f"groupBy must only contain {', '.join(USAGE_GROUPS)}"}), 400
+    start = parse_datetime_arg(request_json.get("start"), "start")
+    end = parse_datetime_arg(request_json.get("end"), "end")
+    return jsonify(aggregate_usage(start, end, group_by))
+
+# Request counts, tokens and latency percentiles from the hourly usage rollups
+
+
+@api_bp.route('/api/admin/analytics', methods=['POST'])
+@require_api_key
+@require_clerk_session
+@rate_limit("default")
+@require_admin
+@read_replica
+def api_admin_analytics(user):
+    """
+    Get Usage Analytics
+    ---
+    tags:
+      - Admin
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - in: body
+        name: body
+        description: Clerk session of an admin user plus optional filters
+        required: true
+        schema:
+          type: object
+          properties:
+            sessionId:
+              type: string
+            userId:
+              type: string
+            start:
+              type: string
+              description: ISO 8601 timestamp, inclusive, rounded down to the hour
+            end:
+              type: string
+              description: ISO 8601 timestamp, exclusive, rounded up to the hour
+            groupBy:
+              type: array
+              items:
+                type: string
+                enum: [user, model, vendor, day, hour]
+          example:
+            sessionId: "sess_123"
+            userId: "user_123"
+            start: "2025-01-01T00:00:00"
+            groupBy: ["day", "model"]
+    responses:
+      200:
+        description: Returns request counts, token totals and latency percentiles (in ms, within 2%) per group. Hours up to rolledUntil come from the rollups, later ones from the usage ledger.
+        examples:
+          application/json: {"rolledUntil": "2025-01-02T10:00:00", "groups": [{"day": "2025-01-01", "model_api_name": "gpt-4o", "requests": 12, "input_tokens": 5400, "output_tokens": 2100, "thinking_tokens": 0, "cached_tokens": 0, "latency_ms": {"p50": 1830.2, "p90": 4120.5, "p95": 5010.0, "p99": 7250.9}}]}
+      400:
+        description: Invalid filters
+      401:
+        description: Unauthorized, invalid or missing API key
+      403:
+        description: The user is not an admin
+    """
+    request_json = request.get_json()
+    group_by = request_json.get("groupBy") or ["day", "model"]
+    if any(group not in ANALYTICS_GROUPS for group in group_by):
+        return jsonify({"message": f"groupBy must only contain {', '.join(ANALYTICS_GROUPS)}"}), 400
+    start = parse_datetime_arg(request_json.get("start"), "start")
+    end = parse_datetime_arg(request_json.get("end"), "end")
+    return jsonify(usage_analytics(start, end, group_by))
+
+# Request profiles written by the opt-in profiler in app/profiling.py
+
+
+@api_bp.route('/api/admin/profiles', methods=['POST'])
+@require_api_key
+@require_clerk_session
+@rate_limit("default")
+@require_admin
+def api_admin_profiles(user):
+    """
+    List Request Profiles
+    ---
+    tags:
+      - Admin
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - in: body
+        name: body
+        description: Clerk session of an admin user
+        required: true
+        schema:
+          type: object
+          properties:
+            sessionId:
+              type: string
+            userId:
+              type: string
+    responses:
+      200:
+        description: Returns the saved profiles, newest first
+        examples:
+          application/json: [{"name": "20250101T120000-api.api_chat-3f2a.prof", "size": 48213, "created": "2025-01-01T12:00:00Z"}]
+      401:
+        description: Unauthorized, invalid or missing API key
+      403:
+        description: The user is not an admin
+      404:
+        description: Profiling is not enabled
+    """
+    if not current_app.config.get("PROFILE_ENABLED"):
+        return jsonify({"message": "Profiling is not enabled"}), 404
+    return jsonify(list_profiles())
+
+
+@api_bp.route('/api/admin/profiles/<string:name>', methods=['POST'])
+@require_api_key
+@require_clerk_session
+@rate_limit("default")
+@require_admin
+def api_admin_profile_download(name, user):
+    """
+    Download a Request Profile
+    ---
+    tags:
+      - Admin
+    parameters:
+      - name: name
+        in: path
+        type: string
+        required: true
+        description: Profile name, as returned in the X-Profile-Id header or the profile list
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: API key (Bearer Token)
+      - in: body
+        name: body
+        description: Clerk session of an admin user
+        required: true
+        schema:
+          type: object
+          properties:
+            sessionId:
+              type: string
+            userId:
+              type: string
+    responses:
+      200:
+        description: The profile, a cProfile .prof file or a pyinstrument .html report
+      401:
+        description: Unauthorized, invalid or missing API key
+      403:
+        description: The user is not an admin
+      404:
+        description: Profiling is not enabled or the profile does not exist
+    """
+    path = profile_path(name) if current_app.config.get("PROFILE_ENABLED") else None
+    if path is None:
+        return jsonify({"message": "Profile not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
@@ -0,0 +1,100 @@
+"""
+apikeys.py
+----------
+
+Issuing, rotating and checking API keys.
+
+Keys are 64 random letters and digits. Only their SHA-256 is stored
+(`APIKey.key_hash`), so the request path hashes the bearer token and looks the
+hash up; the plaintext is returned once, to whoever issued the key. Keys may
+expire: `expires_at` is checked on every request.
+
+Rotation issues a new key under the same name and lets the old ones live on
+for an overlap period, so clients can be moved over before they stop working.
+
+Functions:
+- `generate_api_key(length)`: A new random key.
+- `find_api_key(token)`: The active key matching a bearer token, or None.
+- `issue_api_keys(names, expires_at)`: Creates one key per name in one transaction.
+- `rotate_api_keys(names, overlap, expires_at)`: Replaces the active keys of each name.
+- `key_manifest(issued, expiring)`: The JSON-ready manifest of an issue or rotation.
+"""
+
+import secrets
+import string
+from datetime import datetime
+
+from .model import APIKey, db
+
+ALPHABET = (string.ascii_letters + string.digits).encode()
+# Random bytes at or above this are dropped so every character is equally likely.
+_UNBIASED_LIMIT = 256 - 256 % len(ALPHABET)
+_DROP_BIASED = bytes(range(_UNBIASED_LIMIT, 256))
+_TO_ALPHABET = bytes(ALPHABET[byte % len(ALPHABET)] for byte in range(256))
+
+
+def generate_api_key(length=64):
+    """
+    Returns a key of `length` letters and digits from the OS CSPRNG. Random
+    bytes are mapped onto the alphabet with bytes.translate instead of a
+    `secrets.choice` call per character.
+    """
+    key = b""
+    while len(key) < length:
+        key += secrets.token_bytes(length).translate(None, _DROP_BIASED)
+    return key[:length].translate(_TO_ALPHABET).decode()
+
+
+def find_api_key(token):
+    if not token:
+        return None
+    key = APIKey.query.filter_by(key_hash=APIKey.hash(token)).first()
+    if key is None or not key.is_active():
+        return None
+    return key
+
+
+def issue_api_keys(names, expires_at=None, length=64):
+    """
+    Creates a key for each name in `names` (repeat a name for several keys) and
+    commits them together. Returns the new APIKey rows; their `key` attribute
+    holds the plaintext until they are discarded.
+    """
+    keys = [APIKey(name=name, key=generate_api_key(length), expires_at=expires_at) for name in names]
+    db.session.add_all(keys)
+    db.session.commit()
+    return keys
+
+
+def rotate_api_keys(names, overlap, expires_at=None, length=64):
+    """
+    Issues a new key for each name and makes the name's currently active keys
+    expire `overlap` (a timedelta) from now, or keeps their expiry if it is
+    sooner. One transaction. Returns (new keys, replaced keys).
+    """
+    now = datetime.utcnow()
+    retire_at = now + overlap
+    replaced = [key for key in APIKey.query.filter(APIKey.name.in_(names)).order_by(APIKey.id)
+                if key.is_active(now)]
+    for key in replaced:
+        if key.expires_at is None or key.expires_at > retire_at:
+            key.expires_at = retire_at
+    keys = [APIKey(name=name, key=generate_api_key(length), expires_at=expires_at) for name in names]
+    db.session.add_all(keys)
+    db.session.commit()
+    return keys, replaced
+
+
+def _timestamp(value):
+    return value.isoformat() + "Z" if value else None
+
+
+def key_manifest(issued, expiring=()):
+    return {
+        "generated_at": _timestamp(datetime.utcnow()),
+        "keys": [{"id": key.id, "name": key.name, "key": key.key,
+                  "created_at": _timestamp(key.created_at), "expires_at": _timestamp(key.expires_at)}
+                 for key in issued],
+        "expiring": [{"id": key.id, "name": key.name, "expires_at": _timestamp(key.expires_at)}
+                     for key in expiring],
+    }
@@ -0,0 +1,276 @@
+"""
+bulk.py
+-------
+
+Bulk import and export of the editable catalogs (personas, models and output
+formats), for provisioning a deployment in one request instead of one POST per
+row.
+
+Rows are matched on their natural key rather than their id, so the same file
+can be imported into any deployment and imported again without duplicating
+anything. The keys are unique in the database:
+
+- personas and output formats: `name`
+- models: `api_name` and `name` (one api_name can back several models, e.g. a
+  text and a vision variant)
+
+References are written by name (`api_vendor`, `render_type`) so exports do not
+depend on ids either; `api_vendor_id` and `render_type_id` are accepted too.
+
+An import is validated as a whole before anything is written, and every
+invalid row is reported with its position. A valid batch is written in one
+transaction: the existing rows are read with one query per batch, then the
+changed ones are updated and the new ones inserted with executemany
+statements. Rows that already match are left alone, so re-importing a file is
+a no-op. The inserts are INSERT ... ON CONFLICT on the key, so a row another
+import or request created after it was read is updated (or left alone)
+instead of failing the batch. The catalog cache is invalidated once, after
+the commit.
+
+Functions:
+- `parse_rows(body, mimetype)`: Reads a JSON array or NDJSON request body.
+- `import_rows(catalog, rows)`: Validates and upserts rows into a catalog, and commits.
+- `upsert_catalog(catalog, rows, update_existing)`: The same within the caller's transaction.
+- `validate_rows(catalog, rows)`: Checks rows and resolves their references.
+- `export_rows(catalog)`: Yields a catalog's rows in import format.
+- `upsert(model, key, rows, defaults, update_existing)`: Updates or inserts plain row dicts by natural key.
+
+Classes:
+- `BulkImportError`: Raised with per-row errors when a batch does not validate.
+"""
+
+import orjson
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .catalog import invalidate_catalogs
+from .model import APIVendor, Model, OutputFormat, Persona, RenderType, db
+from .replica import mark_write
+
+MAX_ROWS = 5000
+# Rows per executemany statement and natural keys per lookup query.
+BATCH_SIZE = 500
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+CATALOGS = {
+    "personas": {
+        "model": Persona,
+        "key": ("name",),
+        "fields": {"name": (str, True, 255), "prompt": (str, True, None)},
+    },
+    "models": {
+        "model": Model,
+        "key": ("api_name", "name"),
+        "fields": {
+            "api_name": (str, True, 255),
+            "name": (str, True, 255),
+            "is_vision": (bool, False, None),
+            "is_image_generation": (bool, False, None),
+            "is_thinking": (bool, False, None),
+        },
+        "reference": ("api_vendor", "api_vendor_id", APIVendor, True),
+        # Values new rows get for the flags an import leaves out
+        "defaults": {"is_vision": False, "is_image_generation": False, "is_thinking": False},
+    },
+    "output-formats": {
+        "model": OutputFormat,
+        "key": ("name",),
+        "fields": {"name": (str, True, 255), "prompt": (str, True, None)},
+        "reference": ("render_type", "render_type_id", RenderType, False),
+    },
+}
+
+
+class BulkImportError(Exception):
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid rows")
+        self.errors = errors
+
+
+def parse_rows(body, mimetype):
+    """
+    Parses a request body holding a JSON array of objects, or NDJSON (one object
+    per line) when `mimetype` is application/x-ndjson. Raises BulkImportError.
+    """
+    if mimetype == NDJSON_MIMETYPE:
+        rows = []
+        for number, line in enumerate(body.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(orjson.loads(line))
+            except orjson.JSONDecodeError as e:
+                raise BulkImportError([{"row": number, "errors": [f"Invalid JSON: {e}"]}])
+        return rows
+    try:
+        rows = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise BulkImportError([{"row": None, "errors": [f"Invalid JSON: {e}"]}])
+    if not isinstance(rows, list):
+        raise BulkImportError([{"row": None, "errors": ["Expected a JSON array of objects"]}])
+    return rows
+
+
+def _validate(spec, row, references):
+    if not isinstance(row, dict):
+        return None, ["Expected an object"]
+    errors, values = [], {}
+    for field, (kind, required, max_length) in spec["fields"].items():
+        value = row.get(field)
+        if value is None:
+            if required:
+                errors.append(f"'{field}' is required")
+            continue
+        if not isinstance(value, kind) or (kind is str and not value.strip()):
+            errors.append(f"'{field}' must be a {'non-empty string' if kind is str else 'boolean'}")
+        elif max_length and len(value) > max_length:
+            errors.append(f"'{field}' is longer than {max_length} characters")
+        else:
+            values[field] = value
+
+    if "reference" in spec:
+        name_field, id_field, _, required = spec["reference"]
+        if row.get(name_field) is not None:
+            reference_id = references.get(row[name_field]) if isinstance(row[name_field], str) else None
+            if reference_id is None:
+                errors.append(f"Unknown {name_field} {row[name_field]!r}")
+            values[id_field] = reference_id
+        elif row.get(id_field) is not None:
+            if row[id_field] not in set(references.values()):
+                errors.append(f"Unknown {id_field} {row[id_field]!r}")
+            values[id_field] = row[id_field]
+        elif required:
+            errors.append(f"'{name_field}' or '{id_field}' is required")
+    return values, errors
+
+
+def _key(row, key):
+    return tuple(row[field] for field in key)
+
+
+def _insert_statement(model, key, fields, update_existing):
+    """INSERT ... ON CONFLICT on the `key` columns, updating the other `fields` or doing nothing."""
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    statement = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(model)
+    index_elements = [getattr(model, field) for field in key]
+    updated = {field: statement.excluded[field] for field in fields if field not in key}
+    if update_existing and updated:
+        return statement.on_conflict_do_update(index_elements=index_elements, set_=updated)
+    return statement.on_conflict_do_nothing(index_elements=index_elements)
+
+
+def upsert(model, key, rows, defaults=None, update_existing=True):
+    """
+    Updates every existing row of `model` whose `key` columns match a row in
+    `rows` and differs from it, inserts the others (with `defaults` for missing
+    columns), and returns the number of rows inserted, updated and unchanged.
+    With `update_existing=False` existing rows are left alone and counted as
+    unchanged, like INSERT ... ON CONFLICT DO NOTHING.
+    The `key` columns must be unique. A row inserted concurrently after the
+    lookup is updated (or left alone) by the insert's ON CONFLICT clause; it
+    is counted as inserted.
+    Runs in the current transaction without committing, and bypasses the unit
+    of work, so session hooks do not see the rows; the write is recorded for
+    read-replica routing explicitly.
+    """
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    columns = [getattr(model, field) for field in fields]
+    key_column = getattr(model, key[0])
+    existing = {}
+    for start in range(0, len(rows), BATCH_SIZE):
+        first_values = {row[key[0]] for row in rows[start:start + BATCH_SIZE]}
+        for found in db.session.execute(select(model.id, *columns).where(key_column.in_(first_values))):
+            stored = dict(zip(fields, found[1:]))
+            existing[_key(stored, key)] = (found.id, stored)
+
+    updates, inserts, unchanged = [], {}, 0
+    for row in rows:
+        match = existing.get(_key(row, key))
+        if match is None:
+            row = {**defaults, **row} if defaults else row
+            # Grouped by the columns they set, so ON CONFLICT only overwrites those
+            inserts.setdefault(tuple(row), []).append(row)
+        elif not update_existing:
+            unchanged += 1
+        elif any(match[1][field] != value for field, value in row.items()):
+            updates.append({**row, "id": match[0]})
+        else:
+            unchanged += 1
+    if updates or inserts:
+        mark_write()
+    for start in range(0, len(updates), BATCH_SIZE):
+        db.session.execute(update(model), updates[start:start + BATCH_SIZE])
+    for insert_fields, group in inserts.items():
+        statement = _insert_statement(model, key, insert_fields, update_existing)
+        for start in range(0, len(group), BATCH_SIZE):
+            db.session.execute(statement, group[start:start + BATCH_SIZE])
+    inserted = sum(len(group) for group in inserts.values())
+    return {"inserted": inserted, "updated": len(updates), "unchanged": unchanged}
+
+
+def validate_rows(catalog, rows):
+    """
+    Checks `rows` for the named catalog and returns them as column values, with
+    references resolved to ids. Raises BulkImportError listing every invalid row.
+    """
+    spec = CATALOGS[catalog]
+    if len(rows) > MAX_ROWS:
+        raise BulkImportError([{"row": None, "errors": [f"At most {MAX_ROWS} rows per import"]}])
+    references = {}
+    if "reference" in spec:
+        reference_model = spec["reference"][2]
+        references = dict(db.session.execute(select(reference_model.name, reference_model.id)).all())
+
+    errors, valid, seen = [], [], set()
+    for number, row in enumerate(rows, start=1):
+        values, row_errors = _validate(spec, row, references)
+        if not row_errors:
+            row_key = _key(values, spec["key"])
+            if row_key in seen:
+                row_errors.append(f"Duplicate of an earlier row with the same {' and '.join(spec['key'])}")
+            seen.add(row_key)
+        if row_errors:
+            errors.append({"row": number, "errors": row_errors})
+        else:
+            valid.append(values)
+    if errors:
+        raise BulkImportError(errors)
+    return valid
+
+
+def upsert_catalog(catalog, rows, update_existing=True):
+    """Validates and upserts rows into the named catalog, without committing."""
+    spec = CATALOGS[catalog]
+    return upsert(spec["model"], spec["key"], validate_rows(catalog, rows), spec.get("defaults"), update_existing)
+
+
+def import_rows(catalog, rows):
+    """
+    Validates `rows` for the named catalog and upserts them in one transaction.
+    Returns the number of rows inserted, updated and unchanged; raises
+    BulkImportError with every row's errors, before writing anything, if any
+    row is invalid.
+    """
+    try:
+        result = upsert_catalog(catalog, rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_catalogs()
+    return result
+
+
+def export_rows(catalog):
+    """Yields the rows of the named catalog as dicts in the format import_rows takes."""
+    spec = CATALOGS[catalog]
+    model = spec["model"]
+    columns = [getattr(model, field) for field in spec["fields"]]
+    statement = select(*columns).order_by(model.id)
+    if "reference" in spec:
+        name_field, id_field, reference_model, _ = spec["reference"]
+        statement = statement.add_columns(reference_model.name.label(name_field)).outerjoin(
+            reference_model, getattr(model, id_field) == reference_model.id)
+    for row in db.session.execute(statement.execution_options(yield_per=BATCH_SIZE)):
+        yield dict(row._mapping)
@@ -0,0 +1,123 @@
+"""
+catalog.py
+----------
+
+In-process cache of the serialized catalog lists (personas, models, output
+formats, render types and API vendors). The catalogs are small, read on every
+client start and rarely edited, so each list is rendered to JSON once and the
+same bytes are served until it expires or a catalog row changes.
+
+Committing a session that inserted, updated or deleted a catalog row bumps the
+catalog version, which empties this process' cache. Other workers pick the
+change up when their entries expire after `CATALOG_CACHE_TTL` seconds; a TTL of 0
+disables the cache. Under a pre-forking server the catalogs are loaded in the
+master before fork (see app/prefork.py), so workers start warm and share the
+cached bytes copy-on-write.
+
+Functions:
+- `init_catalog(app)`: Configures the TTL and installs the invalidation hooks.
+- `catalog_json(name)`: The JSON list for one catalog, from the cache when fresh.
+- `catalog_response(name)`: An application/json response for one catalog.
+- `warm_catalogs()`: Loads every catalog into the cache. Needs an app context.
+- `invalidate_catalogs()`: Empties the cache and bumps the catalog version.
+- `catalog_version()`: Number of invalidations so far in this process.
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import selectinload
+
+from .model import APIVendor, Model, OutputFormat, Persona, RenderType
+from .replica import RoutingSession
+from .utils import (api_vendors_json, models_json, output_formats_json,
+                    personas_json, render_types_json)
+
+CATALOG_MODELS = (APIVendor, Model, OutputFormat, Persona, RenderType)
+
+CATALOGS = {
+    "personas": lambda: personas_json(Persona.query.all()),
+    "models": lambda: models_json(Model.query.order_by(Model.id).all()),
+    "output_formats": lambda: output_formats_json(
+        OutputFormat.query.options(selectinload(OutputFormat.render_type)).order_by(OutputFormat.id).all()),
+    "render_types": lambda: render_types_json(RenderType.query.all()),
+    "api_vendors": lambda: api_vendors_json(APIVendor.query.all()),
+}
+
+_ttl = 0
+_lock = threading.Lock()
+_entries = {}
+_version = 0
+
+
+def catalog_version():
+    return _version
+
+
+def invalidate_catalogs():
+    global _version
+    with _lock:
+        _version += 1
+        _entries.clear()
+
+
+def catalog_json(name):
+    if _ttl <= 0:
+        return CATALOGS[name]()
+    entry = _entries.get(name)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    version = _version
+    body = CATALOGS[name]()
+    with _lock:
+        # Skip storing a list read before a concurrent invalidation.
+        if version == _version:
+            _entries[name] = (time.monotonic() + _ttl, body)
+    return body
+
+
+def catalog_response(name):
+    return current_app.response_class(catalog_json(name), mimetype="application/json")
+
+
+def warm_catalogs():
+    for name in CATALOGS:
+        catalog_json(name)
+
+
+def reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+
+
+def _note_catalog_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CATALOG_MODELS):
+            session.info["catalog_changed"] = True
+            return
+
+
+def _after_commit(session):
+    if session.info.pop("catalog_changed", False):
+        invalidate_catalogs()
+
+
+def _after_rollback(session):
+    session.info.pop("catalog_changed", None)
+
+
+_session_hooks_installed = False
+
+
+def init_catalog(app):
+    global _ttl, _session_hooks_installed
+
+    _ttl = app.config.get("CATALOG_CACHE_TTL", 0)
+    invalidate_catalogs()
+    if not _session_hooks_installed:
+        event.listen(RoutingSession, "after_flush", _note_catalog_changes)
+        event.listen(RoutingSession, "after_commit", _after_commit)
+        event.listen(RoutingSession, "after_rollback", _after_rollback)
+        _session_hooks_installed = True
@@ -0,0 +1,219 @@
+"""
+commands.py
+-----------
+
+Flask CLI commands.
+
+Commands:
+- `flask import-report`: Boots the app in a fresh interpreter under
+  `python -X importtime` and reports where the start-up time goes.
+- `flask search-reindex`: Rebuilds the full-text index over saved conversations
+  (app/search.py), e.g. after the migration that adds it.
+- `flask semantic-reindex`: Re-embeds all saved conversations into the semantic
+  search index (app/semantic.py), e.g. after changing the embedder.
+- `flask seed`: Inserts the missing rows of the default catalog from
+  app/data/defaults.json (app/seed.py). Safe to run on every deploy; `--force`
+  also resets existing rows to the file's values.
+- `flask analytics-rollup`: Rolls up the finished hours of the token usage
+  ledger for the admin analytics (app/analytics.py); `--since` rebuilds hours.
+- `flask keys issue NAME...`: Issues API keys (app/apikeys.py) and prints or
+  writes a manifest with the plaintext keys.
+- `flask keys rotate NAME...`: Issues replacement keys and expires the old ones
+  after an overlap period.
+
+Functions:
+- `register_commands(app)`: Adds the commands to the app's CLI.
+- `parse_importtime(output)`: Parses the `-X importtime` lines written to stderr.
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+from datetime import datetime, timedelta
+
+import click
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+BOOT_LINE = re.compile(r"^BOOT ([\d.]+) ([\d.]+)$", re.MULTILINE)
+
+# Vendor SDKs are imported on first use (app/vendors.py), never at boot.
+LAZY_MODULES = ("openai", "anthropic", "google.generativeai")
+
+BOOT_SCRIPT = """
+import time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app({config_name!r})
+print("BOOT", imported - started, time.perf_counter() - imported)
+"""
+
+
+def parse_importtime(output):
+    """
+    Returns one dict per imported module with its self and cumulative import
+    time in microseconds and its nesting depth, in import order.
+    """
+    modules = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            modules.append({
+                "module": match.group(4),
+                "self_us": int(match.group(1)),
+                "cumulative_us": int(match.group(2)),
+                "depth": (len(match.group(3)) - 1) // 2,
+            })
+    return modules
+
+
+def _write_manifest(manifest, path):
+    from .jsonprovider import dumps_bytes
+
+    data = dumps_bytes(manifest, indent=True)
+    if path is None:
+        click.echo(data.decode())
+        return
+    # The manifest holds plaintext keys: only the owner may read it
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "wb") as manifest_file:
+        manifest_file.write(data)
+    click.echo(f"Wrote {len(manifest['keys'])} keys to {path}", err=True)
+
+
+def _expiry(expires_in, expires_at):
+    if expires_in is not None and expires_at is not None:
+        raise click.UsageError("Use either --expires-in or --expires-at")
+    if expires_in is not None:
+        return datetime.utcnow() + timedelta(days=expires_in)
+    return expires_at
+
+
+def register_commands(app):
+    @app.cli.command("import-report")
+    @click.option("--config", "config_name", default=lambda: os.environ.get("FLASK_ENV", "production"),
+                  help="Configuration to boot with (default: $FLASK_ENV or production).")
+    @click.option("--top", default=15, show_default=True, help="Rows per table.")
+    def import_report(config_name, top):
+        """Report the slowest imports when the app boots in a fresh interpreter."""
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", BOOT_SCRIPT.format(config_name=config_name)],
+            capture_output=True, text=True, cwd=os.path.dirname(app.root_path),
+        )
+        boot = BOOT_LINE.search(result.stdout)
+        if result.returncode != 0 or not boot:
+            click.echo(result.stderr[-4000:], err=True)
+            raise click.ClickException("Booting the app failed")
+
+        modules = parse_importtime(result.stderr)
+        click.echo(f"import app: {float(boot.group(1)) * 1000:.1f} ms, "
+                   f"create_app({config_name!r}): {float(boot.group(2)) * 1000:.1f} ms, "
+                   f"{len(modules)} modules imported")
+
+        packages = {}
+        for module in modules:
+            root = module["module"].split(".")[0]
+            packages[root] = packages.get(root, 0) + module["self_us"]
+        click.echo("\nPackages by import time (sum of their modules' self time)")
+        for root, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            click.echo(f"{self_us / 1000:>10.1f} ms  {root}")
+
+        click.echo("\nSlowest imports (including what they import)")
+        for module in sorted(modules, key=lambda module: -module["cumulative_us"])[:top]:
+            click.echo(f"{module['cumulative_us'] / 1000:>10.1f} ms  {'  ' * module['depth']}{module['module']}")
+
+        eager = [name for name in LAZY_MODULES if any(module["module"] == name for module in modules)]
+        if eager:
+            click.echo(f"\nWarning: imported at boot although only needed on demand: {', '.join(eager)}")
+
+    @app.cli.command("search-reindex")
+    @click.option("--batch-size", default=500, show_default=True, help="Conversations loaded per batch.")
+    def search_reindex(batch_size):
+        """Rebuild the full-text search index over saved conversations."""
+        from .search import reindex_conversations
+
+        count = reindex_conversations(batch_size=batch_size)
+        click.echo(f"Indexed {count} conversations")
+
+    @app.cli.command("semantic-reindex")
+    @click.option("--batch-size", default=200, show_default=True, help="Conversations embedded per batch.")
+    def semantic_reindex(batch_size):
+        """Rebuild the semantic search index over saved conversations."""
+        from .semantic import reindex_semantic
+
+        if not app.config.get("SEMANTIC_INDEX_DIR"):
+            raise click.ClickException("SEMANTIC_INDEX_DIR is not set")
+        count = reindex_semantic(batch_size=batch_size)
+        click.echo(f"Embedded {count} conversations")
+
+    @app.cli.command("seed")
+    @click.option("--file", "path", type=click.Path(exists=True, dir_okay=False),
+                  help="Defaults file to load (default: app/data/defaults.json).")
+    @click.option("--force", is_flag=True,
+                  help="Also overwrite existing rows that differ from the file, undoing edits made since.")
+    def seed(path, force):
+        """Insert the missing default catalog rows."""
+        from .bulk import BulkImportError
+        from .seed import DEFAULTS_PATH, seed_defaults
+
+        try:
+            counts = seed_defaults(path or DEFAULTS_PATH, force=force)
+        except BulkImportError as e:
+            for error in e.errors:
+                click.echo(f"row {error['row']}: {'; '.join(error['errors'])}", err=True)
+            raise click.ClickException("The defaults file has invalid rows, nothing was written")
+        for section, count in counts.items():
+            click.echo(f"{section}: {count['inserted']} inserted, {count['updated']} updated, "
+                       f"{count['unchanged']} unchanged")
+
+    @app.cli.command("analytics-rollup")
+    @click.option("--since", type=click.DateTime(),
+                  help="Rebuild the rollups from this time (UTC) on, e.g. after fixing ledger rows.")
+    def analytics_rollup(since):
+        """Roll up the finished hours of the token usage ledger."""
+        from .analytics import rollup_usage
+
+        click.echo(f"Rolled up {rollup_usage(since=since)} hours")
+
+    @app.cli.group("keys")
+    def keys():
+        """Issue and rotate API keys."""
+
+    manifest_option = click.option(
+        "--manifest", type=click.Path(dir_okay=False),
+        help="Write the JSON manifest with the new keys to this file (mode 600) instead of stdout.")
+    expires_in_option = click.option("--expires-in", type=click.IntRange(min=1),
+                                     help="Days until the new keys expire.")
+    expires_at_option = click.option("--expires-at", type=click.DateTime(), help="When the new keys expire (UTC).")
+
+    @keys.command("issue")
+    @click.argument("names", nargs=-1, required=True)
+    @click.option("--count", default=1, show_default=True, type=click.IntRange(min=1), help="Keys per name.")
+    @expires_in_option
+    @expires_at_option
+    @click.option("--length", default=64, show_default=True, type=click.IntRange(min=32), help="Key length.")
+    @manifest_option
+    def issue(names, count, expires_in, expires_at, length, manifest):
+        """Issue new API keys, in one transaction."""
+        from .apikeys import issue_api_keys, key_manifest
+
+        issued = issue_api_keys([name for name in names for _ in range(count)],
+                                expires_at=_expiry(expires_in, expires_at), length=length)
+        _write_manifest(key_manifest(issued), manifest)
+
+    @keys.command("rotate")
+    @click.argument("names", nargs=-1, required=True)
+    @click.option("--overlap-hours", default=24, show_default=True, type=click.FloatRange(min=0),
+                  help="How long the replaced keys keep working.")
+    @expires_in_option
+    @expires_at_option
+    @manifest_option
+    def rotate(names, overlap_hours, expires_in, expires_at, manifest):
+        """Replace the active API keys of each name, keeping the old ones valid for an overlap."""
+        from .apikeys import key_manifest, rotate_api_keys
+
+        issued, replaced = rotate_api_keys(list(dict.fromkeys(names)), timedelta(hours=overlap_hours),
+                                           expires_at=_expiry(expires_in, expires_at))
+        _write_manifest(key_manifest(issued, replaced), manifest)
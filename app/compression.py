@@ -0,0 +1,257 @@
+"""
+compression.py
+--------------
+
+HTTP compression for the API blueprint, in both directions.
+
+Requests: a body sent with `Content-Encoding: gzip`, `deflate`, `br` or `zstd`
+is decoded before the view reads it. `MAX_CONTENT_LENGTH` applies to the
+compressed body. Decoding stops with 413 once the output passes
+`COMPRESSION_MAX_DECODED_SIZE` or `COMPRESSION_MAX_RATIO` times the compressed
+size, so a small bomb never gets inflated in memory. Unknown encodings get 415
+and corrupt bodies 400.
+
+Responses: JSON, NDJSON and text responses of at least `COMPRESSION_MIN_SIZE`
+bytes are compressed with the best encoding the client accepts (zstd, then br,
+then gzip). Streamed responses, such as server-sent events, are compressed
+chunk by chunk and flushed after every chunk, so events are not held back.
+
+gzip and deflate use zlib. br needs the optional `brotli` package and zstd the
+optional `zstandard` package; each is offered only when installed. br request
+bodies are only accepted with brotli >= 1.2, which can cap each step's output.
+
+Functions:
+- `init_compression(app)`: Registers the request decoding and response encoding hooks.
+- `available_encodings()`: Response encodings this process can produce, preferred first.
+- `decode_body(data, encoding, max_size)`: Decodes a request body within a size limit.
+"""
+
+import io
+import zlib
+
+from flask import abort, current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Output produced per decompression step
+DECODE_CHUNK = 64 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript")
+
+
+class DecodedTooLarge(Exception):
+    pass
+
+
+def _inflate(data, max_size, wbits):
+    decompressor = zlib.decompressobj(wbits)
+    chunks, size = [], 0
+    while not decompressor.eof:
+        chunk = decompressor.decompress(data, DECODE_CHUNK)
+        data = decompressor.unconsumed_tail
+        if not chunk and not data:
+            raise ValueError("truncated body")
+        size += len(chunk)
+        if size > max_size:
+            raise DecodedTooLarge()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _decode_gzip(data, max_size):
+    return _inflate(data, max_size, 16 + zlib.MAX_WBITS)
+
+
+def _decode_deflate(data, max_size):
+    # HTTP deflate is zlib-wrapped, but some clients send raw deflate.
+    try:
+        return _inflate(data, max_size, zlib.MAX_WBITS)
+    except zlib.error:
+        return _inflate(data, max_size, -zlib.MAX_WBITS)
+
+
+def _decode_brotli(data, max_size):
+    # A few bytes of brotli can expand to hundreds of MB in one step, so every
+    # step's output is capped; the decoder keeps the rest for the next call.
+    decompressor = brotli.Decompressor()
+    chunks, size = [], 0
+    chunk = decompressor.process(data, output_buffer_limit=DECODE_CHUNK)
+    while True:
+        size += len(chunk)
+        if size > max_size:
+            raise DecodedTooLarge()
+        chunks.append(chunk)
+        if decompressor.is_finished():
+            return b"".join(chunks)
+        if decompressor.can_accept_more_data():
+            # All input consumed and no output pending, but the stream has not ended
+            raise ValueError("truncated body")
+        chunk = decompressor.process(b"", output_buffer_limit=DECODE_CHUNK)
+
+
+def _decode_zstd(data, max_size):
+    chunks, size = [], 0
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+        while True:
+            chunk = reader.read(DECODE_CHUNK)
+            if not chunk:
+                return b"".join(chunks)
+            size += len(chunk)
+            if size > max_size:
+                raise DecodedTooLarge()
+            chunks.append(chunk)
+
+
+DECODERS = {"gzip": _decode_gzip, "x-gzip": _decode_gzip, "deflate": _decode_deflate}
+# Capping brotli's output needs brotli >= 1.2; older versions only encode responses.
+if brotli is not None and hasattr(brotli.Decompressor, "can_accept_more_data"):
+    DECODERS["br"] = _decode_brotli
+if zstandard is not None:
+    DECODERS["zstd"] = _decode_zstd
+
+
+def decode_body(data, encoding, max_size):
+    """
+    Decodes `data` sent with the given Content-Encoding. Raises KeyError for an
+    unsupported encoding, DecodedTooLarge past `max_size` decoded bytes and
+    ValueError (or a codec error) for a corrupt body.
+    """
+    return DECODERS[encoding](data, max_size)
+
+
+class _GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = _ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = _BrotliEncoder
+ENCODERS["gzip"] = _GzipEncoder
+
+
+def available_encodings():
+    return list(ENCODERS)
+
+
+def _compressible(response):
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+def _encode_stream(original, chunks, encoder):
+    try:
+        for chunk in chunks:
+            data = encoder.compress(chunk) + encoder.flush()
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        close = getattr(original, "close", None)
+        if close is not None:
+            close()
+
+
+def _decode_request():
+    encoding = request.headers.get("Content-Encoding", "").strip().lower()
+    if request.blueprint != "api" or encoding in ("", "identity"):
+        return
+    if encoding not in DECODERS:
+        abort(415, description=f"Unsupported Content-Encoding {encoding!r}, "
+                               f"expected one of {', '.join(sorted(DECODERS))}")
+    data = request.get_data()
+    config = current_app.config
+    max_size = min(config["COMPRESSION_MAX_DECODED_SIZE"],
+                   max(len(data), 1) * config["COMPRESSION_MAX_RATIO"])
+    try:
+        body = decode_body(data, encoding, max_size)
+    except DecodedTooLarge:
+        abort(413, description="Decompressed request body is too large")
+    except Exception:
+        abort(400, description=f"Request body is not valid {encoding} data")
+    # get_data() and get_json() read the cached body, which is now the decoded one.
+    request._cached_data = body
+
+
+def _encode_response(response):
+    if (request.blueprint != "api" or request.method == "HEAD" or response.direct_passthrough
+            or response.status_code in (204, 206, 304) or "Content-Encoding" in response.headers
+            or not _compressible(response)
+            or "no-transform" in response.headers.get("Cache-Control", "")):
+        return response
+    response.vary.add("Accept-Encoding")
+    streamed = response.is_streamed
+    if not streamed and response.content_length is not None \
+            and response.content_length < current_app.config["COMPRESSION_MIN_SIZE"]:
+        return response
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    encoder = ENCODERS[encoding]()
+    if streamed:
+        response.response = _encode_stream(response.response, response.iter_encoded(), encoder)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(encoder.compress(response.get_data()) + encoder.finish())
+    response.headers["Content-Encoding"] = encoding
+    if response.headers.get("ETag") and not response.headers["ETag"].startswith("W/"):
+        # The compressed body is a different representation.
+        response.headers["ETag"] = "W/" + response.headers["ETag"]
+    return response
+
+
+def init_compression(app):
+    if not app.config.get("COMPRESSION_ENABLED", True):
+        return
+    app.before_request(_decode_request)
+    app.after_request(_encode_response)
@@ -3,6 +3,26 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def engine_options(read_only=False):
+    """
+    SQLAlchemy engine options for a PostgreSQL engine, driven by environment
+    variables. Connections are checked before use and recycled before server or
+    proxy idle timeouts, and every statement gets a server-side timeout.
+    """
+    server_options = f"-c statement_timeout={int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))}"
+    if read_only:
+        server_options += " -c default_transaction_read_only=on"
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true",
+        "connect_args": {"options": server_options},
+    }
+
+
 class Config:
     """Base configuration class containing settings applicable to all environments."""
     SECRET_KEY = os.environ.get('SECRET_KEY')
@@ -12,15 +32,128 @@ class Config:
     DBHOST = os.environ.get("POSTGRES_HOST")
     DBPORT = os.environ.get("POSTGRES_PORT")
     SQLALCHEMY_DATABASE_URI= f"postgresql://{DBUSER}:{DBPASSWORD}@{DBHOST}:{DBPORT}/{DBNAME}"
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options()
+    # Optional read replica (see app/replica.py). Routes decorated with
+    # @read_replica read from it; writers are pinned to the primary for
+    # REPLICA_STICKY_SECONDS so they read their own writes.
+    SQLALCHEMY_REPLICA_URI = os.environ.get("SQLALCHEMY_REPLICA_URI")
+    SQLALCHEMY_BINDS = {
+        "replica": {"url": SQLALCHEMY_REPLICA_URI, **engine_options(read_only=True)},
+    } if SQLALCHEMY_REPLICA_URI else {}
+    REPLICA_STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", 10))
+    REPLICA_STICKY_STORAGE_URL = os.environ.get("REPLICA_STICKY_STORAGE_URL")
     SESSION_COOKIE_SECURE = bool(os.environ.get('SESSION_COOKIE_SECURE', False))
     SESSION_PERMANENT = False
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
     CLERK_SECRET = os.environ.get("CLERK_SECRET")
+    # Swagger UI at /apidocs. Turning it off also skips importing flasgger at boot.
+    SWAGGER_ENABLED = os.environ.get("SWAGGER_ENABLED", "true").lower() == "true"
+    # Logging (see app/log.py). Prompt bodies are redacted unless LOG_PROMPTS is true.
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING")
+    LOG_FILE = os.environ.get("LOG_FILE", "flask_app.log")
+    LOG_PROMPTS = os.environ.get("LOG_PROMPTS", "false").lower() == "true"
+    # Metrics (see app/metrics.py). Set METRICS_DIR to a directory shared by all
+    # workers so /metrics reports the whole deployment rather than one process.
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = int(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+    METRICS_BEARER_TOKEN = os.environ.get("METRICS_BEARER_TOKEN")
+    # Server-Timing header (see app/timing.py). The span tree debug header is opt-in.
+    SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "true").lower() == "true"
+    SERVER_TIMING_DEBUG = os.environ.get("SERVER_TIMING_DEBUG", "false").lower() == "true"
+    SERVER_TIMING_ALLOW_ORIGIN = os.environ.get("SERVER_TIMING_ALLOW_ORIGIN", "*")
+    # Token usage ledger (see app/usage.py). Rows are written in batches every
+    # USAGE_FLUSH_INTERVAL seconds, or as soon as USAGE_FLUSH_BATCH_SIZE are pending.
+    USAGE_FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", 5))
+    USAGE_FLUSH_BATCH_SIZE = int(os.environ.get("USAGE_FLUSH_BATCH_SIZE", 500))
+    USAGE_MAX_PENDING = int(os.environ.get("USAGE_MAX_PENDING", 50000))
+    # Usage analytics (see app/analytics.py). Each worker rolls up the finished
+    # hours of the ledger every ANALYTICS_ROLLUP_INTERVAL seconds (0 turns the
+    # thread off, e.g. to run `flask analytics-rollup` from cron instead), once
+    # ANALYTICS_ROLLUP_DELAY seconds have passed for the hour's last rows to be flushed.
+    ANALYTICS_ROLLUP_INTERVAL = float(os.environ.get("ANALYTICS_ROLLUP_INTERVAL", 300))
+    ANALYTICS_ROLLUP_DELAY = int(os.environ.get("ANALYTICS_ROLLUP_DELAY", 120))
+    # Rate limiting (see app/ratelimit.py). (rate, burst) per route class and scope:
+    # `rate` requests per second refill a bucket holding at most `burst`.
+    # Set RATELIMIT_STORAGE_URL to a Redis URL to share buckets between workers.
+    RATELIMIT_ENABLED = os.environ.get("RATELIMIT_ENABLED", "true").lower() == "true"
+    RATELIMIT_STORAGE_URL = os.environ.get("RATELIMIT_STORAGE_URL")
+    RATELIMITS = {
+        "catalog": {"api_key": (50, 500), "user": (5, 100)},
+        "chat": {"api_key": (10, 200), "user": (1, 20)},
+        "dalle": {"api_key": (1, 20), "user": (0.1, 5)},
+        "default": {"api_key": (20, 300), "user": (2, 60)},
+    }
+    # Token quotas (see app/quota.py). Limits are tokens per UTC day / month per
+    # user (or API key when no Clerk session is sent); None means unlimited.
+    # Models are assigned to tiers by api_name prefix.
+    QUOTA_ENABLED = os.environ.get("QUOTA_ENABLED", "false").lower() == "true"
+    QUOTA_LIMITS = {
+        "standard": {"daily": None, "monthly": None},
+        "premium": {"daily": None, "monthly": None},
+    }
+    QUOTA_MODEL_TIERS = {
+        "premium": ["o1", "o3", "gpt-4.5", "claude-3-opus", "claude-3-7", "claude-opus"],
+    }
+    QUOTA_DEFAULT_TIER = "standard"
+    QUOTA_DEFAULT_MAX_TOKENS = int(os.environ.get("QUOTA_DEFAULT_MAX_TOKENS", 4096))
+    QUOTA_CACHE_TTL = int(os.environ.get("QUOTA_CACHE_TTL", 60))
+    # SQL instrumentation (see app/querylog.py). Statements slower than
+    # SLOW_QUERY_THRESHOLD_MS are logged with their route. Requests running more
+    # statements than their budget (QUERY_BUDGETS by endpoint, else
+    # QUERY_BUDGET_DEFAULT) log a warning, or fail when QUERY_BUDGET_STRICT is set.
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 200))
+    QUERY_BUDGET_DEFAULT = int(os.environ.get("QUERY_BUDGET_DEFAULT", 25))
+    QUERY_BUDGETS = {
+        "api.api_personas": 3,
+        "api.api_models": 3,
+        "api.api_output_formats": 3,
+        "api.api_render_types": 3,
+        "api.api_api_vendors": 3,
+        "api.api_history": 5,
+    }
+    QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "false").lower() == "true"
+    # Request profiling (see app/profiling.py). Off by default; when enabled, requests
+    # sending `X-Profile: 1` with one of PROFILE_API_KEY_NAMES, plus a
+    # PROFILE_SAMPLE_RATE fraction of all API requests, are profiled into PROFILE_DIR.
+    PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED", "false").lower() == "true"
+    PROFILE_API_KEY_NAMES = [name.strip() for name in os.environ.get("PROFILE_API_KEY_NAMES", "").split(",")
+                             if name.strip()]
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+    PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
+    PROFILE_ENGINE = os.environ.get("PROFILE_ENGINE", "auto")  # auto, cprofile or pyinstrument
+
+    # Catalog cache (see app/catalog.py). The catalog lists are served from memory
+    # for CATALOG_CACHE_TTL seconds; edits show up at once on the worker that made
+    # them and within the TTL on the others. 0 disables the cache.
+    CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 30))
+    # Semantic search over saved chats (see app/semantic.py). Off unless
+    # SEMANTIC_INDEX_DIR is set to an absolute path, where each user gets a vector
+    # shard shared by all workers. SEMANTIC_EMBEDDER is "hashing" (offline) or
+    # "openai". Saved chats are embedded in the background every
+    # SEMANTIC_EMBED_INTERVAL seconds, at most SEMANTIC_EMBED_BATCH_SIZE per call.
+    SEMANTIC_INDEX_DIR = os.environ.get("SEMANTIC_INDEX_DIR") or None
+    SEMANTIC_EMBEDDER = os.environ.get("SEMANTIC_EMBEDDER", "hashing")
+    SEMANTIC_EMBEDDING_DIM = int(os.environ.get("SEMANTIC_EMBEDDING_DIM", 0)) or None
+    SEMANTIC_OPENAI_MODEL = os.environ.get("SEMANTIC_OPENAI_MODEL", "text-embedding-3-small")
+    SEMANTIC_EMBED_INTERVAL = float(os.environ.get("SEMANTIC_EMBED_INTERVAL", 2))
+    SEMANTIC_EMBED_BATCH_SIZE = int(os.environ.get("SEMANTIC_EMBED_BATCH_SIZE", 64))
+    # HTTP compression for the API (see app/compression.py). Compressed request
+    # bodies may decode to at most COMPRESSION_MAX_DECODED_SIZE bytes and
+    # COMPRESSION_MAX_RATIO times their compressed size. Responses smaller than
+    # COMPRESSION_MIN_SIZE bytes are sent uncompressed.
+    COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+    COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+    COMPRESSION_MAX_DECODED_SIZE = int(os.environ.get("COMPRESSION_MAX_DECODED_SIZE", 20 * 1024 * 1024))
+    COMPRESSION_MAX_RATIO = int(os.environ.get("COMPRESSION_MAX_RATIO", 200))
 
 class DevelopmentConfig(Config):
     """Development-specific configuration, inherits from the base Config class."""
     DEBUG = True
-    SQLALCHEMY_ECHO = os.environ.get("SQLALCHEMY_ECHO", False)  # Set to True to log SQL queries for debugging
+    SQLALCHEMY_ECHO = os.environ.get("SQLALCHEMY_ECHO", False)  # Logs every statement; prefer SLOW_QUERY_THRESHOLD_MS
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 50))
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG")
+    SERVER_TIMING_DEBUG = os.environ.get("SERVER_TIMING_DEBUG", "true").lower() == "true"
 
 class ProductionConfig(Config):
     """Production-specific configuration."""
@@ -30,6 +163,15 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}  # Pool sizing and server options do not apply to SQLite
+    SQLALCHEMY_BINDS = {}
+    USAGE_FLUSH_INTERVAL = 0  # No flusher thread; tests flush explicitly
+    ANALYTICS_ROLLUP_INTERVAL = 0  # No rollup thread; tests roll up explicitly
+    RATELIMIT_ENABLED = False
+    QUERY_BUDGET_STRICT = True  # Over-budget requests raise QueryBudgetExceeded
+    CATALOG_CACHE_TTL = 0  # Catalog routes query the database on every request
+    SEMANTIC_INDEX_DIR = None  # Tests that need it point it at a temporary directory
+    SEMANTIC_EMBED_INTERVAL = 0  # No embedding thread; tests flush the queue explicitly
 
 # A dictionary to hold the configurations for easy retrieval.
 config_by_name = {
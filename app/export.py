@@ -0,0 +1,52 @@
+"""
+export.py
+---------
+
+Export of a user's saved conversations as NDJSON, one conversation per line:
+
+    {"id": 12, "title": "...", "timestamp": "...", "message_count": 2, "messages": [{...}, {...}]}
+
+The conversations are read through a server-side cursor (`yield_per`), and the
+messages of each batch with one query on (conversation_id, sequence). The
+stored message JSON is spliced into the lines without being decoded. Only one
+batch is held in memory at a time, so memory stays flat however many
+conversations the user has.
+
+Each batch is yielded as one chunk, so a compressed response (app/compression.py)
+is flushed per batch rather than per line.
+
+Functions:
+- `export_conversations(user_id, batch_size)`: Yields the user's conversations as NDJSON chunks.
+"""
+
+from sqlalchemy import select
+
+from .jsonprovider import dumps_bytes
+from .model import ConversationHistory, ConversationMessage, db
+
+EXPORT_BATCH_SIZE = 200
+
+
+def _line(conversation, messages):
+    header = dumps_bytes({"id": conversation.id, "title": conversation.title,
+                          "timestamp": conversation.timestamp.isoformat() if conversation.timestamp else None,
+                          "message_count": conversation.message_count})
+    return b"".join((header[:-1], b',"messages":[', ",".join(messages).encode(), b"]}\n"))
+
+
+def export_conversations(user_id, batch_size=EXPORT_BATCH_SIZE):
+    """Yields the user's conversations, newest first, as NDJSON bytes, one chunk per batch."""
+    conversations = db.session.execute(
+        select(ConversationHistory.id, ConversationHistory.title, ConversationHistory.timestamp,
+               ConversationHistory.message_count)
+        .where(ConversationHistory.user_id == user_id)
+        .order_by(ConversationHistory.timestamp.desc(), ConversationHistory.id.desc())
+        .execution_options(yield_per=batch_size))
+    for batch in conversations.partitions():
+        messages = {conversation.id: [] for conversation in batch}
+        for conversation_id, message in db.session.execute(
+                select(ConversationMessage.conversation_id, ConversationMessage.message)
+                .where(ConversationMessage.conversation_id.in_(messages))
+                .order_by(ConversationMessage.conversation_id, ConversationMessage.sequence)):
+            messages[conversation_id].append(message)
+        yield b"".join(_line(conversation, messages[conversation.id]) for conversation in batch)
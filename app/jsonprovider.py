@@ -0,0 +1,52 @@
+"""
+jsonprovider.py
+---------------
+
+The app's JSON provider, built on orjson. orjson encodes straight to UTF-8
+bytes, several times faster than the standard library, so `jsonify` responses
+are built from bytes without an intermediate `str`. Request bodies are parsed
+with orjson as well.
+
+Types orjson does not handle natively (dates, decimals, UUIDs, objects with
+`__html__`) go through Flask's default conversion, so responses look the same
+as with Flask's own provider, except that keys are not sorted.
+
+Functions:
+- `dumps_bytes(obj)`: Encodes `obj` to JSON bytes, for serializers outside a response.
+
+Classes:
+- `ORJSONProvider`: The Flask JSON provider installed on the app.
+"""
+
+import orjson
+from flask.json.provider import JSONProvider, _default
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def dumps_bytes(obj, sort_keys=False, indent=False):
+    option = OPTIONS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+class ORJSONProvider(JSONProvider):
+    sort_keys = False
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, **kwargs).decode()
+
+    def dumps_bytes(self, obj, **kwargs):
+        return dumps_bytes(obj, sort_keys=kwargs.get("sort_keys", self.sort_keys),
+                           indent=bool(kwargs.get("indent")))
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,184 @@
+"""
+log.py
+------
+
+Structured logging for the Flask application. Every record is rendered as a
+single-line JSON document that carries the id of the request it was emitted
+from, and is handed to a `QueueHandler` so request threads never block on file
+or stream I/O. A `QueueListener` thread does the actual writing.
+
+Functions:
+- `init_logging(app)`: Installs the queue-backed JSON handlers on the app logger and
+  registers the request id / access log hooks.
+- `get_request_id()`: Returns the id of the current request, or None outside a request.
+- `redact(value)`: Summarises prompt bodies and message lists unless `LOG_PROMPTS` is enabled.
+- `restart_listener_after_fork()`: Starts the listener thread again in a forked worker.
+
+Module code should log through `logging.getLogger(__name__)`; those loggers are
+children of the app logger and share its level, so a disabled `debug()` call
+costs a single level check. Wrap any expensive argument construction in
+`logger.isEnabledFor(logging.DEBUG)`.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import re
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Incoming request ids are echoed back and written to the logs, so only accept
+# short, printable values.
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# Attributes every LogRecord has; anything else was passed through `extra=`.
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "request_id"}
+
+_listener = None
+_log_prompts = False
+
+
+def get_request_id():
+    if has_request_context():
+        return g.get("request_id")
+    return None
+
+
+def redact(value):
+    """
+    Make a prompt body, message or message list safe to log.
+
+    Args:
+        value: A string, a message dict or a list of message dicts.
+
+    Returns:
+        The value itself when `LOG_PROMPTS` is enabled, otherwise a short
+        description of its size.
+    """
+    if _log_prompts:
+        return value
+    if isinstance(value, str):
+        return f"<redacted {len(value)} chars>"
+    if isinstance(value, list):
+        return f"<redacted {len(value)} messages>"
+    if isinstance(value, dict):
+        return f"<redacted {value.get('role', 'message')}>"
+    return "<redacted>"
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id in the emitting thread."""
+
+    def filter(self, record):
+        record.request_id = get_request_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Only merges the message arguments in the request thread. Formatting to JSON
+    happens on the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def restart_listener_after_fork():
+    """
+    Threads do not survive a fork, so a forked worker starts its own listener on
+    the same queue and handlers.
+    """
+    global _listener
+    if _listener is not None:
+        _listener = QueueListener(_listener.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def init_logging(app):
+    global _listener, _log_prompts
+
+    _stop_listener()
+    _log_prompts = app.config.get("LOG_PROMPTS", False)
+
+    formatter = JsonFormatter()
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if app.config.get("LOG_FILE"):
+        handlers.append(logging.FileHandler(app.config["LOG_FILE"]))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    # Replace Flask's default stderr handler, which writes synchronously.
+    for handler in list(app.logger.handlers):
+        app.logger.removeHandler(handler)
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(app.config.get("LOG_LEVEL", "WARNING"))
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        g.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        response.headers[REQUEST_ID_HEADER] = g.get("request_id", "")
+        if app.logger.isEnabledFor(logging.INFO):
+            started = g.get("request_started")
+            app.logger.info("request", extra={
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2) if started else None,
+            })
+        return response
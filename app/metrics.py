@@ -0,0 +1,392 @@
+"""
+metrics.py
+----------
+
+Prometheus-style metrics for the Flask application, exposed as text at `/metrics`.
+
+Each process keeps its own counters, gauges and histograms behind one small lock
+per metric. When `METRICS_DIR` is configured (multi-worker deployments), a daemon
+thread periodically writes the process' snapshot to that directory and a scrape
+of `/metrics` on any worker merges the snapshots of all workers.
+
+Functions:
+- `init_metrics(app)`: Registers request hooks, the flusher thread and the
+  `/metrics` endpoint. SQL statements are timed by app/querylog.py.
+- `observe_vendor(vendor, model)`: Context manager timing a vendor API call and
+  recording the token usage attached to it.
+- `on_vendor_call(listener)`: Registers a callback invoked with every finished `VendorCall`.
+- `render_metrics()`: Renders the merged metrics in the Prometheus text format.
+- `reset_after_fork()`: Clears the inherited values and restarts the flusher in a forked worker.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request
+
+from .timing import span
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+TOKEN_KINDS = ("input", "output", "thinking", "cached")
+
+logger = logging.getLogger(__name__)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.register(self)
+
+    def reset(self):
+        # Also replaces the lock, which may have been held when the process forked.
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), value if not isinstance(value, list) else list(value)]
+                      for key, value in self._values.items()]
+        return {"type": self.type, "help": self.documentation,
+                "labelnames": list(self.labelnames), "values": values}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Stores, per label set, one count per bucket (non-cumulative) followed by the
+    running sum and total count of the observations.
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+
+HTTP_REQUESTS = Counter(
+    "gptflask_http_requests_total", "HTTP requests handled.", ("endpoint", "method", "status"))
+HTTP_LATENCY = Histogram(
+    "gptflask_http_request_duration_seconds", "HTTP request latency.", ("endpoint", "method", "status"))
+HTTP_IN_FLIGHT = Gauge(
+    "gptflask_http_requests_in_flight", "HTTP requests currently being handled.", ("endpoint",))
+VENDOR_LATENCY = Histogram(
+    "gptflask_vendor_request_duration_seconds", "AI vendor API call latency.", ("vendor", "model", "outcome"))
+VENDOR_IN_FLIGHT = Gauge(
+    "gptflask_vendor_requests_in_flight", "AI vendor API calls currently waiting on a response.", ("vendor",))
+VENDOR_TOKENS = Counter(
+    "gptflask_vendor_tokens_total", "Tokens reported by AI vendor responses.", ("vendor", "model", "kind"))
+DB_QUERIES = Counter(
+    "gptflask_db_queries_total", "SQL statements executed.", ("endpoint",))
+DB_LATENCY = Histogram(
+    "gptflask_db_query_duration_seconds", "SQL statement execution time.", ("endpoint",), buckets=DB_BUCKETS)
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return "none"
+
+
+_vendor_listeners = []
+
+
+def on_vendor_call(listener):
+    if listener not in _vendor_listeners:
+        _vendor_listeners.append(listener)
+    return listener
+
+
+class VendorCall:
+    """Handed out by `observe_vendor` so the caller can attach the response's token usage."""
+
+    def __init__(self, vendor, model):
+        self.vendor = vendor
+        self.model = model
+        self.usage = None
+        self.duration = None
+        self.outcome = None
+
+    def record_usage(self, usage):
+        self.usage = usage
+
+
+@contextmanager
+def observe_vendor(vendor, model):
+    call = VendorCall(vendor, model)
+    outcome = "error"
+    VENDOR_IN_FLIGHT.inc(vendor=vendor)
+    start = time.perf_counter()
+    try:
+        with span("vendor"):
+            yield call
+        outcome = "ok"
+    finally:
+        call.duration = time.perf_counter() - start
+        call.outcome = outcome
+        VENDOR_IN_FLIGHT.dec(vendor=vendor)
+        VENDOR_LATENCY.observe(call.duration, vendor=vendor, model=model, outcome=outcome)
+        if call.usage:
+            for kind in TOKEN_KINDS:
+                amount = call.usage.get(f"{kind}_tokens") or 0
+                if amount:
+                    VENDOR_TOKENS.inc(amount, vendor=vendor, model=model, kind=kind)
+        for listener in _vendor_listeners:
+            try:
+                listener(call)
+            except Exception:
+                logger.exception("Vendor call listener failed")
+
+
+# Multi-worker aggregation
+
+_metrics_dir = None
+_flusher = None
+_flush_interval = 5
+
+
+def _snapshot_path(pid):
+    return os.path.join(_metrics_dir, f"metrics-{pid}.json")
+
+
+def flush_snapshot():
+    if not _metrics_dir:
+        return
+    path = _snapshot_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as snapshot_file:
+        json.dump(REGISTRY.snapshot(), snapshot_file)
+    os.replace(tmp_path, path)
+
+
+def _flush_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush_snapshot()
+        except OSError:
+            pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _worker_snapshots():
+    """Yields (snapshot, alive) for every other worker that has written one."""
+    if not _metrics_dir or not os.path.isdir(_metrics_dir):
+        return
+    own = os.getpid()
+    for filename in os.listdir(_metrics_dir):
+        if not (filename.startswith("metrics-") and filename.endswith(".json")):
+            continue
+        try:
+            pid = int(filename[len("metrics-"):-len(".json")])
+        except ValueError:
+            continue
+        if pid == own:
+            continue
+        try:
+            with open(os.path.join(_metrics_dir, filename)) as snapshot_file:
+                yield json.load(snapshot_file), _pid_alive(pid)
+        except (OSError, ValueError):
+            continue
+
+
+def merged_snapshot():
+    merged = REGISTRY.snapshot()
+    for name in merged:
+        merged[name]["values"] = {tuple(labels): value for labels, value in merged[name]["values"]}
+    for snapshot, alive in _worker_snapshots():
+        for name, metric in snapshot.items():
+            # Gauges of workers that have exited no longer describe anything.
+            if name not in merged or (metric["type"] == "gauge" and not alive):
+                continue
+            values = merged[name]["values"]
+            for labels, value in metric["values"]:
+                key = tuple(labels)
+                if isinstance(value, list):
+                    current = values.get(key)
+                    values[key] = [a + b for a, b in zip(current, value)] if current else value
+                else:
+                    values[key] = values.get(key, 0) + value
+    return merged
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{_escape_label(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    lines = []
+    for name, metric in sorted(merged_snapshot().items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for labels, value in sorted(metric["values"].items()):
+            if metric["type"] == "histogram":
+                cumulative = 0
+                bounds = [_format_value(float(b)) for b in metric["buckets"]] + ["+Inf"]
+                for bound, count in zip(bounds, value[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labelnames, labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labelnames, labels)} {value[-1]}")
+            else:
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _start_flusher():
+    global _flusher
+    _flusher = threading.Thread(target=_flush_forever, args=(_flush_interval,),
+                                name="metrics-flusher", daemon=True)
+    _flusher.start()
+
+
+def reset_after_fork():
+    """
+    Called in a freshly forked worker. The worker starts from empty metrics (the
+    master's values are reported in the master's own snapshot) and needs its own
+    flusher thread, since threads do not survive a fork.
+    """
+    REGISTRY.reset()
+    if _flusher is not None:
+        _start_flusher()
+
+
+def init_metrics(app):
+    global _metrics_dir, _flush_interval
+
+    _metrics_dir = app.config.get("METRICS_DIR")
+    _flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", 5)
+    if _metrics_dir:
+        os.makedirs(_metrics_dir, exist_ok=True)
+        if _flusher is None:
+            _start_flusher()
+
+    @app.before_request
+    def start_request_metrics():
+        if request.blueprint != "api" and request.endpoint is not None:
+            return
+        g.metrics_endpoint = request.endpoint or "unmatched"
+        g.metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get("metrics_start")
+        if start is not None:
+            labels = {"endpoint": g.metrics_endpoint, "method": request.method,
+                      "status": response.status_code}
+            HTTP_REQUESTS.inc(**labels)
+            HTTP_LATENCY.observe(time.perf_counter() - start, **labels)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop("metrics_start", None) is not None:
+            HTTP_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+
+    def metrics():
+        token = app.config.get("METRICS_BEARER_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            abort(401, description="Invalid or missing metrics token")
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics)
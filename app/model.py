@@ -1,7 +1,13 @@
+import hashlib
 from datetime import datetime
+
+import orjson
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import object_session
+
+from .replica import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 # Models
 # User model
@@ -17,7 +23,7 @@ class Users(db.Model):
 
 class Model(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    api_name = db.Column(db.String(255), nullable=False)
+    api_name = db.Column(db.String(255), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)
     is_vision = db.Column(db.Boolean, nullable=False, default=False)
     is_image_generation = db.Column(db.Boolean, nullable=False, default=False)
@@ -26,6 +32,10 @@ class Model(db.Model):
         db.Integer, db.ForeignKey('api_vendor.id'), nullable=True)
     api_vendor = db.relationship(
         'APIVendor', backref=db.backref('api_vendors', lazy=True))
+    # The natural key catalog imports upsert on (app/bulk.py)
+    __table_args__ = (
+        db.UniqueConstraint('api_name', 'name', name='uq_model_api_name_name'),
+    )
 
     def to_dict(self):
         model_obj = {
@@ -43,6 +53,10 @@ class Model(db.Model):
 class APIVendor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
+    # Imports and the seed refer to vendors by name
+    __table_args__ = (
+        db.UniqueConstraint('name', name='uq_api_vendor_name'),
+    )
 
     def to_dict(self):
         api_vendor_obj = {
@@ -52,21 +66,74 @@ class APIVendor(db.Model):
         return api_vendor_obj
 
 
-# ConversationHistory model (for storing conversations)
+# ConversationHistory model (for storing conversations). The messages are
+# stored one row each in ConversationMessage, so saving a longer version of a
+# chat only appends the new messages.
 class ConversationHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.Text, nullable=True)
-    conversation = db.Column(db.Text, nullable=False)
+    # Number of stored messages, which is also the sequence of the next one
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    messages = db.relationship('ConversationMessage', back_populates='conversation',
+                               order_by='ConversationMessage.sequence', cascade='all, delete-orphan')
+
+    # Serves the history listing: one user's conversations, newest first
+    __table_args__ = (
+        db.Index('ix_conversation_history_user_id_timestamp', 'user_id', 'timestamp'),
+    )
 
     # Represent the object when printed
     def __repr__(self):
         return f'<ConversationHistory {self.id}>'
 
-    # Get a dict of the ConversationHistory object
+    def append_messages(self, messages):
+        """
+        Adds messages after the last stored one. Setting the many-to-one side
+        leaves the `messages` collection unloaded, so the stored ones are not
+        read; the new rows are then added to the session explicitly.
+        """
+        session = object_session(self)
+        count = self.message_count or 0  # None until a new conversation is flushed
+        for message in messages:
+            row = ConversationMessage(conversation=self, sequence=count,
+                                      role=str(message.get("role", "")), message=orjson.dumps(message).decode())
+            if session is not None:
+                session.add(row)
+            count += 1
+        self.message_count = count
+
+    def message_list(self):
+        return [message.to_message() for message in self.messages]
+
+    # Get a dict of the ConversationHistory object. `conversation` keeps the
+    # JSON document format clients sent to /api/save_chat, spliced together from
+    # the stored message JSON without decoding it.
     def to_dict(self):
-        return dict(id=self.id, title=self.title, conversation=self.conversation)
+        conversation = '{"messages":[' + ",".join(message.message for message in self.messages) + ']}'
+        return dict(id=self.id, title=self.title, message_count=self.message_count,
+                    conversation=conversation)
+
+
+class ConversationMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation_history.id', ondelete='CASCADE'),
+                                nullable=False)
+    sequence = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(50), nullable=False)
+    # The message as the client sent it (role, content and any other keys), JSON encoded
+    message = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    conversation = db.relationship('ConversationHistory', back_populates='messages')
+
+    # Also the index for reading a conversation's messages in order
+    __table_args__ = (
+        db.UniqueConstraint('conversation_id', 'sequence', name='uq_conversation_message_conversation_id_sequence'),
+    )
+
+    def to_message(self):
+        return orjson.loads(self.message)
 
 # Persona Model (sets the OpenAI system prompt)
 
@@ -77,6 +144,10 @@ class Persona(db.Model):
     prompt = db.Column(db.Text, nullable=False)
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     owner = db.relationship('Users', backref=db.backref('personas', lazy=True))
+    # The natural key catalog imports upsert on (app/bulk.py)
+    __table_args__ = (
+        db.UniqueConstraint('name', name='uq_persona_name'),
+    )
 
     def to_dict(self):
         persona_obj = {
@@ -101,15 +172,21 @@ class OutputFormat(db.Model):
         db.Integer, db.ForeignKey('render_type.id'), nullable=True)
     render_type = db.relationship(
         'RenderType', backref=db.backref('output_formats', lazy=True))
+    # The natural key catalog imports upsert on (app/bulk.py)
+    __table_args__ = (
+        db.UniqueConstraint('name', name='uq_output_format_name'),
+    )
 
     def to_dict(self):
-        render_type = RenderType.query.get(self.render_type_id)
+        # Use the relationship so list queries can eager load render types
+        # instead of issuing one lookup per output format.
+        render_type = self.render_type
         output_format_obj = {
             "id": self.id,
             "name": self.name,
             "prompt": self.prompt,
             "owner_id": self.owner_id,
-            "render_type_name": render_type.name,
+            "render_type_name": render_type.name if render_type else None,
             "render_type_id": self.render_type_id
         }
         return output_format_obj
@@ -120,7 +197,30 @@ class OutputFormat(db.Model):
 class APIKey(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
-    key = db.Column(db.String(255), nullable=False)
+    # SHA-256 of the key; the key itself is only shown once, when issued. Keys
+    # are 64 random characters, so a fast unsalted hash cannot be brute forced.
+    key_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # None for keys that never expire. Rotation sets it on the replaced key.
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    @staticmethod
+    def hash(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    # Write-only: `APIKey(name=..., key=...)` stores the hash. The plaintext is
+    # kept on this instance only, for showing it to whoever issued it.
+    @property
+    def key(self):
+        return self.__dict__.get("_plaintext_key")
+
+    @key.setter
+    def key(self, value):
+        self.__dict__["_plaintext_key"] = value
+        self.key_hash = APIKey.hash(value)
+
+    def is_active(self, now=None):
+        return self.expires_at is None or self.expires_at > (now or datetime.utcnow())
 
 # Render Types
 
@@ -128,6 +228,10 @@ class APIKey(db.Model):
 class RenderType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
+    # Imports and the seed refer to render types by name
+    __table_args__ = (
+        db.UniqueConstraint('name', name='uq_render_type_name'),
+    )
 
     def to_dict(self):
         render_type_obj = {
@@ -142,6 +246,10 @@ class UserSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     user = db.relationship('Users', backref=db.backref('settings', lazy=True))
+    # One settings row per user; also the index for lookups by user
+    __table_args__ = (
+        db.UniqueConstraint('user_id', name='uq_user_settings_user_id'),
+    )
     appearance_mode = db.Column(db.String(10), nullable=False, default='light') # Values: 'dark' or 'light'
     summary_model_preference_id = db.Column(db.Integer, db.ForeignKey('model.id'), nullable=True)
     summary_model_preference = db.relationship('Model')
@@ -154,4 +262,78 @@ class UserSettings(db.Model):
             "summary_model_preference_id": self.summary_model_preference_id,
             "summary_model_preference": self.summary_model_preference.name if self.summary_model_preference else None,
         }
-        return settings_obj
\ No newline at end of file
+        return settings_obj
+
+# Token usage ledger, one row per AI vendor call. Rows are written in batches
+# by the background flusher in app/usage.py.
+
+class TokenUsage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    api_key_id = db.Column(db.Integer, db.ForeignKey('api_key.id'), nullable=True)
+    api_vendor = db.Column(db.String(255), nullable=False)
+    model_api_name = db.Column(db.String(255), nullable=False)
+    endpoint = db.Column(db.String(255), nullable=True)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    thinking_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cached_tokens = db.Column(db.Integer, nullable=False, default=0)
+    # Wall time of the vendor call; None for rows recorded before it was tracked
+    latency_ms = db.Column(db.Integer, nullable=True)
+    # "ok" or "error" (the call raised, e.g. timed out or was cut off)
+    outcome = db.Column(db.String(20), nullable=False, default="ok", server_default="ok")
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index('ix_token_usage_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    def to_dict(self):
+        token_usage_obj = {
+            "id": self.id,
+            "user_id": self.user_id,
+            "api_key_id": self.api_key_id,
+            "api_vendor": self.api_vendor,
+            "model_api_name": self.model_api_name,
+            "endpoint": self.endpoint,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "thinking_tokens": self.thinking_tokens,
+            "cached_tokens": self.cached_tokens,
+            "latency_ms": self.latency_ms,
+            "outcome": self.outcome,
+            "timestamp": self.timestamp.isoformat() if self.timestamp else None,
+        }
+        return token_usage_obj
+
+# Hourly rollups of the token usage ledger, maintained by app/analytics.py. One
+# row per hour, user, vendor and model, with the request and token totals.
+
+class UsageRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    api_vendor = db.Column(db.String(255), nullable=False)
+    model_api_name = db.Column(db.String(255), nullable=False)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    input_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    output_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    thinking_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cached_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    latency_buckets = db.relationship('UsageLatencyBucket', cascade='all, delete-orphan', passive_deletes=True)
+
+# The latency sketch of a rollup row: how many calls fell in each logarithmic
+# latency bucket. Sketches merge by adding counts, so any range of rollups is
+# summarized with one SUM ... GROUP BY bucket.
+
+class UsageLatencyBucket(db.Model):
+    rollup_id = db.Column(db.Integer, db.ForeignKey('usage_rollup.id', ondelete='CASCADE'), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False)
+
+# How far the rollups have been built: every ledger hour before `rolled_until`
+# is in usage_rollup.
+
+class RollupWatermark(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    rolled_until = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,60 @@
+"""
+prefork.py
+----------
+
+Support for pre-forking servers (gunicorn with `preload_app`, see wsgi.py and
+gunicorn.conf.py). The master process builds the app and warms it once; the
+workers it forks then share the imported SDKs and the cached catalogs
+copy-on-write instead of each loading them after start-up.
+
+What a forked worker must not share with the master is re-created after the
+fork: the database connection pools (a socket used by two processes corrupts
+both sessions), the vendor clients with their connection pools, and the
+background threads, which do not survive a fork (log listener, metrics flusher,
+usage flusher, usage rollup job, semantic embedder).
+
+Functions:
+- `warm(app)`: Imports and configures the vendor SDKs and loads the catalogs.
+- `after_fork(app)`: Re-creates per-process state in a freshly forked worker.
+"""
+
+import logging
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import catalog, metrics, semantic, vendors
+from .analytics import rollup_job
+from .log import restart_listener_after_fork
+from .model import db
+from .usage import usage_buffer
+
+logger = logging.getLogger(__name__)
+
+
+def warm(app):
+    vendors.preload()
+    with app.app_context():
+        try:
+            catalog.warm_catalogs()
+        except SQLAlchemyError:
+            # Workers load the catalogs on first use instead.
+            logger.warning("Could not preload catalogs", exc_info=True)
+        finally:
+            db.session.remove()
+            # Connections opened by the master must not be handed to the workers.
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+def after_fork(app):
+    restart_listener_after_fork()
+    metrics.reset_after_fork()
+    usage_buffer.reset_after_fork()
+    rollup_job.reset_after_fork()
+    vendors.reset_after_fork()
+    catalog.reset_after_fork()
+    semantic.embed_queue.reset_after_fork()
+    with app.app_context():
+        for engine in db.engines.values():
+            # Drops the inherited pool without closing the master's connections.
+            engine.dispose(close=False)
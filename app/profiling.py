@@ -0,0 +1,184 @@
+"""
+profiling.py
+------------
+
+Opt-in profiling of individual API requests in place, e.g. in production.
+
+When `PROFILE_ENABLED` is set, a request is profiled if it sends
+`X-Profile: 1` with an API key whose name is listed in `PROFILE_API_KEY_NAMES`,
+or if it is picked by `PROFILE_SAMPLE_RATE` (a fraction of API requests). The
+profile is written to `PROFILE_DIR`, which keeps at most `PROFILE_MAX_FILES`
+profiles, and the file name is returned in the `X-Profile-Id` response header.
+Admins list and download profiles through /api/admin/profiles.
+
+pyinstrument is used when installed (HTML output), otherwise cProfile (a
+`.prof` file for pstats or snakeviz); set `PROFILE_ENGINE` to force one. When
+profiling is disabled no hooks are registered, so it costs nothing to leave deployed.
+
+Functions:
+- `init_profiling(app)`: Registers the hooks when profiling is enabled.
+- `list_profiles()`: The saved profiles, newest first.
+- `profile_path(name)`: Path of a saved profile, or None if there is no such profile.
+"""
+
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+
+from flask import current_app, g, request
+
+from .apikeys import find_api_key
+from .log import get_request_id
+
+logger = logging.getLogger(__name__)
+
+PROFILE_REQUEST_HEADER = "X-Profile"
+PROFILE_RESPONSE_HEADER = "X-Profile-Id"
+PROFILE_EXTENSIONS = (".prof", ".html")
+
+
+class CProfileSession:
+    extension = ".prof"
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def save(self, path):
+        self.profiler.dump_stats(path)
+
+
+class PyinstrumentSession:
+    extension = ".html"
+
+    def __init__(self):
+        # Optional dependency, imported only when a request is profiled.
+        from pyinstrument import Profiler
+
+        self.profiler = Profiler(async_mode="disabled")
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def save(self, path):
+        with open(path, "w") as profile_file:
+            profile_file.write(self.profiler.output_html())
+
+
+def _session_class(engine):
+    if engine == "cprofile":
+        return CProfileSession
+    if engine == "pyinstrument":
+        return PyinstrumentSession
+    try:
+        import pyinstrument  # noqa: F401
+    except ImportError:
+        return CProfileSession
+    return PyinstrumentSession
+
+
+def _requested_by_allowed_key():
+    if request.headers.get(PROFILE_REQUEST_HEADER) != "1":
+        return False
+    allowed = current_app.config.get("PROFILE_API_KEY_NAMES") or []
+    auth_header = request.headers.get("Authorization", "")
+    if not allowed or not auth_header.startswith("Bearer "):
+        return False
+    key_object = find_api_key(auth_header.split(" ", 1)[1])
+    return key_object is not None and key_object.name in allowed
+
+
+def _should_profile():
+    sample_rate = current_app.config.get("PROFILE_SAMPLE_RATE", 0)
+    if sample_rate and random.random() < sample_rate:
+        return True
+    return _requested_by_allowed_key()
+
+
+def _profile_name(extension):
+    endpoint = re.sub(r"[^A-Za-z0-9_.-]", "_", request.endpoint or "unknown")
+    request_id = re.sub(r"[^A-Za-z0-9_-]", "", get_request_id() or "")[:32]
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint}-{request_id or os.urandom(8).hex()}{extension}"
+
+
+def _prune(directory, max_files):
+    profiles = sorted(
+        (entry for entry in os.scandir(directory)
+         if entry.is_file() and entry.name.endswith(PROFILE_EXTENSIONS)),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:max(0, len(profiles) - max_files)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _finish(session):
+    session.stop()
+    directory = current_app.config["PROFILE_DIR"]
+    name = _profile_name(session.extension)
+    session.save(os.path.join(directory, name))
+    _prune(directory, current_app.config.get("PROFILE_MAX_FILES", 50))
+    logger.info("Saved request profile", extra={"profile": name, "endpoint": request.endpoint})
+    return name
+
+
+def list_profiles():
+    directory = current_app.config["PROFILE_DIR"]
+    if not os.path.isdir(directory):
+        return []
+    entries = sorted(
+        (entry for entry in os.scandir(directory)
+         if entry.is_file() and entry.name.endswith(PROFILE_EXTENSIONS)),
+        key=lambda entry: entry.stat().st_mtime, reverse=True,
+    )
+    return [{"name": entry.name, "size": entry.stat().st_size,
+             "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(entry.stat().st_mtime))}
+            for entry in entries]
+
+
+def profile_path(name):
+    if name != os.path.basename(name) or not name.endswith(PROFILE_EXTENSIONS):
+        return None
+    path = os.path.join(current_app.config["PROFILE_DIR"], name)
+    return path if os.path.isfile(path) else None
+
+
+def init_profiling(app):
+    if not app.config.get("PROFILE_ENABLED"):
+        return
+
+    os.makedirs(app.config["PROFILE_DIR"], exist_ok=True)
+    session_class = _session_class(app.config.get("PROFILE_ENGINE", "auto"))
+
+    @app.before_request
+    def start_profile():
+        if request.blueprint != "api" or not _should_profile():
+            return
+        try:
+            g.profile_session = session_class()
+        except (ImportError, ValueError, RuntimeError):
+            # pyinstrument is missing, or another profiler is already active on this thread.
+            logger.warning("Could not start request profiler", exc_info=True)
+
+    @app.after_request
+    def save_profile(response):
+        session = g.pop("profile_session", None)
+        if session is not None:
+            response.headers[PROFILE_RESPONSE_HEADER] = _finish(session)
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        # The request failed before after_request ran.
+        session = g.pop("profile_session", None)
+        if session is not None:
+            session.stop()
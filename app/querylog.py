@@ -0,0 +1,112 @@
+"""
+querylog.py
+-----------
+
+SQL statement instrumentation. Engine event hooks time every statement and feed
+the database metrics (app/metrics.py) and the `db` Server-Timing phase
+(app/timing.py). On top of that this module:
+
+- logs statements slower than `SLOW_QUERY_THRESHOLD_MS` together with the route
+  that issued them (the request id is added by the log filter), and
+- counts the statements each request runs and checks them against a query
+  budget: `QUERY_BUDGETS` per endpoint, `QUERY_BUDGET_DEFAULT` otherwise. Going
+  over budget logs a warning, or raises `QueryBudgetExceeded` when
+  `QUERY_BUDGET_STRICT` is set (as in tests), so N+1 patterns fail the test
+  that introduces them.
+
+Unlike `SQLALCHEMY_ECHO`, only slow statements and budget overruns are logged.
+
+Functions:
+- `init_querylog(app)`: Installs the engine hooks and the per-request budget check.
+- `query_count()`: Statements run so far by the current request.
+"""
+
+import logging
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import DB_LATENCY, DB_QUERIES, current_endpoint
+from .timing import add_db_time
+
+logger = logging.getLogger(__name__)
+
+# Longest statement text written to the slow query log.
+MAX_LOGGED_STATEMENT = 2000
+
+_slow_query_threshold = None
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more SQL statements than its route's query budget allows."""
+
+
+def query_count():
+    if has_request_context():
+        return g.get("query_count", 0)
+    return 0
+
+
+# Listening on the Engine class covers every engine the app creates,
+# including bound engines.
+
+_engine_hooks_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    endpoint = current_endpoint()
+    DB_QUERIES.inc(endpoint=endpoint)
+    DB_LATENCY.observe(elapsed, endpoint=endpoint)
+    add_db_time(elapsed)
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+    if _slow_query_threshold is not None and elapsed >= _slow_query_threshold:
+        # Parameters are left out, they can hold prompts and API keys.
+        logger.warning("Slow query", extra={
+            "duration_ms": round(elapsed * 1000, 3),
+            "endpoint": endpoint,
+            "statement": " ".join(statement.split())[:MAX_LOGGED_STATEMENT],
+            "executemany": executemany,
+        })
+
+
+def install_engine_hooks():
+    global _engine_hooks_installed
+    if _engine_hooks_installed:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    _engine_hooks_installed = True
+
+
+def init_querylog(app):
+    global _slow_query_threshold
+
+    install_engine_hooks()
+    threshold_ms = app.config.get("SLOW_QUERY_THRESHOLD_MS")
+    _slow_query_threshold = threshold_ms / 1000 if threshold_ms is not None else None
+
+    @app.before_request
+    def reset_query_count():
+        # g can outlive a request when an app context was pushed beforehand (tests, CLI).
+        g.query_count = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        count = g.get("query_count", 0)
+        budget = app.config.get("QUERY_BUDGETS", {}).get(request.endpoint,
+                                                         app.config.get("QUERY_BUDGET_DEFAULT"))
+        if budget is None or count <= budget:
+            return response
+        if app.config.get("QUERY_BUDGET_STRICT"):
+            raise QueryBudgetExceeded(f"{request.endpoint} ran {count} queries, budget is {budget}")
+        logger.warning("Query budget exceeded",
+                       extra={"endpoint": request.endpoint, "queries": count, "budget": budget})
+        return response
@@ -0,0 +1,231 @@
+"""
+quota.py
+--------
+
+Daily and monthly token quotas per user and model tier, enforced before a chat
+request is sent to a vendor.
+
+Admission reserves a cheap estimate of the request's cost (the composed messages
+plus the requested `maxTokens`/`budgetTokens`) and rejects the request with 429
+if that would take the caller over a limit. Once the vendor answers, the
+reservation is replaced with the tokens the vendor actually reported (input +
+output + thinking). Usage is tracked in memory; the totals for a period are
+loaded from the `TokenUsage` ledger the first time they are needed and reloaded
+every `QUOTA_CACHE_TTL` seconds to pick up other workers' usage.
+
+The quota principal is the Clerk user when the request carries a verified
+session, otherwise the API key.
+
+Functions:
+- `init_quota(app)`: Hooks settlement into vendor calls.
+- `estimate_tokens(messages)`: Rough input token count for a message list.
+- `model_tier(api_name)`: The quota tier a model belongs to.
+- `admit(model_api_name, messages, max_tokens, budget_tokens)`: Reserves the
+  estimated cost for the current request or aborts with 429.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_request_context, jsonify, make_response, abort
+from sqlalchemy import func
+
+from .metrics import on_vendor_call
+from .model import TokenUsage, db
+
+PERIODS = ("daily", "monthly")
+
+# Estimation constants. Text averages about four characters per token; images
+# are charged at OpenAI's low / high detail base cost.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS_LOW = 85
+IMAGE_TOKENS_HIGH = 765
+
+
+def _content_tokens(content):
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN
+    if isinstance(content, list):
+        return sum(_content_tokens(block) for block in content)
+    if isinstance(content, dict):
+        if content.get("type") == "image_url":
+            image_url = content.get("image_url") or {}
+            return IMAGE_TOKENS_LOW if image_url.get("detail") == "low" else IMAGE_TOKENS_HIGH
+        if content.get("type") == "image":
+            return IMAGE_TOKENS_HIGH
+        return sum(len(value) // CHARS_PER_TOKEN
+                   for key, value in content.items()
+                   if isinstance(value, str) and key not in ("type", "signature"))
+    return len(str(content)) // CHARS_PER_TOKEN
+
+
+def estimate_tokens(messages):
+    return sum(MESSAGE_OVERHEAD_TOKENS + _content_tokens(message.get("content"))
+               for message in messages)
+
+
+def model_tier(api_name):
+    for tier, prefixes in current_app.config.get("QUOTA_MODEL_TIERS", {}).items():
+        if any(api_name.startswith(prefix) for prefix in prefixes):
+            return tier
+    return current_app.config.get("QUOTA_DEFAULT_TIER", "standard")
+
+
+def _period_bounds(period, now):
+    """Returns (period id, start, end) for the UTC day or month containing `now`."""
+    if period == "daily":
+        start = datetime(now.year, now.month, now.day)
+        return start.strftime("%Y-%m-%d"), start, start + timedelta(days=1)
+    start = datetime(now.year, now.month, 1)
+    end = datetime(now.year + 1, 1, 1) if now.month == 12 else datetime(now.year, now.month + 1, 1)
+    return start.strftime("%Y-%m"), start, end
+
+
+def current_principal():
+    if g.get("user_id") is not None:
+        return ("user", g.user_id)
+    if g.get("api_key_id") is not None:
+        return ("api_key", g.api_key_id)
+    return None
+
+
+class QuotaTracker:
+    """Tokens used per (principal, period) and tier, cached in process memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._periods = {}
+
+    def _load(self, principal, start, end):
+        kind, principal_id = principal
+        column = TokenUsage.user_id if kind == "user" else TokenUsage.api_key_id
+        rows = db.session.query(
+            TokenUsage.model_api_name,
+            func.coalesce(func.sum(TokenUsage.input_tokens + TokenUsage.output_tokens
+                                   + TokenUsage.thinking_tokens), 0),
+        ).filter(column == principal_id, TokenUsage.timestamp >= start,
+                 TokenUsage.timestamp < end).group_by(TokenUsage.model_api_name).all()
+        used = {}
+        for api_name, tokens in rows:
+            tier = model_tier(api_name)
+            used[tier] = used.get(tier, 0) + int(tokens)
+        return used
+
+    def _state(self, principal, period, now):
+        period_id, start, end = _period_bounds(period, now)
+        key = (principal, period_id)
+        ttl = current_app.config.get("QUOTA_CACHE_TTL", 60)
+        with self._lock:
+            state = self._periods.get(key)
+        if state is None or time.monotonic() - state["loaded"] > ttl:
+            used = self._load(principal, start, end)
+            with self._lock:
+                # Reservations still in flight are not in the ledger yet.
+                pending = state["pending"] if state else {}
+                for tier, tokens in pending.items():
+                    used[tier] = used.get(tier, 0) + tokens
+                state = {"loaded": time.monotonic(), "used": used, "pending": dict(pending), "end": end}
+                self._periods[key] = state
+        return state
+
+    def reserve(self, principal, tier, tokens, now=None):
+        """
+        Adds `tokens` to every period for `principal` unless a limit would be
+        exceeded. Returns None on success, otherwise (period, limit, used, period end).
+        """
+        now = now or datetime.utcnow()
+        limits = current_app.config.get("QUOTA_LIMITS", {}).get(tier, {})
+        states = {period: self._state(principal, period, now) for period in PERIODS}
+        with self._lock:
+            for period, state in states.items():
+                limit = limits.get(period)
+                used = state["used"].get(tier, 0)
+                if limit is not None and used + tokens > limit:
+                    return period, limit, used, state["end"]
+            for state in states.values():
+                state["used"][tier] = state["used"].get(tier, 0) + tokens
+                state["pending"][tier] = state["pending"].get(tier, 0) + tokens
+        return None
+
+    def adjust(self, principal, tier, reserved, actual, now=None):
+        """Replaces a reservation of `reserved` tokens with `actual` usage."""
+        now = now or datetime.utcnow()
+        with self._lock:
+            for period in PERIODS:
+                period_id = _period_bounds(period, now)[0]
+                state = self._periods.get((principal, period_id))
+                if state is None:
+                    continue
+                state["used"][tier] = max(0, state["used"].get(tier, 0) - reserved + actual)
+                state["pending"][tier] = max(0, state["pending"].get(tier, 0) - reserved)
+
+    def clear(self):
+        with self._lock:
+            self._periods.clear()
+
+
+quota_tracker = QuotaTracker()
+
+
+def admit(model_api_name, messages, max_tokens=None, budget_tokens=None):
+    """
+    Reserve the estimated cost of a chat request for the current principal,
+    aborting with 429 and a Retry-After until the period resets when a quota
+    would be exceeded.
+    """
+    if not current_app.config.get("QUOTA_ENABLED"):
+        return
+    principal = current_principal()
+    if principal is None:
+        return
+    tier = model_tier(model_api_name)
+    estimate = (estimate_tokens(messages)
+                + (max_tokens or current_app.config.get("QUOTA_DEFAULT_MAX_TOKENS", 4096))
+                + (budget_tokens or 0))
+    now = datetime.utcnow()
+    rejected = quota_tracker.reserve(principal, tier, estimate, now)
+    if rejected:
+        period, limit, used, end = rejected
+        response = make_response(jsonify({
+            "message": f"{period.capitalize()} token quota exceeded for {tier} models",
+            "quota": {"period": period, "tier": tier, "limit": limit,
+                      "used": used, "requested": estimate},
+        }), 429)
+        response.headers["Retry-After"] = str(math.ceil((end - now).total_seconds()))
+        abort(response)
+    g.quota_reservation = {"principal": principal, "tier": tier, "tokens": estimate}
+
+
+def settle_vendor_call(call):
+    """Reconciles the current request's reservation with the vendor's reported usage."""
+    if not has_request_context() or not current_app.config.get("QUOTA_ENABLED"):
+        return
+    principal = current_principal()
+    if principal is None:
+        return
+    actual = 0
+    if call.usage:
+        actual = call.usage["input_tokens"] + call.usage["output_tokens"] + call.usage["thinking_tokens"]
+    reservation = g.pop("quota_reservation", None)
+    if reservation is not None:
+        # Without reported usage the estimate stands.
+        if actual or call.outcome != "ok":
+            quota_tracker.adjust(principal, reservation["tier"], reservation["tokens"], actual)
+    elif actual:
+        quota_tracker.adjust(principal, model_tier(call.model), 0, actual)
+
+
+def init_quota(app):
+    on_vendor_call(settle_vendor_call)
+
+    @app.teardown_request
+    def release_unused_reservation(exc):
+        # The request ended before reaching a vendor.
+        reservation = g.pop("quota_reservation", None)
+        if reservation is not None:
+            quota_tracker.adjust(reservation["principal"], reservation["tier"], reservation["tokens"], 0)
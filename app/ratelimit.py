@@ -0,0 +1,164 @@
+"""
+ratelimit.py
+------------
+
+Token-bucket rate limiting per API key and per Clerk user, with separate limits
+for each route class (catalog reads, chat, dalle, everything else).
+
+Buckets live in process memory by default. Set `RATELIMIT_STORAGE_URL` to a
+Redis URL to share them between workers; the refill-and-take step then runs as
+a single Lua script so it stays atomic across processes. If Redis cannot be
+reached the limiter fails open and logs a warning.
+
+Limits are configured in `RATELIMITS` as `(rate, burst)` pairs: `rate` tokens are
+added per second up to `burst`, and every request takes one token.
+
+Functions:
+- `init_rate_limiting(app)`: Selects the backend and adds the rate-limit headers to responses.
+- `rate_limit(route_class)`: Route decorator. Apply below the auth decorators so the
+  API key and user are known.
+"""
+
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, jsonify, make_response, abort
+
+logger = logging.getLogger(__name__)
+
+ROUTE_CLASSES = ("catalog", "chat", "dalle", "default")
+
+
+class MemoryBackend:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def consume(self, key, rate, burst, cost=1):
+        """
+        Returns (allowed, remaining tokens) after refilling the bucket and, if
+        enough tokens are available, taking `cost` of them.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _, _ = self._buckets.get(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, rate, burst)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, tokens
+
+    def _prune(self, now):
+        # Buckets that have been idle long enough to refill behave exactly like
+        # missing ones, so they can be dropped.
+        for key, (tokens, updated, rate, burst) in list(self._buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+
+
+_TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    def __init__(self, url, prefix="gptflask:ratelimit:"):
+        # Optional dependency, only needed when limits are shared between workers.
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    def consume(self, key, rate, burst, cost=1):
+        try:
+            allowed, tokens = self._script(keys=[self.prefix + key], args=[rate, burst, cost])
+        except Exception:
+            logger.warning("Rate limit backend unavailable, allowing request", exc_info=True)
+            return True, burst
+        return bool(allowed), float(tokens)
+
+
+_backend = MemoryBackend()
+
+
+def _check(route_class, scope, identity):
+    limit = current_app.config["RATELIMITS"].get(route_class, {}).get(scope)
+    if not limit or identity is None:
+        return None
+    rate, burst = limit
+    allowed, remaining = _backend.consume(f"{route_class}:{scope}:{identity}", rate, burst)
+    # Seconds until the next token, and until the bucket is full again.
+    retry_after = 0 if allowed else max(1, math.ceil((1 - remaining) / rate))
+    reset = math.ceil((burst - remaining) / rate)
+    return {"allowed": allowed, "limit": burst, "remaining": int(remaining),
+            "retry_after": retry_after, "reset": reset}
+
+
+def rate_limit(route_class):
+    """
+    A decorator that takes a token from the API key's and the Clerk user's
+    bucket for `route_class`, responding 429 when either is empty.
+    """
+    if route_class not in ROUTE_CLASSES:
+        raise ValueError(f"Unknown route class {route_class!r}")
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if current_app.config.get("RATELIMIT_ENABLED"):
+                results = [
+                    result for result in (
+                        _check(route_class, "api_key", g.get("api_key_id")),
+                        _check(route_class, "user", g.get("user_id")),
+                    ) if result is not None
+                ]
+                if results:
+                    tightest = min(results, key=lambda result: (result["allowed"], result["remaining"]))
+                    g.rate_limit = tightest
+                    if not tightest["allowed"]:
+                        response = make_response(jsonify({"message": "Rate limit exceeded"}), 429)
+                        response.headers["Retry-After"] = str(tightest["retry_after"])
+                        abort(response)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def init_rate_limiting(app):
+    global _backend
+
+    storage_url = app.config.get("RATELIMIT_STORAGE_URL")
+    _backend = RedisBackend(storage_url) if storage_url else MemoryBackend()
+
+    @app.after_request
+    def add_rate_limit_headers(response):
+        result = g.get("rate_limit")
+        if result is not None:
+            response.headers["X-RateLimit-Limit"] = str(result["limit"])
+            response.headers["X-RateLimit-Remaining"] = str(result["remaining"])
+            response.headers["X-RateLimit-Reset"] = str(result["reset"])
+        return response
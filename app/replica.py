@@ -0,0 +1,167 @@
+"""
+replica.py
+----------
+
+Read-replica routing. When `SQLALCHEMY_REPLICA_URI` is configured it is added as
+the "replica" bind, and SELECTs issued by routes decorated with `@read_replica`
+go to it instead of the primary. Everything else (writes, flushes, reads on
+undecorated routes) stays on the primary.
+
+Read-your-writes: when a request writes, the writer (the Clerk user, or the API
+key for requests without one) is pinned to the primary for `REPLICA_STICKY_SECONDS`, which should exceed the
+replica lag, so their next reads see their own changes. The pins live in process
+memory, or in Redis when `REPLICA_STICKY_STORAGE_URL` is set so they hold across
+workers. If Redis cannot be reached, reads go to the primary.
+
+Functions:
+- `init_replica(app)`: Registers the hooks that record writes and pin writers.
+- `mark_write()`: Records a write that bypasses the session's flush.
+- `read_replica(f)`: Route decorator. Apply below the auth decorators so the
+  writer pins can be checked.
+
+Classes:
+- `RoutingSession`: The `db.session` class, which picks the engine per statement.
+"""
+
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and has_request_context() and g.get("use_replica") and not g.get("db_wrote")):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class MemoryPins:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._until = {}
+
+    def pin(self, keys, seconds):
+        until = time.monotonic() + seconds
+        with self._lock:
+            for key in keys:
+                self._until[key] = until
+            if len(self._until) > self.max_keys:
+                now = time.monotonic()
+                self._until = {key: until for key, until in self._until.items() if until > now}
+
+    def is_pinned(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return any(self._until.get(key, 0) > now for key in keys)
+
+
+class RedisPins:
+    def __init__(self, url, prefix="gptflask:replica-pin:"):
+        # Optional dependency, only needed when pins are shared between workers.
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def pin(self, keys, seconds):
+        try:
+            pipeline = self._client.pipeline()
+            for key in keys:
+                pipeline.set(self.prefix + key, 1, px=int(seconds * 1000))
+            pipeline.execute()
+        except Exception:
+            logger.warning("Replica pin storage unavailable", exc_info=True)
+
+    def is_pinned(self, keys):
+        try:
+            return bool(self._client.exists(*[self.prefix + key for key in keys]))
+        except Exception:
+            logger.warning("Replica pin storage unavailable, reading from primary", exc_info=True)
+            return True
+
+
+_pins = MemoryPins()
+
+
+def _writer_keys():
+    """
+    The pin of the caller: the Clerk user if there is one, else the API key.
+    All users of the frontend share one API key, so pinning it for their writes
+    would send everyone's reads to the primary.
+    """
+    if g.get("user_id") is not None:
+        return [f"user:{g.user_id}"]
+    if g.get("api_key_id") is not None:
+        return [f"api_key:{g.api_key_id}"]
+    return []
+
+
+def read_replica(f):
+    """
+    A decorator that sends the route's SELECTs to the read replica, unless the
+    caller wrote recently and is pinned to the primary.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if REPLICA_BIND in current_app.config.get("SQLALCHEMY_BINDS", {}):
+            keys = _writer_keys()
+            g.use_replica = not (keys and _pins.is_pinned(keys))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def mark_write():
+    """
+    Records that the current request wrote, for writes that do not flush the
+    session (ORM bulk INSERT/UPDATE statements): its later reads go to the
+    primary and the writer is pinned to it.
+    """
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _record_write(session, flush_context):
+    mark_write()
+
+
+_session_hooks_installed = False
+
+
+def init_replica(app):
+    global _pins, _session_hooks_installed
+
+    if REPLICA_BIND not in app.config.get("SQLALCHEMY_BINDS", {}):
+        return
+
+    storage_url = app.config.get("REPLICA_STICKY_STORAGE_URL")
+    _pins = RedisPins(storage_url) if storage_url else MemoryPins()
+    if not _session_hooks_installed:
+        event.listen(RoutingSession, "after_flush", _record_write)
+        _session_hooks_installed = True
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if g.get("db_wrote"):
+            keys = _writer_keys()
+            if keys:
+                _pins.pin(keys, app.config.get("REPLICA_STICKY_SECONDS", 10))
+        return response
+
+    @app.teardown_request
+    def clear_routing(exc):
+        g.pop("use_replica", None)
+        g.pop("db_wrote", None)
@@ -0,0 +1,296 @@
+"""
+search.py
+---------
+
+Full-text search over saved conversations. Each `ConversationHistory` row has a
+row in the `conversation_search` table holding its title and the text of its
+messages:
+
+- PostgreSQL: a plain table with a generated `tsvector` column (title weighted
+  above the message text) and a GIN index on it, ranked with `ts_rank_cd` and
+  highlighted with `ts_headline`.
+- SQLite (tests, single-node use): an FTS5 virtual table keyed by the
+  conversation id, ranked with `bm25` and highlighted with `snippet`.
+
+The index is kept up to date by a session flush hook as conversations are
+created, retitled, extended and deleted, in the same transaction. Only created
+and retitled conversations are indexed from all their messages; when messages
+are added to a conversation, just their text is appended to its row (up to
+MAX_BODY_CHARS), so saving a turn does not read the earlier ones back. Rows
+saved before the search table existed are indexed by `flask search-reindex`.
+
+Snippets are HTML-escaped, with the matched terms wrapped in `<mark>` tags.
+
+Functions:
+- `search_conversations(user_id, query, limit, offset)`: Ranked matches among
+  the user's conversations.
+- `conversation_text(messages)`: The text of a list of chat messages.
+- `conversation_documents(connection, conversation_ids)`: Owner, title and text per conversation.
+- `changed_conversations(session)`: Conversations touched by the last flush.
+- `reindex_conversations(batch_size)`: Rebuilds the whole index.
+"""
+
+import html
+import re
+
+import orjson
+
+from sqlalchemy import DDL, DateTime, Float, Integer, Text, event, inspect, select, text
+
+from .model import ConversationHistory, ConversationMessage, db
+from .replica import RoutingSession
+
+SEARCH_TABLE = "conversation_search"
+SEARCH_CONFIG = "english"
+# to_tsvector rejects documents over 1 MB; nobody searches that deep into a chat anyway.
+MAX_BODY_CHARS = 200000
+MAX_TERMS = 16
+MAX_SEARCH_PAGE_SIZE = 50
+TERM = re.compile(r"\w+", re.UNICODE)
+# Control characters mark matches so the snippet can be escaped before they
+# become <mark> tags.
+MARK_START, MARK_END = "\x02", "\x03"
+
+CREATE_STATEMENTS = {
+    "postgresql": [
+        f"""CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+            conversation_id INTEGER PRIMARY KEY REFERENCES conversation_history (id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL DEFAULT '',
+            body TEXT NOT NULL DEFAULT '',
+            document tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') ||
+                setweight(to_tsvector('{SEARCH_CONFIG}', body), 'B')
+            ) STORED
+        )""",
+        f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)",
+        f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_user_id ON {SEARCH_TABLE} (user_id)",
+    ],
+    "sqlite": [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+            USING fts5(title, body, user_id UNINDEXED, tokenize = 'porter unicode61')""",
+    ],
+}
+
+UPSERT_STATEMENTS = {
+    "postgresql": [
+        f"""INSERT INTO {SEARCH_TABLE} (conversation_id, user_id, title, body)
+            VALUES (:id, :user_id, :title, :body)
+            ON CONFLICT (conversation_id) DO UPDATE
+            SET user_id = excluded.user_id, title = excluded.title, body = excluded.body""",
+    ],
+    "sqlite": [
+        f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id",
+        f"INSERT INTO {SEARCH_TABLE} (rowid, user_id, title, body) VALUES (:id, :user_id, :title, :body)",
+    ],
+}
+
+# Adds the text of new messages to a row. FTS5 applies an UPDATE as a delete
+# and an insert of the row, so only this row's terms are re-tokenized.
+APPEND_STATEMENTS = {
+    "postgresql": f"""UPDATE {SEARCH_TABLE}
+        SET body = left(concat_ws(chr(10), nullif(body, ''), :delta), {MAX_BODY_CHARS})
+        WHERE conversation_id = :id AND length(body) < {MAX_BODY_CHARS}""",
+    "sqlite": f"""UPDATE {SEARCH_TABLE}
+        SET body = substr(CASE WHEN body = '' THEN :delta ELSE body || char(10) || :delta END, 1, {MAX_BODY_CHARS})
+        WHERE rowid = :id AND length(body) < {MAX_BODY_CHARS}""",
+}
+
+# PostgreSQL removes the row through ON DELETE CASCADE.
+DELETE_STATEMENTS = {
+    "sqlite": f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id",
+}
+
+# Headlines are only computed for the page of results, not every match.
+SEARCH_QUERIES = {
+    "postgresql": f"""
+        SELECT page.id, page.title, page.timestamp, page.rank,
+               ts_headline('{SEARCH_CONFIG}', page.body, page.query, :headline_options) AS snippet
+        FROM (
+            SELECT s.conversation_id AS id, s.title, s.body, h.timestamp,
+                   ts_rank_cd(s.document, q.query) AS rank, q.query
+            FROM {SEARCH_TABLE} s
+            JOIN conversation_history h ON h.id = s.conversation_id,
+                 plainto_tsquery('{SEARCH_CONFIG}', :terms) AS q(query)
+            WHERE s.user_id = :user_id AND s.document @@ q.query
+            ORDER BY rank DESC, s.conversation_id DESC
+            LIMIT :limit OFFSET :offset
+        ) page
+        ORDER BY page.rank DESC, page.id DESC""",
+    "sqlite": f"""
+        SELECT {SEARCH_TABLE}.rowid AS id, {SEARCH_TABLE}.title, h.timestamp,
+               bm25({SEARCH_TABLE}, 10.0, 1.0) AS rank,
+               snippet({SEARCH_TABLE}, -1, char(2), char(3), '...', 16) AS snippet
+        FROM {SEARCH_TABLE}
+        JOIN conversation_history h ON h.id = {SEARCH_TABLE}.rowid
+        WHERE {SEARCH_TABLE} MATCH :terms AND {SEARCH_TABLE}.user_id = :user_id
+        ORDER BY rank, {SEARCH_TABLE}.rowid DESC
+        LIMIT :limit OFFSET :offset""",
+}
+
+HEADLINE_OPTIONS = f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords=30, MinWords=10, MaxFragments=2"
+
+
+def message_text(message):
+    """The text of one chat message; images and other non-text parts are skipped."""
+    content = message.get("content") if isinstance(message, dict) else None
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(part["text"] for part in content
+                         if isinstance(part, dict) and isinstance(part.get("text"), str))
+    return ""
+
+
+def conversation_text(messages):
+    """Joins the text of a conversation's messages."""
+    return "\n".join(filter(None, (message_text(message) for message in messages)))[:MAX_BODY_CHARS]
+
+
+def conversation_documents(connection, conversation_ids):
+    """
+    Reads (user_id, title, message text) for each conversation id through
+    `connection`, which may be mid-flush.
+    """
+    if not conversation_ids:
+        return {}
+    documents = {row.id: (row.user_id, row.title or "", []) for row in connection.execute(
+        select(ConversationHistory.id, ConversationHistory.user_id, ConversationHistory.title)
+        .where(ConversationHistory.id.in_(conversation_ids)))}
+    for row in connection.execute(
+            select(ConversationMessage.conversation_id, ConversationMessage.message)
+            .where(ConversationMessage.conversation_id.in_(conversation_ids))
+            .order_by(ConversationMessage.conversation_id, ConversationMessage.sequence)):
+        documents[row.conversation_id][2].append(orjson.loads(row.message))
+    return {conversation_id: (user_id, title, conversation_text(messages))
+            for conversation_id, (user_id, title, messages) in documents.items()}
+
+
+def _retitled(session):
+    """Ids of the conversations whose owner or title changed in the flush."""
+    for obj in session.dirty:
+        if isinstance(obj, ConversationHistory):
+            state = inspect(obj)
+            if state.attrs.user_id.history.has_changes() or state.attrs.title.history.has_changes():
+                yield obj.id
+
+
+def changed_conversations(session):
+    """
+    For after_flush listeners: ids of the conversations whose owner, title or
+    messages changed in the flush, and ids of the deleted ones.
+    """
+    changed, deleted = set(), set()
+    for obj in session.new:
+        if isinstance(obj, ConversationHistory):
+            changed.add(obj.id)
+        elif isinstance(obj, ConversationMessage):
+            changed.add(obj.conversation_id)
+    changed.update(_retitled(session))
+    for obj in session.deleted:
+        if isinstance(obj, ConversationHistory):
+            deleted.add(obj.id)
+    return changed - deleted, deleted
+
+
+def _index_documents(connection, documents):
+    for conversation_id, (user_id, title, body) in documents.items():
+        for statement in UPSERT_STATEMENTS[connection.dialect.name]:
+            connection.execute(text(statement), {"id": conversation_id, "user_id": user_id,
+                                                 "title": title, "body": body})
+
+
+def _new_message_text(session, skipped):
+    """The text of the messages added in the flush, per conversation not in `skipped`."""
+    added = {}
+    for obj in session.new:
+        if isinstance(obj, ConversationMessage) and obj.conversation_id not in skipped:
+            added.setdefault(obj.conversation_id, []).append(obj)
+    deltas = {}
+    for conversation_id, rows in added.items():
+        delta = conversation_text(orjson.loads(row.message) for row in sorted(rows, key=lambda row: row.sequence))
+        if delta:
+            deltas[conversation_id] = delta
+    return deltas
+
+
+def _update_index(session, flush_context):
+    changed, deleted = changed_conversations(session)
+    if not changed and not deleted:
+        return
+    connection = session.connection(bind_arguments={"mapper": ConversationHistory.__mapper__})
+    dialect = connection.dialect.name
+    if dialect not in UPSERT_STATEMENTS:
+        return
+    delete_statement = DELETE_STATEMENTS.get(dialect)
+    if delete_statement:
+        for conversation_id in deleted:
+            connection.execute(text(delete_statement), {"id": conversation_id})
+    # New or retitled conversations get their whole row written; the others
+    # only had messages added.
+    rebuilt = {obj.id for obj in session.new if isinstance(obj, ConversationHistory)}
+    rebuilt.update(_retitled(session))
+    rebuilt -= deleted
+    for conversation_id, delta in _new_message_text(session, rebuilt | deleted).items():
+        connection.execute(text(APPEND_STATEMENTS[dialect]), {"id": conversation_id, "delta": delta})
+    _index_documents(connection, conversation_documents(connection, rebuilt))
+
+
+# Runs inside the flush, so the index commits or rolls back with the chat.
+event.listen(RoutingSession, "after_flush", _update_index)
+
+# db.create_all() (tests, the load test) creates the search table with the history table.
+for _dialect, _statements in CREATE_STATEMENTS.items():
+    for _statement in _statements:
+        event.listen(ConversationHistory.__table__, "after_create",
+                     DDL(_statement).execute_if(dialect=_dialect))
+event.listen(ConversationHistory.__table__, "before_drop", DDL(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+
+
+def _highlight(snippet):
+    return html.escape(snippet or "").replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def search_conversations(user_id, query, limit=20, offset=0):
+    """
+    Returns the user's conversations matching every word of `query`, best
+    match first, as dicts with id, title, timestamp, rank and snippet.
+    """
+    terms = TERM.findall(query or "")[:MAX_TERMS]
+    connection = db.session.connection(bind_arguments={"mapper": ConversationHistory.__mapper__})
+    dialect = connection.dialect.name
+    if not terms or dialect not in SEARCH_QUERIES:
+        return []
+
+    if dialect == "sqlite":
+        # Quoted, so words like AND, OR or NEAR are not read as operators.
+        terms = " ".join(f'"{term}"' for term in terms)
+    else:
+        terms = " ".join(terms)
+    statement = text(SEARCH_QUERIES[dialect]).columns(
+        id=Integer, title=Text, timestamp=DateTime, rank=Float, snippet=Text)
+    rows = connection.execute(statement, {
+        "terms": terms, "user_id": user_id, "limit": limit, "offset": offset,
+        "headline_options": HEADLINE_OPTIONS,
+    })
+    return [{
+        "id": row.id,
+        "title": row.title,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        # bm25 scores are lower for better matches.
+        "rank": round(-row.rank if dialect == "sqlite" else row.rank, 6),
+        "snippet": _highlight(row.snippet),
+    } for row in rows]
+
+
+def reindex_conversations(batch_size=500):
+    """Rebuilds the search index from all saved conversations. Returns the number indexed."""
+    connection = db.session.connection(bind_arguments={"mapper": ConversationHistory.__mapper__})
+    if connection.dialect.name not in UPSERT_STATEMENTS:
+        return 0
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    conversation_ids = db.session.scalars(select(ConversationHistory.id).order_by(ConversationHistory.id)).all()
+    for start in range(0, len(conversation_ids), batch_size):
+        _index_documents(connection, conversation_documents(connection, conversation_ids[start:start + batch_size]))
+    db.session.commit()
+    return len(conversation_ids)
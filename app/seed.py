@@ -0,0 +1,71 @@
+"""
+seed.py
+-------
+
+Loads the default catalog (render types, API vendors, the admin user, personas,
+output formats and models) from app/data/defaults.json, through the app's
+SQLAlchemy engine, so it works on any configured database, SQLite included.
+
+Rows missing from the database are inserted, matched on their natural key,
+with the batched statements of app/bulk.py, all in one transaction. Rows that
+already exist are left alone, so edits made since (a persona's prompt, the
+admin user's email or admin flag) survive every deploy. `force=True`
+overwrites them with the file's values instead. Output formats and models
+name their render type and API vendor, which are seeded first.
+
+The admin user only exists to own things; sign-in goes through Clerk. It gets a
+random password when created.
+
+Functions:
+- `seed_defaults(path, force)`: Loads a defaults file and returns per-table counts.
+"""
+
+import os
+
+import orjson
+
+from .bulk import upsert, upsert_catalog
+from .catalog import invalidate_catalogs
+from .model import APIVendor, RenderType, Users, db
+from .utils import generate_random_password
+
+DEFAULTS_PATH = os.path.join(os.path.dirname(__file__), "data", "defaults.json")
+
+# Tables without a bulk import catalog, as (model, natural key), in load order
+BASE_TABLES = {
+    "render_types": (RenderType, ("name",)),
+    "api_vendors": (APIVendor, ("name",)),
+    "users": (Users, ("username",)),
+}
+# Sections of the file loaded through app/bulk.py, and their catalog names
+CATALOG_SECTIONS = {"personas": "personas", "output_formats": "output-formats", "models": "models"}
+
+
+def seed_defaults(path=DEFAULTS_PATH, force=False):
+    """
+    Inserts the missing rows of every section of the defaults file in one
+    transaction, or with `force` also updates the existing rows that differ,
+    and returns the inserted, updated and unchanged counts per section. Raises
+    BulkImportError if a catalog row does not validate; nothing is written then.
+    """
+    with open(path, "rb") as defaults_file:
+        defaults = orjson.loads(defaults_file.read())
+
+    counts = {}
+    try:
+        for section, (model, key) in BASE_TABLES.items():
+            rows = defaults.get(section, [])
+            if rows:
+                insert_defaults = {"password": generate_random_password()} if model is Users else None
+                counts[section] = upsert(model, key, rows, insert_defaults, update_existing=force)
+        for section, catalog in CATALOG_SECTIONS.items():
+            rows = defaults.get(section, [])
+            if rows:
+                counts[section] = upsert_catalog(catalog, rows, update_existing=force)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if any(count["inserted"] or count["updated"] for count in counts.values()):
+        invalidate_catalogs()
+    return counts
@@ -0,0 +1,452 @@
+"""
+semantic.py
+-----------
+
+Semantic (embedding) search over saved conversations, without a vector
+database. Each conversation's title and message text are embedded into a unit
+float32 vector, and every user's vectors live in their own shard under
+`SEMANTIC_INDEX_DIR`:
+
+- `user-<id>.f32`: the vectors, one row of `dim` float32 values per conversation.
+- `user-<id>.ids`: the matching conversation ids as int64.
+
+A query memory-maps the caller's shard, scores all rows with one matrix-vector
+product (cosine similarity, since the vectors are normalized) and picks the top
+k with `argpartition`.
+
+Saved chats are embedded off the request path: the commit that stores a chat
+only queues its id, and a background thread (`embed_queue`) embeds the queued
+chats every SEMANTIC_EMBED_INTERVAL seconds. A chat saved several times in
+between is embedded once. A chat already in its shard has its row overwritten
+in place, others are appended, under an exclusive `flock` on the shard so
+workers can share the directory; shards keep one row per chat. Deleted chats
+are dropped when results are matched against the database. Chats still queued
+when a worker exits are picked up by `flask semantic-reindex`, which rewrites
+all shards.
+
+Embedders (`SEMANTIC_EMBEDDER`):
+- `hashing` (default): a deterministic feature-hashing embedder over word
+  unigrams and bigrams. It runs offline, needs no model and costs no tokens.
+- `openai`: the OpenAI embeddings API (`SEMANTIC_OPENAI_MODEL`).
+
+`meta.json` records the embedder and dimension the shards were built with. If
+the configuration changes, semantic search is off until the index is rebuilt.
+
+Functions:
+- `init_semantic(app)`: Opens the index and queues saved chats for embedding on commit.
+- `semantic_search(user_id, query, limit)`: (conversation id, score) pairs, best first.
+- `reindex_semantic(batch_size)`: Re-embeds every saved conversation.
+- `semantic_enabled()`: Whether semantic search is configured and usable.
+
+Classes:
+- `HashingEmbedder`, `OpenAIEmbedder`: Turn lists of texts into unit vectors.
+- `ShardedVectorIndex`: The per-user shard files.
+- `EmbedQueue`: Chats waiting to be embedded, and the thread that embeds them.
+
+Objects:
+- `embed_queue`: The process-wide `EmbedQueue`. Call `embed_queue.flush()` to
+  embed the queued chats synchronously (tests).
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+
+import numpy as np
+from sqlalchemy import event, select
+
+from .metrics import observe_vendor
+from .model import ConversationHistory, db
+from .replica import RoutingSession
+from .search import changed_conversations, conversation_documents
+from .utils import openai_usage
+from .vendors import openai_sdk
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can do for from how i in is it me my of on or "
+    "so that the this to was we what when where which who why will with you your".split())
+# The OpenAI embedding models accept about 8k tokens.
+MAX_EMBED_CHARS = 24000
+
+
+def _stem(word):
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+class HashingEmbedder:
+    """
+    Hashes word unigrams and bigrams into `dim` signed buckets, damps repeated
+    features logarithmically and normalizes. Texts sharing vocabulary land close
+    together; the result is the same in every process and on every machine.
+    """
+    name = "hashing"
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def _hash(feature):
+        return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [_stem(word) for word in TOKEN.findall(text.lower()) if word not in STOP_WORDS]
+            for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+                value = self._hash(feature)
+                matrix[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        return _normalize(matrix)
+
+
+class OpenAIEmbedder:
+    name = "openai"
+
+    def __init__(self, model="text-embedding-3-small", dim=1536):
+        self.model = model
+        self.dim = dim
+
+    def embed(self, texts):
+        with observe_vendor("openai", self.model) as call:
+            response = openai_sdk().Embedding.create(
+                model=self.model, input=[text[:MAX_EMBED_CHARS] or " " for text in texts])
+            # Embeddings bill input tokens only, reported like a chat prompt.
+            call.record_usage(openai_usage(response))
+        items = sorted(response["data"], key=lambda item: item["index"])
+        return _normalize(np.array([item["embedding"] for item in items], dtype=np.float32))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class ShardedVectorIndex:
+    def __init__(self, directory, dim):
+        self.directory = directory
+        self.dim = dim
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, user_id):
+        base = os.path.join(self.directory, f"user-{int(user_id)}")
+        return f"{base}.f32", f"{base}.ids"
+
+    def upsert(self, user_id, ids, vectors):
+        """Overwrites the rows of the ids already in the shard and appends the others."""
+        vectors_path, ids_path = self._paths(user_id)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        row_size = 4 * self.dim
+        with open(ids_path, "ab") as ids_file:
+            fcntl.flock(ids_file, fcntl.LOCK_EX)
+            try:
+                stored = np.fromfile(ids_path, dtype=np.int64)
+                new_ids, new_rows = [], []
+                with open(vectors_path, "r+b" if os.path.exists(vectors_path) else "w+b") as vectors_file:
+                    # Drops vectors a crash left without an id; readers never map those.
+                    vectors_file.truncate(len(stored) * row_size)
+                    for conversation_id, vector in zip(ids, vectors):
+                        rows = np.flatnonzero(stored == conversation_id)
+                        if len(rows):
+                            vectors_file.seek(int(rows[-1]) * row_size)
+                            vectors_file.write(vector.tobytes())
+                        else:
+                            new_ids.append(conversation_id)
+                            new_rows.append(vector)
+                    if new_rows:
+                        vectors_file.seek(len(stored) * row_size)
+                        vectors_file.write(np.vstack(new_rows).tobytes())
+                # Ids last: a reader never sees an id without its vector.
+                if new_ids:
+                    ids_file.write(np.asarray(new_ids, dtype=np.int64).tobytes())
+            finally:
+                fcntl.flock(ids_file, fcntl.LOCK_UN)
+
+    def replace(self, user_id, ids, vectors):
+        vectors_path, ids_path = self._paths(user_id)
+        for path, array in ((vectors_path, np.ascontiguousarray(vectors, dtype=np.float32)),
+                            (ids_path, np.asarray(ids, dtype=np.int64))):
+            with open(f"{path}.tmp", "wb") as shard_file:
+                shard_file.write(array.tobytes())
+            os.replace(f"{path}.tmp", path)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.startswith("user-"):
+                os.remove(os.path.join(self.directory, name))
+
+    def load(self, user_id):
+        """
+        The shard's ids and a read-only memory map of its vectors. Shards
+        written before rows were overwritten in place can hold an id more than
+        once; its newest vector wins.
+        """
+        vectors_path, ids_path = self._paths(user_id)
+        try:
+            ids = np.fromfile(ids_path, dtype=np.int64)
+            rows = min(len(ids), os.path.getsize(vectors_path) // (4 * self.dim))
+        except FileNotFoundError:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+        if rows == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+        ids = ids[:rows]
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        _, last_from_end = np.unique(ids[::-1], return_index=True)
+        if len(last_from_end) < rows:
+            keep = np.sort(rows - 1 - last_from_end)
+            return ids[keep], vectors[keep]
+        return ids, vectors
+
+    def search(self, user_id, vector, k):
+        ids, vectors = self.load(user_id)
+        if len(ids) == 0:
+            return []
+        scores = vectors @ vector
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[row]), float(scores[row])) for row in top]
+
+
+_directory = None
+_embedder = None
+_index = None
+
+
+def semantic_enabled():
+    return _index is not None
+
+
+def semantic_search(user_id, query, limit=10):
+    if _index is None or not query or not query.strip():
+        return []
+    vector = _embedder.embed([query])[0]
+    return _index.search(user_id, vector, limit)
+
+
+def _documents(connection, conversation_ids):
+    return {conversation_id: (user_id, f"{title}\n{body}")
+            for conversation_id, (user_id, title, body)
+            in conversation_documents(connection, conversation_ids).items()}
+
+
+def _embed_documents(documents):
+    """Embeds {conversation id: (user id, text)} and writes the vectors to the users' shards."""
+    if not documents:
+        return
+    vectors = _embedder.embed([document for _, document in documents.values()])
+    shards = {}
+    for row, (conversation_id, (user_id, _)) in enumerate(documents.items()):
+        ids, rows = shards.setdefault(user_id, ([], []))
+        ids.append(conversation_id)
+        rows.append(row)
+    for user_id, (ids, rows) in shards.items():
+        _index.upsert(user_id, ids, vectors[rows])
+
+
+class EmbedQueue:
+    """
+    Ids of saved chats waiting to be embedded. A daemon thread embeds them
+    every `interval` seconds, or sooner once `batch_size` are queued. The
+    thread is started lazily and restarted after a fork, since threads do not
+    survive it. The chats are read from the database when they are embedded,
+    so the latest version of each is indexed.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 0
+        self.batch_size = 64
+        self.max_pending = 10000
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def configure(self, app):
+        self.app = app
+        self.interval = app.config.get("SEMANTIC_EMBED_INTERVAL", 2)
+        self.batch_size = app.config.get("SEMANTIC_EMBED_BATCH_SIZE", 64)
+
+    def add(self, conversation_ids):
+        with self._lock:
+            for conversation_id in conversation_ids:
+                if len(self._pending) >= self.max_pending:
+                    logger.warning("Semantic embedding queue full, dropping chats",
+                                   extra={"pending": len(self._pending)})
+                    break
+                self._pending[conversation_id] = None
+            pending = len(self._pending)
+        if self.interval > 0:
+            self._ensure_thread()
+            if pending >= self.batch_size:
+                self._wake.set()
+
+    def drain(self):
+        with self._lock:
+            conversation_ids, self._pending = list(self._pending), {}
+        return conversation_ids
+
+    def flush(self):
+        """Embeds all queued chats. Requires an app context. Returns the number embedded."""
+        conversation_ids = self.drain()
+        if not conversation_ids or _index is None:
+            return 0
+        connection = db.session.connection(bind_arguments={"mapper": ConversationHistory.__mapper__})
+        embedded = 0
+        for start in range(0, len(conversation_ids), self.batch_size):
+            try:
+                documents = _documents(connection, conversation_ids[start:start + self.batch_size])
+                _embed_documents(documents)
+                embedded += len(documents)
+            except Exception:
+                # The chats are saved either way; `flask semantic-reindex` catches them up.
+                logger.exception("Failed to add conversations to the semantic index")
+        return embedded
+
+    def _flush_in_app(self):
+        with self.app.app_context():
+            try:
+                self.flush()
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._flush_in_app()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="semantic-embedder", daemon=True)
+            self._thread.start()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._thread = None
+
+
+embed_queue = EmbedQueue()
+
+
+def _collect_conversations(session, flush_context):
+    # Only ids are noted here; nothing is read or embedded on the request path,
+    # and only committed chats are queued.
+    if _index is None:
+        return
+    changed, _ = changed_conversations(session)
+    if changed:
+        session.info.setdefault("semantic_pending", set()).update(changed)
+
+
+def _queue_after_commit(session):
+    conversation_ids = session.info.pop("semantic_pending", None)
+    if conversation_ids and _index is not None:
+        embed_queue.add(sorted(conversation_ids))
+
+
+def _discard_after_rollback(session):
+    session.info.pop("semantic_pending", None)
+
+
+def reindex_semantic(batch_size=200):
+    """Re-embeds every saved conversation into fresh shards. Returns the number indexed."""
+    if _embedder is None:
+        return 0
+    index = ShardedVectorIndex(_directory, _embedder.dim)
+    index.clear()
+    shards = {}
+    # Chats queued so far are read below
+    embed_queue.drain()
+    connection = db.session.connection(bind_arguments={"mapper": ConversationHistory.__mapper__})
+    conversation_ids = db.session.scalars(select(ConversationHistory.id).order_by(ConversationHistory.id)).all()
+    for start in range(0, len(conversation_ids), batch_size):
+        _embed_batch(_documents(connection, conversation_ids[start:start + batch_size]), shards)
+    for user_id, (ids, vectors) in shards.items():
+        index.replace(user_id, ids, np.vstack(vectors))
+    _write_meta(_directory, _embedder)
+    _open_index()
+    return len(conversation_ids)
+
+
+def _embed_batch(documents, shards):
+    vectors = _embedder.embed([document for _, document in documents.values()])
+    for row, (conversation_id, (user_id, _)) in enumerate(documents.items()):
+        ids, user_vectors = shards.setdefault(user_id, ([], []))
+        ids.append(conversation_id)
+        user_vectors.append(vectors[row:row + 1])
+
+
+def _meta(embedder):
+    return {"embedder": embedder.name, "dim": embedder.dim, "model": getattr(embedder, "model", None)}
+
+
+def _write_meta(directory, embedder):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+        json.dump(_meta(embedder), meta_file)
+
+
+def _open_index():
+    global _index
+    _index = None
+    meta_path = os.path.join(_directory, "meta.json")
+    if not os.path.exists(meta_path):
+        _write_meta(_directory, _embedder)
+    with open(meta_path) as meta_file:
+        meta = json.load(meta_file)
+    if meta != _meta(_embedder):
+        logger.warning("Semantic index was built with another embedder, run `flask semantic-reindex`",
+                       extra={"index": meta, "configured": _meta(_embedder)})
+        return
+    _index = ShardedVectorIndex(_directory, _embedder.dim)
+
+
+_session_hooks_installed = False
+
+
+def init_semantic(app):
+    global _embedder, _directory, _index, _session_hooks_installed
+
+    _directory = app.config.get("SEMANTIC_INDEX_DIR")
+    if not _directory:
+        _embedder = _index = None
+        return
+    if not os.path.isabs(_directory):
+        raise ValueError(f"SEMANTIC_INDEX_DIR must be an absolute path, got {_directory!r}")
+    name = app.config.get("SEMANTIC_EMBEDDER", "hashing")
+    dim = app.config.get("SEMANTIC_EMBEDDING_DIM")
+    if name == "hashing":
+        _embedder = HashingEmbedder(dim or 512)
+    elif name == "openai":
+        _embedder = OpenAIEmbedder(app.config.get("SEMANTIC_OPENAI_MODEL", "text-embedding-3-small"), dim or 1536)
+    else:
+        raise ValueError(f"Unknown SEMANTIC_EMBEDDER {name!r}, expected 'hashing' or 'openai'")
+    _open_index()
+    embed_queue.configure(app)
+    if not _session_hooks_installed:
+        event.listen(RoutingSession, "after_flush", _collect_conversations)
+        event.listen(RoutingSession, "after_commit", _queue_after_commit)
+        event.listen(RoutingSession, "after_rollback", _discard_after_rollback)
+        _session_hooks_installed = True
@@ -0,0 +1,170 @@
+"""
+timing.py
+---------
+
+Per-request phase timing reported through the `Server-Timing` response header,
+so browser devtools show where a request spent its time.
+
+Code marks phases with `span(name)` (or the `timed(name)` decorator); SQL time is
+added by the engine hooks through `add_db_time()`. The header carries the total
+per phase (auth, clerk, db, prompt-build, vendor, serialize) plus the request
+total. Phases may overlap: database time spent inside `prompt-build` is also
+reported under `db`.
+
+When `SERVER_TIMING_DEBUG` is enabled, a request sent with `X-Timing-Debug: 1`
+also gets the full span tree as JSON in the `X-Timing-Tree` response header.
+
+Functions:
+- `init_timing(app)`: Registers the hooks that start the timer and write the headers.
+- `span(name)`: Context manager timing a phase of the current request.
+- `timed(name)`: Decorator form of `span`.
+- `add_db_time(seconds)`: Attributes SQL execution time to the current span.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request
+
+from .jsonprovider import ORJSONProvider
+
+PHASES = ("auth", "clerk", "db", "prompt-build", "vendor", "serialize")
+DEBUG_REQUEST_HEADER = "X-Timing-Debug"
+DEBUG_RESPONSE_HEADER = "X-Timing-Tree"
+
+
+class _Span:
+    __slots__ = ("name", "start", "duration", "db_time", "db_queries", "children")
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.children = []
+
+    def to_dict(self, origin):
+        node = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "dur_ms": round((self.duration or 0) * 1000, 3),
+        }
+        if self.db_queries:
+            node["db_ms"] = round(self.db_time * 1000, 3)
+            node["db_queries"] = self.db_queries
+        if self.children:
+            node["children"] = [child.to_dict(origin) for child in self.children]
+        return node
+
+
+class RequestTiming:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.root = _Span("request", self.origin)
+        self.stack = [self.root]
+        self.phases = {}
+
+    def push(self, name):
+        node = _Span(name, time.perf_counter())
+        self.stack[-1].children.append(node)
+        self.stack.append(node)
+        return node
+
+    def pop(self, node):
+        node.duration = time.perf_counter() - node.start
+        self.stack.pop()
+        # A phase nested inside a phase of the same name is already counted.
+        if all(ancestor.name != node.name for ancestor in self.stack):
+            self.phases[node.name] = self.phases.get(node.name, 0.0) + node.duration
+
+    def add_db(self, seconds):
+        current = self.stack[-1]
+        current.db_time += seconds
+        current.db_queries += 1
+        self.phases["db"] = self.phases.get("db", 0.0) + seconds
+
+    def finish(self):
+        self.root.duration = time.perf_counter() - self.origin
+
+    def server_timing_header(self):
+        entries = [f"{phase};dur={self.phases[phase] * 1000:.2f}"
+                   for phase in PHASES if phase in self.phases]
+        entries += [f"{name};dur={seconds * 1000:.2f}"
+                    for name, seconds in self.phases.items() if name not in PHASES]
+        entries.append(f"total;dur={self.root.duration * 1000:.2f}")
+        return ", ".join(entries)
+
+    def tree(self):
+        return self.root.to_dict(self.origin)
+
+
+def current_timing():
+    if has_request_context():
+        return g.get("timing")
+    return None
+
+
+@contextmanager
+def span(name):
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+    node = timing.push(name)
+    try:
+        yield
+    finally:
+        timing.pop(node)
+
+
+def timed(name):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def add_db_time(seconds):
+    timing = current_timing()
+    if timing is not None:
+        timing.add_db(seconds)
+
+
+class TimedJSONProvider(ORJSONProvider):
+    """Attributes `jsonify` work to the serialize phase."""
+
+    def dumps_bytes(self, obj, **kwargs):
+        with span("serialize"):
+            return super().dumps_bytes(obj, **kwargs)
+
+
+def init_timing(app):
+    if not app.config.get("SERVER_TIMING_ENABLED", True):
+        return
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_timing():
+        if request.blueprint == "api":
+            g.timing = RequestTiming()
+
+    @app.after_request
+    def add_server_timing(response):
+        timing = g.pop("timing", None)
+        if timing is None:
+            return response
+        timing.finish()
+        response.headers["Server-Timing"] = timing.server_timing_header()
+        allow_origin = app.config.get("SERVER_TIMING_ALLOW_ORIGIN")
+        if allow_origin:
+            response.headers["Timing-Allow-Origin"] = allow_origin
+        if app.config.get("SERVER_TIMING_DEBUG") and request.headers.get(DEBUG_REQUEST_HEADER) == "1":
+            response.headers[DEBUG_RESPONSE_HEADER] = json.dumps(timing.tree(), separators=(",", ":"))
+        return response
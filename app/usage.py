@@ -0,0 +1,208 @@
+"""
+usage.py
+--------
+
+Per-user, per-model token accounting. Every finished vendor call (see
+`observe_vendor` in app/metrics.py), failed or not, is turned into a `TokenUsage` row that is
+buffered in memory and written in batches by a background flusher thread, so
+accounting adds no database round-trip to the chat path.
+
+Rows are attributed to the Clerk user and API key that authenticated the
+request (`g.user_id` and `g.api_key_id`, set by the auth decorators in app/api.py).
+
+Functions:
+- `init_usage(app)`: Hooks the ledger into vendor calls and configures the flusher.
+- `aggregate_usage(start, end, group_by)`: Token totals grouped by user, model and/or day.
+
+Objects:
+- `usage_buffer`: The process-wide `UsageBuffer`. Call `usage_buffer.flush()` to
+  write pending rows synchronously (tests, shutdown).
+"""
+
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import func, insert
+
+from .metrics import TOKEN_KINDS, on_vendor_call
+from .model import TokenUsage, db
+
+logger = logging.getLogger(__name__)
+
+USAGE_GROUPS = ("user", "model", "vendor", "day")
+
+
+class UsageBuffer:
+    """
+    Collects ledger rows in memory. A daemon thread flushes them every
+    `interval` seconds, or sooner once `batch_size` rows are pending. The thread
+    is started lazily and restarted after a fork, since threads do not survive it.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 0
+        self.batch_size = 500
+        self.max_pending = 50000
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def configure(self, app):
+        self.app = app
+        self.interval = app.config.get("USAGE_FLUSH_INTERVAL", 5)
+        self.batch_size = app.config.get("USAGE_FLUSH_BATCH_SIZE", 500)
+        self.max_pending = app.config.get("USAGE_MAX_PENDING", 50000)
+
+    def add(self, row):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                logger.warning("Token usage buffer full, dropping row", extra={"pending": len(self._pending)})
+                return
+            self._pending.append(row)
+            pending = len(self._pending)
+        if self.interval > 0:
+            self._ensure_thread()
+            if pending >= self.batch_size:
+                self._wake.set()
+
+    def drain(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        return rows
+
+    def flush(self):
+        """Writes all pending rows in one INSERT. Requires an app context."""
+        rows = self.drain()
+        if not rows:
+            return 0
+        try:
+            db.session.execute(insert(TokenUsage), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Failed to write token usage batch", extra={"rows": len(rows)})
+            with self._lock:
+                # Keep the rows for the next attempt, within the buffer bound.
+                self._pending = (rows + self._pending)[:self.max_pending]
+            return 0
+        return len(rows)
+
+    def _flush_in_app(self):
+        with self.app.app_context():
+            self.flush()
+            db.session.remove()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._flush_in_app()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="usage-flusher", daemon=True)
+            self._thread.start()
+
+    def reset_after_fork(self):
+        """
+        Called in a freshly forked worker: the pending rows are the master's to
+        write, and its lock may have been held mid-fork.
+        """
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        self._thread = None
+
+    def shutdown(self):
+        if self.app is not None and self._pending:
+            self._flush_in_app()
+
+
+usage_buffer = UsageBuffer()
+
+
+def record_vendor_call(call):
+    # Every call gets a row, including failed ones and those without token
+    # usage (image generation, streams cut off early), so request counts and
+    # latencies are complete.
+    row = {
+        "api_vendor": call.vendor,
+        "model_api_name": call.model,
+        "user_id": None,
+        "api_key_id": None,
+        "endpoint": None,
+        "outcome": call.outcome,
+        "latency_ms": round(call.duration * 1000) if call.duration is not None else None,
+        "timestamp": datetime.utcnow(),
+        **{f"{kind}_tokens": 0 for kind in TOKEN_KINDS},
+    }
+    if call.usage:
+        row.update({key: value or 0 for key, value in call.usage.items()})
+    if has_request_context():
+        row["user_id"] = g.get("user_id")
+        row["api_key_id"] = g.get("api_key_id")
+        row["endpoint"] = request.endpoint
+    usage_buffer.add(row)
+
+
+def init_usage(app):
+    if usage_buffer.app is None:
+        atexit.register(usage_buffer.shutdown)
+    usage_buffer.configure(app)
+    on_vendor_call(record_vendor_call)
+
+
+def aggregate_usage(start=None, end=None, group_by=("user", "model")):
+    """
+    Token totals from the ledger.
+
+    Args:
+        start (datetime): Inclusive lower bound on the call timestamp, or None.
+        end (datetime): Exclusive upper bound on the call timestamp, or None.
+        group_by (iterable): Any of "user", "model", "vendor" and "day".
+
+    Returns:
+        list: One dict per group with the group keys, the request count and the
+        summed input, output, thinking and cached tokens.
+    """
+    columns = {
+        "user": TokenUsage.user_id.label("user_id"),
+        "model": TokenUsage.model_api_name.label("model_api_name"),
+        "vendor": TokenUsage.api_vendor.label("api_vendor"),
+        "day": func.date(TokenUsage.timestamp).label("day"),
+    }
+    group_columns = [columns[group] for group in group_by]
+    query = db.session.query(
+        *group_columns,
+        func.count(TokenUsage.id).label("requests"),
+        func.coalesce(func.sum(TokenUsage.input_tokens), 0).label("input_tokens"),
+        func.coalesce(func.sum(TokenUsage.output_tokens), 0).label("output_tokens"),
+        func.coalesce(func.sum(TokenUsage.thinking_tokens), 0).label("thinking_tokens"),
+        func.coalesce(func.sum(TokenUsage.cached_tokens), 0).label("cached_tokens"),
+    )
+    if start is not None:
+        query = query.filter(TokenUsage.timestamp >= start)
+    if end is not None:
+        query = query.filter(TokenUsage.timestamp < end)
+    if group_columns:
+        query = query.group_by(*group_columns).order_by(*group_columns)
+
+    results = []
+    for row in query.all():
+        result = dict(row._mapping)
+        if "day" in result and result["day"] is not None:
+            result["day"] = str(result["day"])
+        results.append(result)
+    return results
@@ -6,69 +6,64 @@ Utility module for a Flask application providing essential functionalities inclu
 data serialization to JSON format, password generation, and API key handling.
 
 Functions:
-- `personas_json(personas)`: Converts a list of persona objects to JSON format.
-- `models_json(models)`: Converts a list of model objects to JSON format.
-- `output_formats_json(output_formats)`: Converts a list of output format objects to JSON format.
-- `render_types_json(render_types)`: Converts a list of render type objects to JSON format.
-- `api_vendors_json(api_vendors)`: Converts a list of API vendor objects to JSON format.
+- `personas_json(personas)`: Converts a list of persona objects to JSON bytes.
+- `models_json(models)`: Converts a list of model objects to JSON bytes.
+- `output_formats_json(output_formats)`: Converts a list of output format objects to JSON bytes.
+- `render_types_json(render_types)`: Converts a list of render type objects to JSON bytes.
+- `api_vendors_json(api_vendors)`: Converts a list of API vendor objects to JSON bytes.
 - `generate_random_password()`: Generates a random password. 
   Used for accounts created via Google authentication, where a password is required but not used.
-- `get_single_api_key()`: Retrieves the first API key from the database.
+- `get_or_create_user_settings(user_id)`: Upserts and returns the user's settings row.
+- `get_single_api_key()`: Returns the first API key in the database that insert_api_key created.
 - `insert_api_key()`: Generates a new API key, adds it to the database with a 'test' name,
   and commits the change.
 
-The module uses `json` for serialization, `os` and `string` for password generation,
+The module uses orjson (through app/jsonprovider.py) for serialization, `os` and `string` for password generation,
 and custom functions and models for API key handling.
 """
 
-import json
+import logging
 import os
 import string
-from anthropic import Anthropic
-import openai
-import google.generativeai as genai
-from dotenv import load_dotenv
 
-from generate_api_key import generate_api_key
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
+from .apikeys import generate_api_key
+from .jsonprovider import dumps_bytes
+from .log import redact
+from .metrics import observe_vendor
+from .timing import timed
+from .vendors import anthropic_client, genai_sdk, openai_sdk
 from .model import APIKey, db, UserSettings, Model
 
+logger = logging.getLogger(__name__)
 
+
+@timed("serialize")
 def personas_json(personas):
-    persona_array = []
-    for persona in personas:
-        persona_obj = persona.to_dict()
-        persona_array.append(persona_obj)
-    return json.dumps(persona_array)
+    return dumps_bytes([persona.to_dict() for persona in personas])
 
 
+@timed("serialize")
 def models_json(models):
-    models_array = []
-    for model in models:
-        models_array.append(model.to_dict())
-    return json.dumps(models_array)
+    return dumps_bytes([model.to_dict() for model in models])
 
 
+@timed("serialize")
 def output_formats_json(output_formats):
-    output_formats_array = []
-    for output_format in output_formats:
-        output_format_obj = output_format.to_dict()
-        output_formats_array.append(output_format_obj)
-    return json.dumps(output_formats_array)
+    return dumps_bytes([output_format.to_dict() for output_format in output_formats])
 
 
+@timed("serialize")
 def render_types_json(render_types):
-    render_types_array = []
-    for render_type in render_types:
-        render_types_array.append(render_type.to_dict())
-    return json.dumps(render_types_array)
+    return dumps_bytes([render_type.to_dict() for render_type in render_types])
 
 
+@timed("serialize")
 def api_vendors_json(api_vendors):
-    api_vendors_array = []
-    for api_vendor in api_vendors:
-        api_vendors_array.append(api_vendor.to_dict())
-    return json.dumps(api_vendors_array)
+    return dumps_bytes([api_vendor.to_dict() for api_vendor in api_vendors])
 
 # When an account is created via Google, a password still needs to be created but
 # doesn't need to be used.
@@ -81,9 +76,14 @@ def generate_random_password():
     return ''.join(chars[c % len(chars)] for c in os.urandom(pwd_len))
 
 
+# Plaintext of the keys insert_api_key created in this process, by hash. The
+# database only has the hashes.
+_inserted_api_keys = {}
+
+
 def get_single_api_key():
-    apikey = APIKey.query.first()
-    return apikey.key
+    hashes = select(APIKey.key_hash).where(APIKey.key_hash.in_(_inserted_api_keys)).order_by(APIKey.id)
+    return _inserted_api_keys[db.session.scalars(hashes).first()]
 
 
 def insert_api_key():
@@ -91,13 +91,101 @@ def insert_api_key():
     new_api_key = APIKey(name="test", key=api_key)
     db.session.add(new_api_key)
     db.session.commit()
+    _inserted_api_keys[new_api_key.key_hash] = api_key
+
+
+def get_or_create_user_settings(user_id):
+    """
+    Returns the user's settings row, creating it with the defaults if needed, in
+    a single INSERT ... ON CONFLICT statement. The no-op update on conflict makes
+    RETURNING yield the existing row, and concurrent first requests cannot create
+    a second row (user_id is unique).
+    """
+    dialect = db.session.get_bind(mapper=UserSettings.__mapper__).dialect.name
+    insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+    statement = insert(UserSettings).values(user_id=user_id)
+    statement = statement.on_conflict_do_update(
+        index_elements=[UserSettings.user_id],
+        set_={"user_id": statement.excluded.user_id},
+    ).returning(UserSettings)
+    settings = db.session.execute(
+        select(UserSettings).from_statement(statement),
+        execution_options={"populate_existing": True},
+    ).scalar_one()
+    db.session.commit()
+    return settings
 
 
 def get_summary_model(user_id):
     settings = UserSettings.query.filter_by(user_id=user_id).first()
+    if not settings or not settings.summary_model_preference_id:
+        return None
     return Model.query.get(settings.summary_model_preference_id)
 
 
+def _token_count(value):
+    # Mocked or partial vendor responses may be missing usage fields entirely.
+    return value if isinstance(value, int) else 0
+
+
+def _usage(input_tokens=0, output_tokens=0, thinking_tokens=0, cached_tokens=0):
+    return {
+        "input_tokens": _token_count(input_tokens),
+        "output_tokens": _token_count(output_tokens),
+        "thinking_tokens": _token_count(thinking_tokens),
+        "cached_tokens": _token_count(cached_tokens),
+    }
+
+
+def anthropic_usage(response):
+    """
+    Token usage from an Anthropic messages response. Anthropic bills thinking as
+    output and does not report it separately.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return _usage()
+    return _usage(
+        input_tokens=getattr(usage, "input_tokens", 0),
+        output_tokens=getattr(usage, "output_tokens", 0),
+        cached_tokens=getattr(usage, "cache_read_input_tokens", 0),
+    )
+
+
+def openai_usage(response):
+    """
+    Token usage from an OpenAI chat completion response. Reasoning tokens are
+    reported as thinking and taken out of the output count, matching Gemini.
+    """
+    try:
+        usage = response["usage"]
+    except (KeyError, TypeError):
+        return _usage()
+    completion_details = usage.get("completion_tokens_details") or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    output_tokens = _token_count(usage.get("completion_tokens", 0))
+    thinking_tokens = _token_count(completion_details.get("reasoning_tokens", 0))
+    return _usage(
+        input_tokens=usage.get("prompt_tokens", 0),
+        output_tokens=output_tokens - thinking_tokens,
+        thinking_tokens=thinking_tokens,
+        cached_tokens=prompt_details.get("cached_tokens", 0),
+    )
+
+
+def google_usage(response):
+    """Token usage from a Gemini generate_content response's usage_metadata."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return _usage()
+    return _usage(
+        input_tokens=getattr(usage, "prompt_token_count", 0),
+        output_tokens=getattr(usage, "candidates_token_count", 0),
+        thinking_tokens=getattr(usage, "thoughts_token_count", 0),
+        cached_tokens=getattr(usage, "cached_content_token_count", 0),
+    )
+
+
 def openai_to_google_messages(messages):
     """
     Replace all instances of "content" with "parts" and make it an array
@@ -127,7 +215,6 @@ def openai_to_google_messages(messages):
 
 
 def anthropic_request(request):
-    anthropic_client = Anthropic()
     # Anthropic does not take the system prompt in the message array,
     # so we need to get rid of it
     messages = request["messages"]
@@ -136,10 +223,8 @@ def anthropic_request(request):
     # Anthropic variants support 8192 output tokens. If output token
     # amount is included in the array, use it, otherwise default to 8192.
     # Ensure max_tokens is never None by using the or operator
-    print("Max Tokens:")
-    print(request["max_tokens"])
-    print("Budget Tokens")
-    print(request["budget_tokens"])
+    logger.debug("Anthropic request: max_tokens=%s budget_tokens=%s",
+                 request.get("max_tokens"), request.get("budget_tokens"))
 
     max_tokens = request.get("max_tokens") or 8192
 
@@ -156,15 +241,16 @@ def anthropic_request(request):
 
     # Add thinking parameter only if budget_tokens exists and is greater than 0
     if budget_tokens is not None and budget_tokens > 0:
-        print("THinking budget set. I will enable thinking mode.")
+        logger.debug("Thinking budget set, enabling thinking mode.")
         create_kwargs["thinking"] = {
             "type": "enabled", "budget_tokens": budget_tokens}
     else:
-        print("Thinking mode disabled.")
         create_kwargs["thinking"] = {"type": "disabled"}
 
     # Call Anthropic's client and send the messages with the appropriate parameters
-    response = anthropic_client.messages.create(**create_kwargs)
+    with observe_vendor("anthropic", request["model"]) as call:
+        response = anthropic_client().messages.create(**create_kwargs)
+        call.record_usage(anthropic_usage(response))
 
     # Process the response to include thinking blocks if present
     processed_response = {"role": "assistant"}
@@ -199,40 +285,39 @@ def anthropic_request(request):
 
 
 def openai_request(request):
-    load_dotenv()
-    openai.api_key = os.environ.get("OPENAI_API_KEY")
-    response = openai.ChatCompletion.create(
-        model=request["model"],
-        messages=request["messages"]
-    )
+    openai = openai_sdk()
+    with observe_vendor("openai", request["model"]) as call:
+        response = openai.ChatCompletion.create(
+            model=request["model"],
+            messages=request["messages"]
+        )
+        call.record_usage(openai_usage(response))
     return response["choices"][0]["message"]
 
 
 def google_request(request):
-    load_dotenv()
-    google_api_key = os.environ.get("GOOGLE_API_KEY")
-    # client = genai.Client(api_key=google_api_key)
-    genai.configure(api_key=google_api_key)
+    genai = genai_sdk()
     system_instruction = request["system_prompt"]
     messages = openai_to_google_messages(request["messages"])
-    print(messages)
+    logger.debug("Google request messages: %s", redact(messages))
     model = genai.GenerativeModel(
         model_name=(request["model"]),
         system_instruction=system_instruction
     )
-    response = model.generate_content(
-        contents=messages
-    )
-    print(response)
+    with observe_vendor("google", request["model"]) as call:
+        response = model.generate_content(
+            contents=messages
+        )
+        call.record_usage(google_usage(response))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Google response: %s", redact(str(response)))
     model = Model.query.filter_by(api_name=request["model"]).first()
     if model.is_thinking:
-        print("Thinking model")
         response_text = "# Inner Thoughts\n" + \
             response.candidates[0].content.parts[0].text + \
             "\n# Response\n" + \
             response.candidates[0].content.parts[1].text
     else:
-        print("Not a thinking model")
         response_text = response.text
     return {"role": "assistant", "content": response_text}
 
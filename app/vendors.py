@@ -0,0 +1,96 @@
+"""
+vendors.py
+----------
+
+Lazy access to the AI vendor SDKs. `openai`, `anthropic` and
+`google.generativeai` together take seconds to import, so they are imported the
+first time a request needs them rather than when the app boots. Worker start-up
+(autoscaling, worker recycling) then only pays for what it serves.
+
+Each SDK is configured once per process, under a lock, instead of per request:
+the `openai` and `google.generativeai` settings are module globals, and
+rewriting them while other threads or greenlets are mid-request is unsafe. The
+Anthropic client is shared; it is thread-safe and keeps a connection pool.
+
+Under a pre-forking server (see wsgi.py and gunicorn.conf.py), `preload()` imports
+and configures everything in the master so the workers share it copy-on-write,
+and `reset_after_fork()` drops the clients whose connection pools must not be
+shared with the master.
+
+Functions:
+- `openai_sdk()`: The `openai` module, with the API key set.
+- `anthropic_client()`: The process' `anthropic.Anthropic` client.
+- `genai_sdk()`: The `google.generativeai` module, configured with the API key
+  and `GOOGLE_API_ENDPOINT`.
+- `preload()`: Imports and configures all SDKs up front.
+- `reset_after_fork()`: Discards clients created before a fork.
+"""
+
+import os
+import threading
+
+_lock = threading.Lock()
+_openai = None
+_anthropic_client = None
+_genai = None
+
+
+def openai_sdk():
+    global _openai
+    if _openai is None:
+        with _lock:
+            if _openai is None:
+                import openai
+
+                if openai.api_key is None:
+                    openai.api_key = os.environ.get("OPENAI_API_KEY")
+                _openai = openai
+    return _openai
+
+
+def anthropic_client():
+    global _anthropic_client
+    if _anthropic_client is None:
+        with _lock:
+            if _anthropic_client is None:
+                from anthropic import Anthropic
+
+                _anthropic_client = Anthropic()
+    return _anthropic_client
+
+
+def genai_sdk():
+    global _genai
+    if _genai is None:
+        with _lock:
+            if _genai is None:
+                import google.generativeai as genai
+
+                configure_kwargs = {"api_key": os.environ.get("GOOGLE_API_KEY")}
+                # Point the SDK at another Gemini-compatible server, e.g. the load test stub
+                google_api_endpoint = os.environ.get("GOOGLE_API_ENDPOINT")
+                if google_api_endpoint:
+                    configure_kwargs["transport"] = "rest"
+                    configure_kwargs["client_options"] = {"api_endpoint": google_api_endpoint}
+                genai.configure(**configure_kwargs)
+                _genai = genai
+    return _genai
+
+
+def preload():
+    openai_sdk()
+    anthropic_client()
+    genai_sdk()
+
+
+def reset_after_fork():
+    """
+    Called in a freshly forked worker. The lock may have been held by another
+    thread of the master, and the clients' pooled connections belong to the
+    master, so both are replaced. The imported modules stay shared.
+    """
+    global _lock, _anthropic_client, _genai
+    _lock = threading.Lock()
+    _anthropic_client = None
+    # genai caches its gRPC/REST client at configure time; configure again.
+    _genai = None
@@ -0,0 +1,25 @@
+"""The API key check that runs before every authenticated route."""
+
+from app.api import get_api_key_or_abort, require_api_key
+from app.model import APIKey
+
+
+def middle_key():
+    # conftest.py seeds key i as f"{i:064d}"; only its hash is stored
+    return f"{APIKey.query.count() // 2:064d}"
+
+
+def test_api_key_lookup(bench, app):
+    token = middle_key()
+    bench(lambda: get_api_key_or_abort(token))
+
+
+def test_require_api_key(bench, app):
+    token = middle_key()
+
+    @require_api_key
+    def view():
+        return "ok"
+
+    with app.test_request_context("/api/personas", headers={"Authorization": f"Bearer {token}"}):
+        bench(view)
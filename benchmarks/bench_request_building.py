@@ -0,0 +1,67 @@
+"""Building vendor requests from the chat body: ai_request and the message converters."""
+
+import json
+
+import pytest
+
+from app.api import ai_request
+from app.model import Model, OutputFormat, Persona, db
+from app.utils import openai_to_google_messages, system_prompt_dict
+
+
+class JSONBody:
+    """The part of flask.Request that ai_request uses; parses the body on every call like Flask does."""
+
+    def __init__(self, body):
+        self.data = json.dumps(body).encode()
+
+    def get_json(self):
+        return json.loads(self.data)
+
+
+def chat_body(history, image_data=""):
+    model = Model.query.filter_by(is_vision=True).first()
+    return {
+        "model": model.api_name,
+        "modelId": model.id,
+        "prompt": "Describe this screenshot.",
+        "personaId": Persona.query.first().id,
+        "outputFormatId": OutputFormat.query.first().id,
+        "responseHistory": history,
+        "imageData": image_data,
+        "maxTokens": 4096,
+        "budgetTokens": None,
+    }
+
+
+def fresh_session_ai_request(body):
+    # Each request gets a new session in production, so the persona and output
+    # format lookups are not served from the identity map.
+    db.session.expunge_all()
+    return ai_request(body)
+
+
+def test_ai_request_short(bench, app):
+    body = JSONBody(chat_body([{"role": "user", "content": "Hello!"}]))
+    bench(lambda: fresh_session_ai_request(body))
+
+
+def test_ai_request_long_history(bench, app, history):
+    body = JSONBody(chat_body(history))
+    bench(lambda: fresh_session_ai_request(body))
+
+
+def test_ai_request_image(bench, app, image_data):
+    body = JSONBody(chat_body([{"role": "user", "content": "What is in this image?"}], image_data))
+    bench(lambda: fresh_session_ai_request(body))
+
+
+@pytest.mark.parametrize("model_name", ["gpt-4o", "o1-mini"])
+def test_system_prompt_dict(bench, model_name):
+    bench(lambda: system_prompt_dict("You are a helpful assistant. " * 40, model_name))
+
+
+def test_openai_to_google_messages(bench, history):
+    messages = [{"role": "system", "content": "You are a helpful assistant."}] + history
+    # The converter drops the first message in place, so it gets a shallow copy.
+    bench(lambda: openai_to_google_messages(list(messages)))
@@ -0,0 +1,40 @@
+"""Catalog serializers in app/utils.py, the model to_dict methods and the history response."""
+
+import pytest
+from flask import jsonify
+from sqlalchemy.orm import selectinload
+
+from app.model import (APIVendor, ConversationHistory, Model, OutputFormat, Persona,
+                       RenderType, UserSettings)
+from app.utils import (api_vendors_json, models_json, output_formats_json, personas_json,
+                       render_types_json)
+
+SERIALIZERS = {
+    "personas": (Persona, personas_json),
+    "models": (Model, models_json),
+    "output_formats": (OutputFormat, output_formats_json),
+    "render_types": (RenderType, render_types_json),
+    "api_vendors": (APIVendor, api_vendors_json),
+}
+
+
+@pytest.mark.parametrize("catalog", list(SERIALIZERS))
+def test_catalog_json(bench, app, catalog):
+    model_class, serializer = SERIALIZERS[catalog]
+    rows = model_class.query.all()
+    bench(lambda: serializer(rows))
+
+
+@pytest.mark.parametrize("model_class", [Persona, Model, OutputFormat, RenderType, APIVendor,
+                                         ConversationHistory, UserSettings],
+                         ids=lambda model_class: model_class.__name__)
+def test_to_dict(bench, app, model_class):
+    rows = model_class.query.all()
+    bench(lambda: [row.to_dict() for row in rows])
+
+
+def test_history_response(bench, app):
+    # What /api/history does after its query: to_dict per chat, then jsonify
+    conversations = ConversationHistory.query.options(selectinload(ConversationHistory.messages)).all()
+    with app.test_request_context():
+        bench(lambda: jsonify([conversation.to_dict() for conversation in conversations]))
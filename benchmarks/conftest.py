@@ -0,0 +1,227 @@
+"""
+Micro-benchmarks for the per-request CPU work: request building, serialization
+and the API key lookup. They run under pytest but are kept out of the default
+test run (see pytest.ini):
+
+    pytest benchmarks                           # measure and print a report
+    pytest benchmarks --bench-save main         # ...and save the results as "main"
+    pytest benchmarks --bench-compare main      # fail benchmarks that regressed against "main"
+
+Each benchmark reports operations per second (best of several rounds, with the
+loop count calibrated like `timeit`) and the peak memory traced by
+`tracemalloc` during a single call. Results are saved as JSON in
+benchmarks/.results/.
+"""
+
+import base64
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import pytest
+
+from app import create_app
+from app.model import (APIKey, APIVendor, ConversationHistory, Model, OutputFormat,
+                       Persona, RenderType, Users, UserSettings, db)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), ".results")
+
+_results = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-save", metavar="NAME", help="Save the results under NAME.")
+    group.addoption("--bench-compare", metavar="NAME", help="Compare against the results saved under NAME.")
+    group.addoption("--bench-threshold", type=float, default=0.25,
+                    help="Relative slowdown or memory growth that counts as a regression (default 0.25).")
+    group.addoption("--bench-min-time", type=float, default=0.05,
+                    help="Minimum seconds per timing round (default 0.05).")
+    group.addoption("--bench-rounds", type=int, default=5, help="Timing rounds per benchmark (default 5).")
+
+
+def pytest_collect_file(file_path, parent):
+    # Benchmark modules are named bench_*.py so the test run never picks them up.
+    if file_path.suffix == ".py" and file_path.name.startswith("bench_"):
+        return pytest.Module.from_parent(parent, path=file_path)
+
+
+def _results_path(name):
+    return os.path.join(RESULTS_DIR, f"{name}.json")
+
+
+def _load_baseline(name):
+    with open(_results_path(name)) as results_file:
+        return json.load(results_file)["benchmarks"]
+
+
+def _time(fn, loops):
+    started = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - started
+
+
+def _measure(fn, min_time, rounds):
+    """Returns the best and median seconds per call."""
+    fn()  # warm up caches and lazy imports
+    loops = 1
+    while True:
+        elapsed = _time(fn, loops)
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+    per_call = sorted([elapsed / loops] + [_time(fn, loops) / loops for _ in range(rounds - 1)])
+    return per_call[0], per_call[len(per_call) // 2], loops
+
+
+def _peak_memory(fn):
+    """Peak bytes allocated while running `fn` once, above what was live before."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def _compare(result, baseline, threshold):
+    problems = []
+    if result["ops_per_sec"] < baseline["ops_per_sec"] * (1 - threshold):
+        problems.append(f"{result['ops_per_sec']:.0f} ops/s vs {baseline['ops_per_sec']:.0f} ops/s")
+    # A little slack so tiny allocations do not flap.
+    if result["peak_bytes"] > baseline["peak_bytes"] * (1 + threshold) + 1024:
+        problems.append(f"peak {result['peak_bytes']} B vs {baseline['peak_bytes']} B")
+    return problems
+
+
+@pytest.fixture
+def bench(request):
+    """
+    Call `bench(fn)` to benchmark the zero-argument callable `fn`. Keep any
+    per-call setup inside `fn` small and explain it, since it is measured too.
+    """
+    config = request.config
+
+    def run(fn):
+        best, median, loops = _measure(fn, config.getoption("--bench-min-time"),
+                                       config.getoption("--bench-rounds"))
+        result = {
+            "ops_per_sec": 1 / best,
+            "best_us": best * 1e6,
+            "median_us": median * 1e6,
+            "loops": loops,
+            "peak_bytes": _peak_memory(fn),
+        }
+        name = request.node.nodeid.split("::", 1)[1]
+        _results[name] = result
+
+        compare = config.getoption("--bench-compare")
+        if compare:
+            baseline = _load_baseline(compare).get(name)
+            if baseline:
+                result["baseline"] = baseline
+                problems = _compare(result, baseline, config.getoption("--bench-threshold"))
+                if problems:
+                    pytest.fail(f"{name} regressed against {compare!r}: {'; '.join(problems)}")
+        return result
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not _results:
+        return
+    write = terminalreporter.write_line
+    terminalreporter.section("benchmarks")
+    write(f"{'benchmark':<44}{'ops/s':>12}{'best us':>12}{'median us':>12}{'peak KiB':>11}{'vs base':>10}")
+    for name, result in sorted(_results.items()):
+        change = ""
+        if "baseline" in result:
+            change = f"{(result['ops_per_sec'] / result['baseline']['ops_per_sec'] - 1) * 100:+.1f}%"
+        write(f"{name:<44}{result['ops_per_sec']:>12.1f}{result['best_us']:>12.1f}"
+              f"{result['median_us']:>12.1f}{result['peak_bytes'] / 1024:>11.1f}{change:>10}")
+
+
+def pytest_sessionfinish(session):
+    name = session.config.getoption("--bench-save", None)
+    if not name or not _results:
+        return
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results = {name: {key: value for key, value in result.items() if key != "baseline"}
+               for name, result in _results.items()}
+    with open(_results_path(name), "w") as results_file:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                   "saved": time.strftime("%Y-%m-%dT%H:%M:%S"), "benchmarks": results},
+                  results_file, indent=2, sort_keys=True)
+
+
+# Fixtures. Sizes are chosen to resemble a busy deployment rather than the
+# handful of rows in add_default_data.py.
+
+PERSONAS = 300
+MODELS = 150
+OUTPUT_FORMATS = 80
+API_KEYS = 2000
+HISTORY_TURNS = 200
+IMAGE_BYTES = 3 * 1024 * 1024
+
+
+@pytest.fixture(scope="session")
+def app():
+    flask_app = create_app("testing")
+    ctx = flask_app.app_context()
+    ctx.push()
+    seed_catalog()
+    yield flask_app
+    ctx.pop()
+
+
+def seed_catalog():
+    owner = Users(username="bench-owner", password="x", email="bench@example.com", is_admin=True)
+    db.session.add(owner)
+    render_types = [RenderType(name=name) for name in ("markdown", "html", "json", "csv", "text")]
+    vendors = [APIVendor(name=name) for name in ("openai", "anthropic", "google")]
+    db.session.add_all(render_types + vendors)
+    db.session.add_all(
+        Model(api_name=f"model-{i}", name=f"Model {i}", is_vision=i % 3 == 0,
+              is_thinking=i % 7 == 0, api_vendor=vendors[i % len(vendors)])
+        for i in range(MODELS))
+    db.session.add_all(
+        Persona(name=f"Persona {i}", prompt=f"You are persona {i}. " + "Be concise and helpful. " * 80,
+                owner=owner if i % 2 else None)
+        for i in range(PERSONAS))
+    db.session.add_all(
+        OutputFormat(name=f"Format {i}", prompt=f"Format {i}: " + "Use headings and bullet lists. " * 20,
+                     render_type=render_types[i % len(render_types)])
+        for i in range(OUTPUT_FORMATS))
+    db.session.add_all(APIKey(name=f"key-{i}", key=f"{i:064d}") for i in range(API_KEYS))
+    for i in range(20):
+        conversation = ConversationHistory(user_id=1, title=f"Chat {i}")
+        conversation.append_messages(long_history(40))
+        db.session.add(conversation)
+    db.session.add(UserSettings(user=owner, summary_model_preference_id=1))
+    db.session.commit()
+
+
+def long_history(turns=HISTORY_TURNS):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": f"Turn {i}: " + "The quick brown fox jumps over the lazy dog. " * 30}
+        for i in range(turns)
+    ]
+
+
+@pytest.fixture(scope="session")
+def history():
+    return long_history()
+
+
+@pytest.fixture(scope="session")
+def image_data():
+    # A base64 data URL like the frontend sends for a large screenshot.
+    return "data:image/png;base64," + base64.b64encode(os.urandom(IMAGE_BYTES)).decode()
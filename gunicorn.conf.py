@@ -0,0 +1,57 @@
+"""
+gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app`. Every setting can
+be overridden with the environment variables below or on the command line.
+
+Worker classes (GUNICORN_WORKER_CLASS):
+- gthread (default): GUNICORN_WORKERS processes with GUNICORN_THREADS threads
+  each. Needs nothing beyond gunicorn.
+- gevent: one greenlet per request, up to GUNICORN_WORKER_CONNECTIONS per worker;
+  suits long streaming vendor calls. Needs `gevent` (and `psycogreen` so
+  PostgreSQL queries yield to other greenlets). The standard library is patched
+  here, before the app is imported in the master.
+
+With either class, keep workers x (threads or connections in flight) within what
+DB_POOL_SIZE + DB_MAX_OVERFLOW and the database allow.
+"""
+
+import os
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+
+if worker_class == "gevent":
+    from gevent import monkey
+
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        pass
+    else:
+        patch_psycopg()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2 * (os.cpu_count() or 1) + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+
+# Build and warm the app once in the master; workers share it copy-on-write.
+preload_app = True
+
+# Vendor calls (long completions, image generation) can take minutes.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers now and then to bound memory growth.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 500))
+
+# The app writes its own JSON access log (app/log.py).
+accesslog = None
+
+
+def post_fork(server, worker):
+    from app.prefork import after_fork
+    from wsgi import app
+
+    after_fork(app)
@@ -0,0 +1,221 @@
+"""
+driver.py
+---------
+
+Closed-loop load driver for GPTFlask. Worker threads send a weighted mix of
+requests for a fixed duration and the driver reports throughput, error counts
+and p50/p95/p99 latency per endpoint.
+
+Each worker acts as its own Clerk user (`loadtest-user-<n>`, session
+`sess_loadtest-user-<n>`), which the vendor stub accepts, so per-user rate
+limits and quotas behave as they would with real traffic.
+
+Usage:
+    python loadtest/driver.py --url http://127.0.0.1:5001 --concurrency 20 --duration 60 \\
+        --mix chat=4,save_chat=1,history=2,catalog=4 --json results.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CATALOG_ROUTES = ["/api/personas", "/api/models", "/api/output-formats",
+                  "/api/render-types", "/api/api-vendors"]
+DEFAULT_MIX = "chat=4,save_chat=1,history=2,catalog=4"
+PROMPTS = [
+    "Summarise the plot of Hamlet in two sentences.",
+    "Write a haiku about load testing.",
+    "Explain the difference between p95 and p99 latency.",
+    "List three uses for a token bucket.",
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    # The smallest value with at least `fraction` of the values at or below it.
+    # Rounded first so float noise (0.07 * 100 == 7.000000000000001) does not bump the rank.
+    rank = max(1, math.ceil(round(fraction * len(sorted_values), 9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("chat", "save_chat", "history", "catalog"):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r} in --mix")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, endpoint, seconds, status):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((seconds, status))
+
+    def summary(self, elapsed):
+        rows = []
+        for endpoint in sorted(self.samples):
+            samples = self.samples[endpoint]
+            latencies = sorted(seconds * 1000 for seconds, _ in samples)
+            errors = sum(1 for _, status in samples if status is None or status >= 400)
+            statuses = {}
+            for _, status in samples:
+                key = str(status) if status is not None else "error"
+                statuses[key] = statuses.get(key, 0) + 1
+            rows.append({
+                "endpoint": endpoint,
+                "requests": len(samples),
+                "errors": errors,
+                "rps": len(samples) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 0.50),
+                "p95_ms": percentile(latencies, 0.95),
+                "p99_ms": percentile(latencies, 0.99),
+                "max_ms": latencies[-1],
+                "statuses": statuses,
+            })
+        return rows
+
+
+class Worker:
+    def __init__(self, number, base_url, api_key, catalog, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.catalog = catalog
+        self.user = {"userId": f"loadtest-user-{number}", "sessionId": f"sess_loadtest-user-{number}",
+                     "email": f"loadtest-user-{number}@example.com"}
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.history = []
+
+    def _post(self, path, body):
+        return self.session.post(self.base_url + path, json=body, timeout=self.timeout)
+
+    def chat(self):
+        model = random.choice(self.catalog["models"])
+        prompt = random.choice(PROMPTS)
+        body = {
+            "model": model["api_name"],
+            "modelId": model["id"],
+            "prompt": prompt,
+            "personaId": self.catalog["persona_id"],
+            "outputFormatId": self.catalog["output_format_id"],
+            "responseHistory": self.history[-6:] + [{"role": "user", "content": prompt}],
+            "imageData": "",
+            "maxTokens": None,
+            "budgetTokens": None,
+        }
+        body.update(self.user)
+        response = self._post("/api/chat", body)
+        if response.ok:
+            self.history += [{"role": "user", "content": prompt}, response.json()]
+        return "/api/chat", response
+
+    def save_chat(self):
+        body = {"messages": self.history[-6:] or [{"role": "user", "content": random.choice(PROMPTS)}]}
+        body.update(self.user)
+        return "/api/save_chat", self._post("/api/save_chat", body)
+
+    def history_request(self):
+        return "/api/history", self._post("/api/history", dict(self.user))
+
+    def catalog_request(self):
+        path = random.choice(CATALOG_ROUTES)
+        return path, self.session.get(self.base_url + path, timeout=self.timeout)
+
+    def run(self, weights, deadline, results):
+        actions = {"chat": self.chat, "save_chat": self.save_chat,
+                   "history": self.history_request, "catalog": self.catalog_request}
+        names = list(weights)
+        while time.monotonic() < deadline:
+            name = random.choices(names, [weights[name] for name in names])[0]
+            started = time.perf_counter()
+            try:
+                endpoint, response = actions[name]()
+                status = response.status_code
+            except requests.RequestException as e:
+                # Connection errors and timeouts are reported under the mix name.
+                endpoint, status = name, None
+                print(f"Request failed: {e}")
+            results.add(endpoint, time.perf_counter() - started, status)
+
+
+def load_catalog(base_url, api_key, timeout):
+    headers = {"Authorization": f"Bearer {api_key}"}
+    models = requests.get(f"{base_url}/api/models", headers=headers, timeout=timeout).json()
+    personas = requests.get(f"{base_url}/api/personas", headers=headers, timeout=timeout).json()
+    output_formats = requests.get(f"{base_url}/api/output-formats", headers=headers, timeout=timeout).json()
+    chat_models = [model for model in models
+                   if not model["is_image_generation"] and model["api_name"] != "dall-e-3"]
+    if not chat_models or not personas or not output_formats:
+        raise SystemExit("The app needs at least one chat model, persona and output format")
+    return {"models": chat_models, "persona_id": personas[0]["id"],
+            "output_format_id": output_formats[0]["id"]}
+
+
+def print_summary(rows, elapsed):
+    header = f"{'endpoint':<22}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    print(f"\nRan for {elapsed:.1f}s")
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['endpoint']:<22}{row['requests']:>9}{row['errors']:>8}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+    total = sum(row["requests"] for row in rows)
+    print(f"{'total':<22}{total:>9}{sum(row['errors'] for row in rows):>8}{total / elapsed:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running GPTFlask instance.")
+    parser.add_argument("--url", default="http://127.0.0.1:5001")
+    parser.add_argument("--api-key", help="API key (default: read from --key-file)")
+    parser.add_argument("--key-file", default=os.path.join(tempfile.gettempdir(), "gptflask-loadtest.key"))
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Weighted endpoint mix (default: {DEFAULT_MIX})")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", help="Also write the per-endpoint results to this file")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    api_key = args.api_key
+    if not api_key:
+        with open(args.key_file) as key_file:
+            api_key = key_file.read().strip()
+
+    catalog = load_catalog(base_url, api_key, args.timeout)
+    results = Results()
+    workers = [Worker(number, base_url, api_key, catalog, args.timeout) for number in range(args.concurrency)]
+    started = time.monotonic()
+    deadline = started + args.duration
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(worker.run, args.mix, deadline, results) for worker in workers]:
+            future.result()
+    elapsed = time.monotonic() - started
+
+    rows = results.summary(elapsed)
+    print_summary(rows, elapsed)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"concurrency": args.concurrency, "duration": elapsed, "endpoints": rows},
+                      json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+serve_app.py
+------------
+
+Runs GPTFlask against the local vendor stub (loadtest/stub_server.py) with a
+throwaway SQLite database, seeded with one model per vendor, a persona, an
+output format and an API key. The key is printed and written to `--key-file`
+for the load driver.
+
+Usage:
+    python loadtest/serve_app.py --port 5001 --stub-url http://127.0.0.1:8090
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Chat models seeded per vendor; the driver picks them up from /api/models.
+SEED_MODELS = [
+    ("openai", "gpt-4o-mini", "GPT-4o mini"),
+    ("anthropic", "claude-3-5-haiku-latest", "Claude 3.5 Haiku"),
+    ("google", "gemini-2.0-flash", "Gemini 2.0 Flash"),
+]
+
+
+def configure_environment(stub_url):
+    # The vendor SDKs read these when they are imported or instantiated, so
+    # they must be set before the app is imported.
+    os.environ["OPENAI_API_BASE"] = f"{stub_url}/v1"
+    os.environ["ANTHROPIC_BASE_URL"] = stub_url
+    os.environ["GOOGLE_API_ENDPOINT"] = stub_url
+    os.environ["CLERK_API_URL"] = f"{stub_url}/v1"
+    for name in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GOOGLE_API_KEY", "CLERK_SECRET"):
+        os.environ[name] = "loadtest"
+
+
+def create_loadtest_app(database_path, rate_limits):
+    from app import create_app
+    from app.config import TestingConfig, config_by_name
+
+    class LoadTestConfig(TestingConfig):
+        TESTING = False
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{database_path}"
+        # Flush the token ledger in the background, as in production.
+        USAGE_FLUSH_INTERVAL = 5
+        RATELIMIT_ENABLED = rate_limits
+        LOG_LEVEL = "WARNING"
+        LOG_FILE = os.path.join(os.path.dirname(database_path), "loadtest.log")
+
+    config_by_name["loadtest"] = LoadTestConfig
+    return create_app("loadtest")
+
+
+def seed(app):
+    from app.model import APIKey, APIVendor, Model, OutputFormat, Persona, RenderType, db
+    from app.apikeys import generate_api_key
+
+    with app.app_context():
+        db.create_all()
+        vendors = {}
+        for vendor_name, api_name, name in SEED_MODELS:
+            if vendor_name not in vendors:
+                vendors[vendor_name] = APIVendor(name=vendor_name)
+                db.session.add(vendors[vendor_name])
+            db.session.add(Model(api_name=api_name, name=name, api_vendor=vendors[vendor_name]))
+        db.session.add(Model(api_name="dall-e-3", name="DALL-E 3", is_image_generation=True,
+                             api_vendor=vendors["openai"]))
+        render_type = RenderType(name="markdown")
+        db.session.add(render_type)
+        db.session.add(Persona(name="Load test", prompt="You are a helpful assistant."))
+        db.session.add(OutputFormat(name="Markdown", prompt="Respond in markdown.", render_type=render_type))
+        key = generate_api_key()
+        db.session.add(APIKey(name="loadtest", key=key))
+        db.session.commit()
+    return key
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run GPTFlask against the local vendor stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--stub-url", default="http://127.0.0.1:8090")
+    parser.add_argument("--database", help="SQLite file to use (default: a new temporary file)")
+    parser.add_argument("--key-file", default=os.path.join(tempfile.gettempdir(), "gptflask-loadtest.key"))
+    parser.add_argument("--rate-limits", action="store_true", help="Enforce the configured rate limits")
+    args = parser.parse_args()
+
+    configure_environment(args.stub_url.rstrip("/"))
+    database_path = args.database or os.path.join(tempfile.mkdtemp(prefix="gptflask-loadtest-"), "app.db")
+    app = create_loadtest_app(database_path, args.rate_limits)
+    key = seed(app)
+    with open(args.key_file, "w") as key_file:
+        key_file.write(key)
+    print(f"Database: {database_path}")
+    print(f"API key:  {key} (written to {args.key_file})")
+    app.run(host=args.host, port=args.port, threaded=True, use_reloader=False)
+
+
+if __name__ == "__main__":
+    main()
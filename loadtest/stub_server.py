@@ -0,0 +1,324 @@
+"""
+stub_server.py
+--------------
+
+A local stand-in for the AI vendors and Clerk, so GPTFlask can be load-tested
+without network access or vendor bills. One process serves:
+
+- OpenAI: `POST /v1/chat/completions` (optionally streamed) and `POST /v1/images/generations`
+- Anthropic: `POST /v1/messages` (optionally streamed)
+- Google: `POST /v1beta/models/<model>:generateContent` and `:streamGenerateContent`
+- Clerk: `GET /v1/sessions/<session_id>`, active for any session id. The user id
+  is the session id without its `sess_` prefix.
+
+Responses carry realistic usage blocks so the token ledger and quotas see
+traffic. Latency, streaming pace and error injection are set on the command
+line and can be changed while a test runs through `POST /_stub/config`.
+
+Point the app at the stub with:
+
+    OPENAI_API_BASE=http://127.0.0.1:8090/v1
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8090
+    GOOGLE_API_ENDPOINT=http://127.0.0.1:8090
+    CLERK_API_URL=http://127.0.0.1:8090/v1
+
+Usage:
+    python loadtest/stub_server.py --port 8090 --latency-ms 800 --jitter-ms 400 --error-rate 0.02
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+
+# Runtime settings, replaced from the command line and /_stub/config.
+settings = {
+    # Time to the complete response (or to the first chunk when streaming).
+    "latency_ms": 300.0,
+    "jitter_ms": 100.0,
+    # Delay between streamed chunks and the number of chunks per response.
+    "chunk_delay_ms": 20.0,
+    "chunks": 8,
+    # Fraction of vendor requests answered with `error_status`.
+    "error_rate": 0.0,
+    "error_status": 500,
+    "clerk_latency_ms": 20.0,
+    "output_tokens": 64,
+}
+_settings_lock = threading.Lock()
+_stats = {"requests": 0, "errors": 0}
+
+REPLY_WORDS = ("stub", "response", "from", "the", "local", "load", "test", "server")
+
+
+def _setting(name):
+    with _settings_lock:
+        return settings[name]
+
+
+def _count(error=False):
+    with _settings_lock:
+        _stats["requests"] += 1
+        if error:
+            _stats["errors"] += 1
+
+
+def _sleep_latency():
+    latency = _setting("latency_ms")
+    jitter = _setting("jitter_ms")
+    time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)) / 1000)
+
+
+def _inject_error():
+    """Returns the status to fail with for this request, or None."""
+    if random.random() < _setting("error_rate"):
+        return _setting("error_status")
+    return None
+
+
+def _estimate_tokens(value):
+    # Same rough ratio the app uses for quota estimates.
+    return max(1, len(json.dumps(value)) // 4)
+
+
+def _reply_text(output_tokens):
+    return " ".join(REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(output_tokens))
+
+
+def _chunks(text):
+    words = text.split(" ")
+    size = max(1, len(words) // max(1, _setting("chunks")))
+    return [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+
+
+def _sse(events):
+    """Streams (event name or None, payload) pairs as server-sent events."""
+    def generate():
+        chunk_delay = _setting("chunk_delay_ms") / 1000
+        for event, payload in events:
+            data = payload if isinstance(payload, str) else json.dumps(payload)
+            prefix = f"event: {event}\n" if event else ""
+            yield f"{prefix}data: {data}\n\n"
+            time.sleep(chunk_delay)
+    return Response(generate(), mimetype="text/event-stream")
+
+
+# OpenAI
+
+
+def _openai_error(status):
+    _count(error=True)
+    return jsonify({"error": {"message": "Injected stub error", "type": "server_error",
+                              "param": None, "code": None}}), status
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def openai_chat_completions():
+    body = request.get_json()
+    _sleep_latency()
+    status = _inject_error()
+    if status:
+        return _openai_error(status)
+    _count()
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    output_tokens = min(body.get("max_tokens") or _setting("output_tokens"), _setting("output_tokens"))
+    text = _reply_text(output_tokens)
+    usage = {"prompt_tokens": _estimate_tokens(body.get("messages")),
+             "completion_tokens": output_tokens}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+    if body.get("stream"):
+        base = {"id": completion_id, "object": "chat.completion.chunk",
+                "created": created, "model": body["model"]}
+        events = [(None, dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                              "finish_reason": None}]))]
+        events += [(None, dict(base, choices=[{"index": 0, "delta": {"content": chunk},
+                                               "finish_reason": None}]))
+                   for chunk in _chunks(text)]
+        events.append((None, dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])))
+        events.append((None, "[DONE]"))
+        return _sse(events)
+
+    return jsonify({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                     "finish_reason": "stop"}],
+        "usage": usage,
+    })
+
+
+@app.route("/v1/images/generations", methods=["POST"])
+def openai_images_generations():
+    body = request.get_json()
+    _sleep_latency()
+    status = _inject_error()
+    if status:
+        return _openai_error(status)
+    _count()
+    return jsonify({
+        "created": int(time.time()),
+        "data": [{"url": f"http://127.0.0.1/stub-images/{uuid.uuid4().hex}.png",
+                  "revised_prompt": body.get("prompt", "")}
+                 for _ in range(body.get("n") or 1)],
+    })
+
+
+# Anthropic
+
+
+@app.route("/v1/messages", methods=["POST"])
+def anthropic_messages():
+    body = request.get_json()
+    _sleep_latency()
+    status = _inject_error()
+    if status:
+        _count(error=True)
+        error_type = "overloaded_error" if status == 529 else "api_error"
+        return jsonify({"type": "error", "error": {"type": error_type,
+                                                   "message": "Injected stub error"}}), status
+    _count()
+
+    message_id = f"msg_{uuid.uuid4().hex}"
+    output_tokens = min(body.get("max_tokens") or _setting("output_tokens"), _setting("output_tokens"))
+    text = _reply_text(output_tokens)
+    input_tokens = _estimate_tokens([body.get("system"), body.get("messages")])
+    content = []
+    thinking = body.get("thinking") or {}
+    if thinking.get("type") == "enabled":
+        content.append({"type": "thinking", "thinking": _reply_text(output_tokens // 2),
+                        "signature": uuid.uuid4().hex})
+    content.append({"type": "text", "text": text})
+
+    if body.get("stream"):
+        message = {"id": message_id, "type": "message", "role": "assistant", "model": body["model"],
+                   "content": [], "stop_reason": None, "stop_sequence": None,
+                   "usage": {"input_tokens": input_tokens, "output_tokens": 1}}
+        events = [("message_start", {"type": "message_start", "message": message}),
+                  ("content_block_start", {"type": "content_block_start", "index": 0,
+                                           "content_block": {"type": "text", "text": ""}})]
+        events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                            "delta": {"type": "text_delta", "text": chunk}})
+                   for chunk in _chunks(text)]
+        events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                   ("message_delta", {"type": "message_delta",
+                                      "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": output_tokens}}),
+                   ("message_stop", {"type": "message_stop"})]
+        return _sse(events)
+
+    return jsonify({
+        "id": message_id,
+        "type": "message",
+        "role": "assistant",
+        "model": body["model"],
+        "content": content,
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                  "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0},
+    })
+
+
+# Google
+
+
+def _gemini_response(text, prompt_tokens, output_tokens):
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                        "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": prompt_tokens,
+                          "candidatesTokenCount": output_tokens,
+                          "totalTokenCount": prompt_tokens + output_tokens},
+    }
+
+
+@app.route("/v1beta/models/<model_action>", methods=["POST"])
+def google_generate_content(model_action):
+    model, _, action = model_action.partition(":")
+    if action not in ("generateContent", "streamGenerateContent"):
+        return jsonify({"error": {"code": 404, "message": f"Unknown method {action}",
+                                  "status": "NOT_FOUND"}}), 404
+    body = request.get_json()
+    _sleep_latency()
+    status = _inject_error()
+    if status:
+        _count(error=True)
+        return jsonify({"error": {"code": status, "message": "Injected stub error",
+                                  "status": "INTERNAL"}}), status
+    _count()
+
+    output_tokens = _setting("output_tokens")
+    text = _reply_text(output_tokens)
+    prompt_tokens = _estimate_tokens([body.get("systemInstruction"), body.get("contents")])
+
+    if action == "streamGenerateContent":
+        chunks = _chunks(text)
+        events = [(None, _gemini_response(chunk, prompt_tokens, (i + 1) * output_tokens // len(chunks)))
+                  for i, chunk in enumerate(chunks)]
+        if request.args.get("alt") == "sse":
+            return _sse(events)
+        return jsonify([payload for _, payload in events])
+
+    return jsonify(_gemini_response(text, prompt_tokens, output_tokens))
+
+
+# Clerk
+
+
+@app.route("/v1/sessions/<session_id>", methods=["GET"])
+def clerk_session(session_id):
+    time.sleep(_setting("clerk_latency_ms") / 1000)
+    user_id = session_id[len("sess_"):] if session_id.startswith("sess_") else session_id
+    return jsonify({"id": session_id, "object": "session", "status": "active",
+                    "user_id": user_id, "expire_at": int(time.time() + 3600) * 1000})
+
+
+# Control
+
+
+@app.route("/_stub/config", methods=["GET", "POST"])
+def stub_config():
+    """Read or update the stub settings, e.g. to raise the error rate mid-run."""
+    if request.method == "POST":
+        updates = request.get_json() or {}
+        unknown = set(updates) - set(settings)
+        if unknown:
+            return jsonify({"message": f"Unknown settings: {', '.join(sorted(unknown))}"}), 400
+        with _settings_lock:
+            for name, value in updates.items():
+                settings[name] = type(settings[name])(value)
+    with _settings_lock:
+        return jsonify({"settings": dict(settings), "stats": dict(_stats)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub for the OpenAI, Anthropic, Google and Clerk APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=settings["jitter_ms"])
+    parser.add_argument("--chunk-delay-ms", type=float, default=settings["chunk_delay_ms"])
+    parser.add_argument("--chunks", type=int, default=settings["chunks"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"])
+    parser.add_argument("--error-status", type=int, default=settings["error_status"])
+    parser.add_argument("--clerk-latency-ms", type=float, default=settings["clerk_latency_ms"])
+    parser.add_argument("--output-tokens", type=int, default=settings["output_tokens"])
+    args = parser.parse_args()
+    for name in settings:
+        settings[name] = getattr(args, name)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
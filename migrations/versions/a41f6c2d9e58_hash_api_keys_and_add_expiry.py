@@ -0,0 +1,92 @@
+"""Store API keys as SHA-256 hashes and add creation and expiry times
+
+Revision ID: a41f6c2d9e58
+Revises: e8b4f20c6d17
+Create Date: 2026-10-19 20:02:41.118305
+
+Replaces `api_key.key` with `key_hash`, the hex SHA-256 of the key, so the
+database no longer holds usable keys. Existing keys keep working: they are
+hashed in place. Keys that existed before get the migration time as
+`created_at` and no expiry.
+
+Downgrading cannot recover the keys: `key` is filled with the hashes, so every
+key has to be issued again afterwards.
+
+"""
+import hashlib
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f6c2d9e58'
+down_revision = 'e8b4f20c6d17'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+api_key = sa.table(
+    'api_key',
+    sa.column('id', sa.Integer),
+    sa.column('key', sa.String),
+    sa.column('key_hash', sa.String),
+    sa.column('created_at', sa.DateTime),
+)
+
+
+def _batches(bind, columns):
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(*columns).where(api_key.c.id > last_id).order_by(api_key.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('key_hash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    bind = op.get_bind()
+    migrated_at = datetime.utcnow()
+    for rows in _batches(bind, (api_key.c.id, api_key.c.key)):
+        bind.execute(
+            api_key.update().where(api_key.c.id == sa.bindparam('key_id'))
+            .values(key_hash=sa.bindparam('hash'), created_at=migrated_at),
+            [{'key_id': row.id, 'hash': hashlib.sha256(row.key.encode()).hexdigest()} for row in rows],
+        )
+
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.alter_column('key_hash', existing_type=sa.String(length=64), nullable=False)
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.drop_index(batch_op.f('ix_api_key_key'))
+        batch_op.create_index(batch_op.f('ix_api_key_key_hash'), ['key_hash'], unique=True)
+        batch_op.drop_column('key')
+
+
+def downgrade():
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('key', sa.String(length=255), nullable=True))
+
+    bind = op.get_bind()
+    for rows in _batches(bind, (api_key.c.id, api_key.c.key_hash)):
+        bind.execute(
+            api_key.update().where(api_key.c.id == sa.bindparam('key_id')).values(key=sa.bindparam('hash')),
+            [{'key_id': row.id, 'hash': row.key_hash} for row in rows],
+        )
+
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.alter_column('key', existing_type=sa.String(length=255), nullable=False)
+        batch_op.drop_index(batch_op.f('ix_api_key_key_hash'))
+        batch_op.create_index(batch_op.f('ix_api_key_key'), ['key'], unique=False)
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('created_at')
+        batch_op.drop_column('key_hash')
@@ -0,0 +1,83 @@
+"""Make the catalog natural keys unique
+
+Revision ID: b3e5d8a2c691
+Revises: f2a6d0c4b873
+Create Date: 2026-10-20 11:05:48.203117
+
+Catalog imports and the seed match render types, API vendors, personas and
+output formats by name and models by api_name and name. Two imports running at
+once could insert the same key twice. Duplicates are removed first, keeping
+the oldest row, which is the one lookups returned. References to a removed row
+(models' vendor, output formats' render type, summary model preferences) are
+moved to the kept one.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e5d8a2c691'
+down_revision = 'f2a6d0c4b873'
+branch_labels = None
+depends_on = None
+
+
+# (table, key columns, referencing (table, column) pairs), referenced tables first
+TABLES = [
+    ('render_type', ('name',), [('output_format', 'render_type_id')]),
+    ('api_vendor', ('name',), [('model', 'api_vendor_id')]),
+    ('model', ('api_name', 'name'), [('user_settings', 'summary_model_preference_id')]),
+    ('persona', ('name',), []),
+    ('output_format', ('name',), []),
+]
+
+
+def _deduplicate(table, key, references):
+    kept = f"SELECT MIN(id) FROM {table} GROUP BY {', '.join(key)}"
+    same_key = " AND ".join(f"duplicate.{column} = kept.{column}" for column in key)
+    for referencing_table, column in references:
+        op.execute(
+            f"UPDATE {referencing_table} SET {column} = "
+            f"(SELECT MIN(kept.id) FROM {table} kept JOIN {table} duplicate ON {same_key} "
+            f"WHERE duplicate.id = {referencing_table}.{column}) "
+            f"WHERE {column} NOT IN ({kept})"
+        )
+    op.execute(f"DELETE FROM {table} WHERE id NOT IN ({kept})")
+
+
+def upgrade():
+    for table, key, references in TABLES:
+        _deduplicate(table, key, references)
+
+    with op.batch_alter_table('render_type', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_render_type_name', ['name'])
+
+    with op.batch_alter_table('api_vendor', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_api_vendor_name', ['name'])
+
+    with op.batch_alter_table('model', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_model_api_name_name', ['api_name', 'name'])
+
+    with op.batch_alter_table('persona', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_persona_name', ['name'])
+
+    with op.batch_alter_table('output_format', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_output_format_name', ['name'])
+
+
+def downgrade():
+    with op.batch_alter_table('output_format', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_output_format_name', type_='unique')
+
+    with op.batch_alter_table('persona', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_persona_name', type_='unique')
+
+    with op.batch_alter_table('model', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_model_api_name_name', type_='unique')
+
+    with op.batch_alter_table('api_vendor', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_api_vendor_name', type_='unique')
+
+    with op.batch_alter_table('render_type', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_render_type_name', type_='unique')
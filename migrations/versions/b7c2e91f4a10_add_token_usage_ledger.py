@@ -0,0 +1,46 @@
+"""Add token usage ledger
+
+Revision ID: b7c2e91f4a10
+Revises: 3f74ed1ba35c
+Create Date: 2026-10-19 09:12:41.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c2e91f4a10'
+down_revision = '3f74ed1ba35c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_usage',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('api_key_id', sa.Integer(), nullable=True),
+    sa.Column('api_vendor', sa.String(length=255), nullable=False),
+    sa.Column('model_api_name', sa.String(length=255), nullable=False),
+    sa.Column('endpoint', sa.String(length=255), nullable=True),
+    sa.Column('input_tokens', sa.Integer(), nullable=False),
+    sa.Column('output_tokens', sa.Integer(), nullable=False),
+    sa.Column('thinking_tokens', sa.Integer(), nullable=False),
+    sa.Column('cached_tokens', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['api_key_id'], ['api_key.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_token_usage_timestamp'), ['timestamp'], unique=False)
+        batch_op.create_index('ix_token_usage_user_id_timestamp', ['user_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.drop_index('ix_token_usage_user_id_timestamp')
+        batch_op.drop_index(batch_op.f('ix_token_usage_timestamp'))
+
+    op.drop_table('token_usage')
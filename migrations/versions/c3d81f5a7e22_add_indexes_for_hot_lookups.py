@@ -0,0 +1,50 @@
+"""Add indexes for hot lookups and one settings row per user
+
+Revision ID: c3d81f5a7e22
+Revises: b7c2e91f4a10
+Create Date: 2026-10-19 14:37:05.118420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d81f5a7e22'
+down_revision = 'b7c2e91f4a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_api_key_key'), ['key'], unique=False)
+
+    with op.batch_alter_table('conversation_history', schema=None) as batch_op:
+        batch_op.create_index('ix_conversation_history_user_id_timestamp', ['user_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('model', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_model_api_name'), ['api_name'], unique=False)
+
+    # Users could end up with several settings rows when two requests created
+    # them at once. Keep the oldest, which is the one lookups returned.
+    op.execute(
+        "DELETE FROM user_settings WHERE id NOT IN "
+        "(SELECT MIN(id) FROM user_settings GROUP BY user_id)"
+    )
+    with op.batch_alter_table('user_settings', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_user_settings_user_id', ['user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('user_settings', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_user_settings_user_id', type_='unique')
+
+    with op.batch_alter_table('model', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_model_api_name'))
+
+    with op.batch_alter_table('conversation_history', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_history_user_id_timestamp')
+
+    with op.batch_alter_table('api_key', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_api_key_key'))
@@ -0,0 +1,66 @@
+"""Add hourly usage rollups with latency sketches
+
+Revision ID: c9e3b7a15d42
+Revises: a41f6c2d9e58
+Create Date: 2026-10-19 21:14:06.730521
+
+Ledger rows recorded before this revision have no latency; they are counted in
+the rollups but left out of the latency percentiles. The rollups are built by
+the app's rollup job, or at once with `flask analytics-rollup`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e3b7a15d42'
+down_revision = 'a41f6c2d9e58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('latency_ms', sa.Integer(), nullable=True))
+
+    op.create_table('usage_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('api_vendor', sa.String(length=255), nullable=False),
+    sa.Column('model_api_name', sa.String(length=255), nullable=False),
+    sa.Column('requests', sa.Integer(), nullable=False),
+    sa.Column('input_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('output_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('thinking_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('cached_tokens', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('usage_rollup', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_usage_rollup_hour'), ['hour'], unique=False)
+
+    op.create_table('usage_latency_bucket',
+    sa.Column('rollup_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['rollup_id'], ['usage_rollup.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('rollup_id', 'bucket')
+    )
+    op.create_table('rollup_watermark',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('rolled_until', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_watermark')
+    op.drop_table('usage_latency_bucket')
+    with op.batch_alter_table('usage_rollup', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_usage_rollup_hour'))
+
+    op.drop_table('usage_rollup')
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.drop_column('latency_ms')
@@ -0,0 +1,48 @@
+"""Add full-text search index over conversation history
+
+Revision ID: d5a1c7e93b40
+Revises: c3d81f5a7e22
+Create Date: 2026-10-19 16:02:48.730912
+
+Creates the `conversation_search` table described in app/search.py: a table
+with a generated tsvector column and GIN index on PostgreSQL, an FTS5 table on
+SQLite. Existing conversations are indexed by running `flask search-reindex`
+after the upgrade.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a1c7e93b40'
+down_revision = 'c3d81f5a7e22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("""
+            CREATE TABLE conversation_search (
+                conversation_id INTEGER PRIMARY KEY REFERENCES conversation_history (id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL,
+                title TEXT NOT NULL DEFAULT '',
+                body TEXT NOT NULL DEFAULT '',
+                document tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('english', title), 'A') ||
+                    setweight(to_tsvector('english', body), 'B')
+                ) STORED
+            )
+        """)
+        op.execute("CREATE INDEX ix_conversation_search_document ON conversation_search USING GIN (document)")
+        op.execute("CREATE INDEX ix_conversation_search_user_id ON conversation_search (user_id)")
+    elif dialect == 'sqlite':
+        op.execute("""
+            CREATE VIRTUAL TABLE conversation_search
+            USING fts5(title, body, user_id UNINDEXED, tokenize = 'porter unicode61')
+        """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS conversation_search")
@@ -0,0 +1,137 @@
+"""Store conversation messages as rows instead of a JSON blob
+
+Revision ID: e8b4f20c6d17
+Revises: d5a1c7e93b40
+Create Date: 2026-10-19 18:21:13.402557
+
+Moves the messages of every saved conversation out of the
+`conversation_history.conversation` JSON blob into `conversation_message`, one
+row per message, then drops the blob. Keys of the saved document other than
+`messages` (the Clerk session id, user id and email the client sent along) are
+not carried over.
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b4f20c6d17'
+down_revision = 'd5a1c7e93b40'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+conversation_history = sa.table(
+    'conversation_history',
+    sa.column('id', sa.Integer),
+    sa.column('conversation', sa.Text),
+    sa.column('message_count', sa.Integer),
+    sa.column('timestamp', sa.DateTime),
+)
+
+conversation_message = sa.table(
+    'conversation_message',
+    sa.column('conversation_id', sa.Integer),
+    sa.column('sequence', sa.Integer),
+    sa.column('role', sa.String),
+    sa.column('message', sa.Text),
+    sa.column('timestamp', sa.DateTime),
+)
+
+
+def _messages(conversation):
+    try:
+        document = json.loads(conversation)
+    except (TypeError, ValueError):
+        return []
+    messages = document.get('messages') if isinstance(document, dict) else None
+    if not isinstance(messages, list):
+        return []
+    return [message for message in messages if isinstance(message, dict)]
+
+
+def _batches(bind, columns):
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(*columns).where(conversation_history.c.id > last_id)
+            .order_by(conversation_history.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def upgrade():
+    op.create_table('conversation_message',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('sequence', sa.Integer(), nullable=False),
+    sa.Column('role', sa.String(length=50), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation_history.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('conversation_id', 'sequence', name='uq_conversation_message_conversation_id_sequence')
+    )
+    with op.batch_alter_table('conversation_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+
+    bind = op.get_bind()
+    columns = (conversation_history.c.id, conversation_history.c.conversation, conversation_history.c.timestamp)
+    for rows in _batches(bind, columns):
+        message_rows, counts = [], []
+        for row in rows:
+            messages = _messages(row.conversation)
+            message_rows.extend({
+                'conversation_id': row.id,
+                'sequence': sequence,
+                'role': str(message.get('role', ''))[:50],
+                'message': json.dumps(message),
+                'timestamp': row.timestamp,
+            } for sequence, message in enumerate(messages))
+            counts.append({'conversation_id': row.id, 'count': len(messages)})
+        if message_rows:
+            bind.execute(conversation_message.insert(), message_rows)
+        bind.execute(
+            conversation_history.update()
+            .where(conversation_history.c.id == sa.bindparam('conversation_id'))
+            .values(message_count=sa.bindparam('count')),
+            counts,
+        )
+
+    with op.batch_alter_table('conversation_history', schema=None) as batch_op:
+        batch_op.drop_column('conversation')
+
+
+def downgrade():
+    with op.batch_alter_table('conversation_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('conversation', sa.Text(), nullable=True))
+
+    bind = op.get_bind()
+    for rows in _batches(bind, (conversation_history.c.id,)):
+        ids = [row.id for row in rows]
+        documents = {conversation_id: [] for conversation_id in ids}
+        for message in bind.execute(
+                sa.select(conversation_message.c.conversation_id, conversation_message.c.message)
+                .where(conversation_message.c.conversation_id.in_(ids))
+                .order_by(conversation_message.c.conversation_id, conversation_message.c.sequence)):
+            documents[message.conversation_id].append(json.loads(message.message))
+        bind.execute(
+            conversation_history.update()
+            .where(conversation_history.c.id == sa.bindparam('conversation_id'))
+            .values(conversation=sa.bindparam('document')),
+            [{'conversation_id': conversation_id, 'document': json.dumps({'messages': messages})}
+             for conversation_id, messages in documents.items()],
+        )
+
+    with op.batch_alter_table('conversation_history', schema=None) as batch_op:
+        batch_op.alter_column('conversation', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('message_count')
+
+    op.drop_table('conversation_message')
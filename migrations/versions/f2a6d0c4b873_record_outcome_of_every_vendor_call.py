@@ -0,0 +1,29 @@
+"""Record the outcome of every vendor call in the token usage ledger
+
+Revision ID: f2a6d0c4b873
+Revises: c9e3b7a15d42
+Create Date: 2026-10-20 09:41:27.512904
+
+The ledger now gets a row for failed calls and calls without token usage as
+well. Existing rows were all successful calls.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a6d0c4b873'
+down_revision = 'c9e3b7a15d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('outcome', sa.String(length=20), nullable=False, server_default='ok'))
+
+
+def downgrade():
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.drop_column('outcome')
@@ -0,0 +1,89 @@
+import random
+from datetime import datetime, timedelta
+
+import responses
+
+from app.analytics import latency_bucket, percentiles, rollup_usage, usage_analytics
+from app.model import TokenUsage, UsageRollup, Users, db
+from app.utils import get_single_api_key, insert_api_key
+
+DAY = datetime(2025, 1, 1)
+
+
+def usage(model, timestamp, latency_ms, user_id=None, input_tokens=10):
+    return TokenUsage(api_vendor="openai", model_api_name=model, user_id=user_id, input_tokens=input_tokens,
+                      output_tokens=1, latency_ms=latency_ms, timestamp=timestamp)
+
+
+def test_sketch_percentiles_are_within_two_percent():
+    rng = random.Random(7)
+    latencies = sorted(rng.lognormvariate(7, 1) for _ in range(10000))
+    buckets = {}
+    for latency in latencies:
+        bucket = latency_bucket(latency)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    for quantile, value in percentiles(buckets).items():
+        exact = latencies[int(int(quantile[1:]) / 100 * (len(latencies) - 1))]
+        assert abs(value - exact) / exact <= 0.021
+    assert percentiles({}) == {"p50": None, "p90": None, "p95": None, "p99": None}
+
+
+def test_rollups_match_the_ledger(test_client):
+    db.session.add_all([usage("roll-a", DAY.replace(hour=10, minute=5), 100, user_id=1),
+                        usage("roll-a", DAY.replace(hour=10, minute=50), 300, user_id=2),
+                        usage("roll-a", DAY.replace(hour=11, minute=1), 200, user_id=1),
+                        usage("roll-b", DAY.replace(hour=11, minute=30), None),
+                        usage("roll-a", datetime.utcnow(), 1000)])
+    db.session.commit()
+    expected = usage_analytics(group_by=["model"])["groups"]
+
+    assert rollup_usage(now=DAY.replace(hour=13)) == 2
+    assert rollup_usage(now=DAY.replace(hour=13)) == 0
+    assert UsageRollup.query.count() == 4
+    result = usage_analytics(group_by=["model"])
+    assert result["rolledUntil"] == "2025-01-01T12:00:00"
+    # The call after the watermark is read from the ledger
+    assert result["groups"] == expected
+    roll_a = result["groups"][0]
+    assert roll_a["model_api_name"] == "roll-a" and roll_a["requests"] == 4 and roll_a["input_tokens"] == 40
+    assert 196 <= roll_a["latency_ms"]["p50"] <= 204
+    assert result["groups"][1]["latency_ms"]["p50"] is None
+
+    hourly = usage_analytics(DAY, DAY.replace(hour=10, minute=30), group_by=["hour", "user"])["groups"]
+    assert [(group["hour"], group["user_id"], group["requests"]) for group in hourly] == [
+        ("2025-01-01T10:00:00", 1, 1), ("2025-01-01T10:00:00", 2, 1)]
+
+
+def test_rollups_can_be_rebuilt(test_client):
+    db.session.add(usage("roll-a", DAY.replace(hour=10, minute=59), 100, user_id=1, input_tokens=5))
+    db.session.commit()
+    assert usage_analytics(DAY, DAY.replace(hour=11), group_by=["user"])["groups"][0]["input_tokens"] == 10
+
+    assert rollup_usage(now=DAY.replace(hour=13), since=DAY.replace(hour=10)) == 2
+    groups = usage_analytics(DAY, DAY.replace(hour=11), group_by=["user"])["groups"]
+    assert [(group["user_id"], group["requests"], group["input_tokens"]) for group in groups] == [(1, 2, 15), (2, 1, 10)]
+
+
+@responses.activate
+def test_admin_analytics_requires_admin(test_client, monkeypatch):
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    insert_api_key()
+    responses.add(responses.GET, 'https://api.clerk.com/v1/sessions/analyticsSession',
+                  json={'status': 'active', 'user_id': 'analyticsUser'}, status=200)
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    body = {"sessionId": "analyticsSession", "userId": "analyticsUser", "start": "2025-01-01T00:00:00",
+            "end": "2025-01-02T00:00:00", "groupBy": ["day", "model"]}
+
+    response = test_client.post('/api/admin/analytics', headers=headers, json=body)
+    assert response.status_code == 403
+
+    Users.query.filter_by(username="analyticsUser").one().is_admin = True
+    db.session.commit()
+    response = test_client.post('/api/admin/analytics', headers=headers, json=body)
+    assert response.status_code == 200
+    groups = response.get_json()["groups"]
+    assert [(group["day"], group["model_api_name"], group["requests"]) for group in groups] == [
+        ("2025-01-01", "roll-a", 4), ("2025-01-01", "roll-b", 1)]
+
+    response = test_client.post('/api/admin/analytics', headers=headers, json={**body, "groupBy": ["bogus"]})
+    assert response.status_code == 400
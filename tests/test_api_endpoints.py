@@ -85,7 +85,12 @@ def test_openai_request_with_other_model(test_client, mock_request_data_other_mo
 
 @patch('openai.ChatCompletion.create')
 @responses.activate
-def test_save_chat(mock_openai_create, test_client):
+def test_save_chat(mock_openai_create, test_client, monkeypatch):
+    from app.model import ConversationHistory, ConversationMessage
+    from app.utils import get_single_api_key, insert_api_key
+
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    insert_api_key()
     # Mock the Clerk API response
     responses.add(
         responses.GET,
@@ -93,54 +98,100 @@ def test_save_chat(mock_openai_create, test_client):
         json={'status': 'active', 'user_id': 'testUser'},
         status=200
     )
+    # Mock the OpenAI API response
+    mock_openai_create.return_value = {"choices": [{"message": {"role": "assistant", "content": "Test Chat Title"}}]}
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    auth = {"sessionId": "testSession", "userId": "testUser", "email": "test@example.com"}
+    chat = [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi there!"}
+    ]
+
+    response = test_client.post('/api/save_chat', headers=headers, json={"messages": chat, **auth})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body["message"] == "Successfully saved chat: Test Chat Title using gpt-4o-mini"
+    assert body["messageCount"] == 2
+    conversation_id = body["conversationId"]
+    conversation = ConversationHistory.query.get(conversation_id)
+    assert conversation.title == "Test Chat Title"
+    assert json.loads(conversation.to_dict()["conversation"]) == {"messages": chat}
+
+    # Saving the whole, longer chat appends only the new messages and keeps the title
+    chat += [{"role": "user", "content": "Tell me a joke"}]
+    response = test_client.post('/api/save_chat', headers=headers,
+                                json={"messages": chat, "conversationId": conversation_id, **auth})
+    assert response.status_code == 200
+    assert response.get_json()["messageCount"] == 3
+    assert mock_openai_create.call_count == 1
+
+    # Or send just the new messages after the known stored count
+    reply = {"role": "assistant", "content": "Why did the chicken cross the road?"}
+    response = test_client.post('/api/save_chat', headers=headers, json={
+        "messages": [reply], "conversationId": conversation_id, "baseSequence": 3, **auth})
+    assert response.status_code == 200
+    response = test_client.post('/api/save_chat', headers=headers, json={
+        "messages": [reply], "conversationId": conversation_id, "baseSequence": 3, **auth})
+    assert response.status_code == 409
+    assert response.get_json()["messageCount"] == 4
+
+    stored = ConversationMessage.query.filter_by(conversation_id=conversation_id) \
+        .order_by(ConversationMessage.sequence).all()
+    assert [message.sequence for message in stored] == [0, 1, 2, 3]
+    assert [message.to_message() for message in stored] == chat + [reply]
+
+    response = test_client.post('/api/save_chat', headers=headers,
+                                json={"messages": [], "conversationId": 999999, **auth})
+    assert response.status_code == 404
+
+@responses.activate
+def test_api_chat_in_saved_conversation(test_client, monkeypatch):
+    from app.model import APIVendor, ConversationHistory, Users
+
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    insert_api_key()
+    responses.add(responses.GET, 'https://api.clerk.com/v1/sessions/chatSession',
+                  json={'status': 'active', 'user_id': 'chatUser'}, status=200)
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    auth = {"sessionId": "chatSession", "userId": "chatUser", "email": "chat@example.com"}
+    test_client.post('/api/current_user', headers=headers, json=auth)
+    user = Users.query.filter_by(username="chatUser").first()
+
+    vendor = APIVendor(name="openai")
+    db.session.add(vendor)
+    db.session.flush()
+    model = Model(api_name="conversation-model", name="Conversation Model", api_vendor_id=vendor.id)
+    conversation = ConversationHistory(user_id=user.id, title="Greetings")
+    conversation.append_messages([{"role": "user", "content": "Hello"},
+                                  {"role": "assistant", "content": "Hi there!"}])
+    db.session.add_all([model, conversation])
+    db.session.commit()
+
+    body = {"model": "conversation-model", "modelId": model.id, "prompt": "Tell me a joke",
+            "personaId": None, "outputFormatId": None, "imageData": "", "maxTokens": None,
+            "budgetTokens": None, "conversationId": conversation.id, **auth}
+    reply = {"role": "assistant", "content": "Why did the chicken cross the road?"}
+    with patch('app.api.openai_request', return_value=reply) as vendor_request:
+        response = test_client.post('/api/chat', headers=headers, json=body)
+
+    assert response.status_code == 200
+    assert response.get_json() == {**reply, "conversationId": conversation.id, "messageCount": 4}
+    # The vendor saw the stored history followed by the new prompt
+    assert vendor_request.call_args[0][0]["messages"][1:] == [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi there!"},
+        {"role": "user", "content": "Tell me a joke"},
+    ]
+    db.session.refresh(conversation)
+    assert conversation.message_list()[2:] == [{"role": "user", "content": "Tell me a joke"}, reply]
+
+    with patch('app.api.openai_request', return_value=reply):
+        response = test_client.post('/api/chat', headers=headers, json={**body, "conversationId": 999999})
+    assert response.status_code == 404
 
-    with test_client.application.test_request_context('/api/save_chat', json={
-        "messages": [
-            {"role": "user", "content": "Hello"},
-            {"role": "assistant", "content": "Hi there!"}
-        ],
-        "sessionId": "testSession",
-        "userId": "testUser",
-        "email": "test@example.com"
-    }):
-
-        # Mock the OpenAI API response
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock(message=MagicMock(content="Test Chat Title"))]
-        mock_openai_create.return_value = mock_response
-
-        # Mock the user object
-        mock_user = MagicMock(id=1)
-
-        # Mock the database session
-        with patch('app.model.db.session') as mock_db_session:
-            # Call the save_chat function
-            response = save_chat()
-
-            # Assert the response status code and message
-            assert response[1] == 201
-            assert response[0].get_json() == {"message": "Successfully saved chat: Test Chat Title"}
-
-            # Assert that the conversation history entry was created and added to the session
-            mock_db_session.add.assert_called_once()
-            conversation_history_entry = mock_db_session.add.call_args[0][0]
-            # assert conversation_history_entry.user_id == 1
-            assert conversation_history_entry.title == "Test Chat Title"
-            assert conversation_history_entry.conversation == jsonify({
-                "messages": [
-                    {"role": "user", "content": "Hello"},
-                    {"role": "assistant", "content": "Hi there!"}
-                ],
-                "sessionId": "testSession",
-                "userId": "testUser",
-                "email": "test@example.com"
-            }).get_data(as_text=True)
-
-            # Assert that the session was committed
-            mock_db_session.commit.assert_called_once()
 
 @patch('openai.ChatCompletion.create')
-@patch('app.api.anthropic_client.messages.create')
+@patch('anthropic.resources.messages.Messages.create')
 @patch('flask.jsonify')
 def test_api_chat(mock_openai_create, mock_anthropic_create, mock_jsonify, test_client):
     api_key = get_single_api_key()
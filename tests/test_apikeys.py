@@ -0,0 +1,41 @@
+import string
+from datetime import datetime, timedelta
+
+from app.apikeys import find_api_key, generate_api_key, issue_api_keys, rotate_api_keys
+from app.model import APIKey
+
+
+def test_generate_api_key():
+    keys = {generate_api_key() for _ in range(200)}
+    assert len(keys) == 200
+    assert all(len(key) == 64 and set(key) <= set(string.ascii_letters + string.digits) for key in keys)
+    assert len(generate_api_key(100)) == 100
+
+
+def test_only_the_hash_is_stored(test_client):
+    key = issue_api_keys(["hashed"])[0]
+    assert key.key_hash == APIKey.hash(key.key)
+    assert key.key not in key.key_hash
+    assert find_api_key(key.key).id == key.id
+    assert find_api_key(key.key_hash) is None
+
+
+def test_expired_keys_are_rejected(test_client):
+    key = issue_api_keys(["expired"], expires_at=datetime.utcnow() - timedelta(seconds=1))[0]
+    assert find_api_key(key.key) is None
+    response = test_client.get('/api/personas', headers={'Authorization': f'Bearer {key.key}'})
+    assert response.status_code == 401
+
+
+def test_rotation_keeps_old_keys_valid_for_the_overlap(test_client):
+    old, other = issue_api_keys(["rotated", "untouched"])
+    old_plaintext = old.key
+    new_keys, replaced = rotate_api_keys(["rotated"], timedelta(hours=1))
+    assert [key.id for key in replaced] == [old.id]
+    assert timedelta(minutes=59) < old.expires_at - datetime.utcnow() <= timedelta(hours=1)
+    assert other.expires_at is None
+    assert find_api_key(old_plaintext).id == old.id
+    assert find_api_key(new_keys[0].key).name == "rotated"
+
+    rotate_api_keys(["rotated"], timedelta(0))
+    assert find_api_key(old_plaintext) is None
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+from sqlalchemy import false, select
+
+from app import bulk, catalog
+from app.model import APIVendor, Model, OutputFormat, Persona, RenderType, db
+from app.utils import get_single_api_key, insert_api_key
+
+
+@pytest.fixture
+def headers(test_client):
+    insert_api_key()
+    return {'Authorization': f'Bearer {get_single_api_key()}'}
+
+
+def test_import_upserts_by_name_and_bumps_catalog_version_once(test_client, headers):
+    rows = [{"name": "Bulk Persona 1", "prompt": "One"}, {"name": "Bulk Persona 2", "prompt": "Two"}]
+    version = catalog.catalog_version()
+    response = test_client.post('/api/personas/bulk', headers=headers, json=rows)
+    assert response.status_code == 200
+    assert response.get_json() == {"inserted": 2, "updated": 0, "unchanged": 0}
+    assert catalog.catalog_version() == version + 1
+
+    rows[0]["prompt"] = "One, edited"
+    rows.append({"name": "Bulk Persona 3", "prompt": "Three"})
+    response = test_client.post('/api/personas/bulk', headers=headers, json=rows)
+    assert response.get_json() == {"inserted": 1, "updated": 1, "unchanged": 1}
+    assert Persona.query.filter_by(name="Bulk Persona 1").one().prompt == "One, edited"
+    assert Persona.query.filter(Persona.name.like("Bulk Persona %")).count() == 3
+
+
+def test_ndjson_models_import_resolves_vendor_names(test_client, headers):
+    db.session.add(APIVendor(name="bulk-vendor"))
+    db.session.commit()
+    body = "\n".join([
+        json.dumps({"api_name": "bulk-model", "name": "Bulk Model", "api_vendor": "bulk-vendor"}),
+        json.dumps({"api_name": "bulk-model", "name": "Bulk Model Vision", "is_vision": True,
+                    "api_vendor": "bulk-vendor"}),
+        "",
+    ])
+    response = test_client.post('/api/models/bulk', data=body,
+                                headers={**headers, 'Content-Type': 'application/x-ndjson'})
+    assert response.get_json() == {"inserted": 2, "updated": 0, "unchanged": 0}
+    models = Model.query.filter_by(api_name="bulk-model").order_by(Model.name).all()
+    assert [(model.name, model.is_vision, model.is_thinking) for model in models] == [
+        ("Bulk Model", False, False), ("Bulk Model Vision", True, False)]
+
+
+def test_invalid_rows_are_reported_and_nothing_is_written(test_client, headers):
+    rows = [
+        {"name": "Bulk Format", "prompt": "Fine", "render_type": None},
+        {"name": "Bulk Format 2"},
+        {"name": "Bulk Format 3", "prompt": "p", "render_type": "no-such-type"},
+        "not an object",
+        {"name": "Bulk Format", "prompt": "Again"},
+    ]
+    response = test_client.post('/api/output-formats/bulk', headers=headers, json=rows)
+    assert response.status_code == 400
+    assert [error["row"] for error in response.get_json()["errors"]] == [2, 3, 4, 5]
+    assert response.get_json()["errors"][0]["errors"] == ["'prompt' is required"]
+    response = test_client.post('/api/output-formats/bulk', headers={**headers, 'Content-Type': 'application/json'},
+                                data=b'{"name": "not a list"}')
+    assert response.status_code == 400
+    assert OutputFormat.query.filter(OutputFormat.name.like("Bulk Format%")).count() == 0
+
+
+def test_export_round_trips_through_import(test_client, headers):
+    db.session.add(RenderType(name="bulk-render"))
+    db.session.commit()
+    test_client.post('/api/output-formats/bulk', headers=headers,
+                     json=[{"name": "Exported", "prompt": "p", "render_type": "bulk-render"}])
+
+    response = test_client.get('/api/output-formats/bulk',
+                               headers={**headers, 'Accept': 'application/x-ndjson'})
+    assert response.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert {"name": "Exported", "prompt": "p", "render_type": "bulk-render"} in rows
+
+    response = test_client.get('/api/output-formats/bulk', headers=headers)
+    assert response.get_json() == rows
+    response = test_client.post('/api/output-formats/bulk', headers=headers, json=rows)
+    assert response.get_json() == {"inserted": 0, "updated": 0, "unchanged": len(rows)}
+
+
+def test_rows_created_after_the_lookup_are_upserted(test_client, monkeypatch):
+    db.session.add(Persona(name="Raced", prompt="Written by another import"))
+    db.session.commit()
+    # As if the row was inserted between the lookup and the insert
+    monkeypatch.setattr(bulk, "select", lambda *columns: select(*columns).where(false()))
+
+    bulk.upsert(Persona, ("name",), [{"name": "Raced", "prompt": "Kept"}], update_existing=False)
+    assert Persona.query.filter_by(name="Raced").one().prompt == "Written by another import"
+    bulk.upsert(Persona, ("name",), [{"name": "Raced", "prompt": "Ours"}])
+    db.session.commit()
+    assert Persona.query.filter_by(name="Raced").one().prompt == "Ours"
+
+
+def test_duplicate_persona_name_is_a_conflict(test_client, headers):
+    response = test_client.post('/api/personas', headers=headers, json={"name": "Taken", "prompt": "p"})
+    assert response.status_code == 201
+    response = test_client.post('/api/personas', headers=headers, json={"name": "Taken", "prompt": "q"})
+    assert response.status_code == 409
+    assert Persona.query.filter_by(name="Taken").one().prompt == "p"
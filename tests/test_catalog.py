@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from flask import g
+
+from app import catalog, create_app
+from app.config import TestingConfig
+from app.model import APIKey, Persona, db
+
+
+@pytest.fixture
+def cached_client(monkeypatch):
+    monkeypatch.setattr(TestingConfig, "CATALOG_CACHE_TTL", 60)
+    flask_app = create_app("testing")
+    ctx = flask_app.app_context()
+    ctx.push()
+    db.session.add_all([APIKey(name="catalog-test", key="catalog-key"), Persona(name="cached", prompt="p")])
+    db.session.commit()
+    yield flask_app.test_client()
+    db.session.remove()
+    ctx.pop()
+    catalog.init_catalog(flask_app)
+
+
+def persona_names(client):
+    response = client.get('/api/personas', headers={'Authorization': 'Bearer catalog-key'})
+    assert response.status_code == 200
+    return [persona["name"] for persona in json.loads(response.data)]
+
+
+def test_catalog_served_from_cache(cached_client):
+    assert "cached" in persona_names(cached_client)
+    cached_client.get('/api/personas', headers={'Authorization': 'Bearer catalog-key'})
+    # Only the API key lookup hits the database.
+    assert g.query_count == 1
+
+
+def test_commit_of_catalog_row_invalidates_cache(cached_client):
+    assert "added" not in persona_names(cached_client)
+    version = catalog.catalog_version()
+
+    response = cached_client.post('/api/personas', headers={'Authorization': 'Bearer catalog-key'},
+                                  json={"name": "added", "prompt": "p"})
+    assert response.status_code == 201
+    assert catalog.catalog_version() == version + 1
+    assert "added" in persona_names(cached_client)
+
+
+def test_rolled_back_change_keeps_cache(cached_client):
+    persona_names(cached_client)
+    version = catalog.catalog_version()
+    db.session.add(Persona(name="rolled-back", prompt="p"))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    assert catalog.catalog_version() == version
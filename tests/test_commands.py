@@ -0,0 +1,104 @@
+import subprocess
+import sys
+
+from app.commands import parse_importtime
+
+
+def test_parse_importtime():
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |     _io",
+        "import time:        80 |        200 |   app.model",
+        "import time:        50 |        250 | app",
+        "unrelated line",
+    ])
+    modules = parse_importtime(output)
+    assert [module["module"] for module in modules] == ["_io", "app.model", "app"]
+    assert modules[1] == {"module": "app.model", "self_us": 80, "cumulative_us": 200, "depth": 1}
+    assert modules[2]["depth"] == 0
+
+
+def test_importing_app_does_not_import_vendor_sdks():
+    script = ("import sys, app; "
+              "print(','.join(m for m in ('openai', 'anthropic', 'google.generativeai') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+
+
+def test_seed_is_idempotent():
+    from app import create_app
+    from app.model import Model, Persona, Users, db
+
+    flask_app = create_app("testing")
+    runner = flask_app.test_cli_runner()
+    result = runner.invoke(args=["seed"])
+    assert result.exit_code == 0, result.output
+    assert "models: 9 inserted, 0 updated, 0 unchanged" in result.output
+
+    result = runner.invoke(args=["seed"])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert len(lines) == 6 and all(": 0 inserted, 0 updated," in line for line in lines)
+    with flask_app.app_context():
+        assert Persona.query.filter_by(name="General").count() == 1
+        assert Model.query.filter_by(api_name="gpt-4o").count() == 2
+        assert Users.query.filter_by(username="admin").one().is_admin
+        db.session.remove()
+
+
+def test_seed_keeps_edits_unless_forced():
+    from app import create_app
+    from app.model import Persona, Users, db
+
+    flask_app = create_app("testing")
+    runner = flask_app.test_cli_runner()
+    assert runner.invoke(args=["seed"]).exit_code == 0
+    with flask_app.app_context():
+        Persona.query.filter_by(name="General").one().prompt = "Edited prompt"
+        admin = Users.query.filter_by(username="admin").one()
+        admin.email, admin.is_admin = "ops@example.com", False
+        db.session.commit()
+
+    result = runner.invoke(args=["seed"])
+    assert result.exit_code == 0, result.output
+    assert "personas: 0 inserted, 0 updated" in result.output
+    with flask_app.app_context():
+        assert Persona.query.filter_by(name="General").one().prompt == "Edited prompt"
+        admin = Users.query.filter_by(username="admin").one()
+        assert (admin.email, admin.is_admin) == ("ops@example.com", False)
+        db.session.remove()
+
+    result = runner.invoke(args=["seed", "--force"])
+    assert result.exit_code == 0, result.output
+    with flask_app.app_context():
+        assert Persona.query.filter_by(name="General").one().prompt != "Edited prompt"
+        assert Users.query.filter_by(username="admin").one().is_admin
+        db.session.remove()
+
+def test_keys_issue_and_rotate(tmp_path):
+    import json
+
+    from app import create_app
+    from app.apikeys import find_api_key
+    from app.model import db
+
+    flask_app = create_app("testing")
+    runner = flask_app.test_cli_runner()
+    manifest_path = tmp_path / "keys.json"
+    result = runner.invoke(args=["keys", "issue", "ci", "worker", "--count", "2", "--expires-in", "30",
+                                 "--manifest", str(manifest_path)])
+    assert result.exit_code == 0, result.output
+    issued = json.loads(manifest_path.read_text())["keys"]
+    assert [key["name"] for key in issued] == ["ci", "ci", "worker", "worker"]
+    assert oct(manifest_path.stat().st_mode & 0o777) == "0o600"
+
+    result = runner.invoke(args=["keys", "rotate", "ci", "--overlap-hours", "0"])
+    assert result.exit_code == 0, result.output
+    manifest = json.loads(result.output)
+    assert [key["name"] for key in manifest["keys"]] == ["ci"]
+    assert sorted(key["id"] for key in manifest["expiring"]) == [issued[0]["id"], issued[1]["id"]]
+    with flask_app.app_context():
+        assert find_api_key(issued[0]["key"]) is None
+        assert find_api_key(issued[2]["key"]).name == "worker"
+        assert find_api_key(manifest["keys"][0]["key"]).name == "ci"
+        db.session.remove()
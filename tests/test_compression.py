@@ -0,0 +1,112 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from flask import Response
+
+from app import compression
+from app.compression import DECODE_CHUNK, DecodedTooLarge, decode_body
+from app.model import Persona
+from app.utils import get_single_api_key, insert_api_key
+
+
+@pytest.fixture
+def headers(test_client):
+    insert_api_key()
+    return {'Authorization': f'Bearer {get_single_api_key()}', 'Content-Type': 'application/json'}
+
+
+def test_gzip_request_body_is_decoded(test_client, headers):
+    body = gzip.compress(json.dumps({"name": "Gzipped", "prompt": "Compressed " * 100}).encode())
+    response = test_client.post('/api/personas', data=body,
+                                headers={**headers, 'Content-Encoding': 'gzip'})
+    assert response.status_code == 201
+    assert Persona.query.filter_by(name="Gzipped").first().prompt.startswith("Compressed")
+
+
+def test_bad_request_encodings_are_rejected(test_client, headers):
+    response = test_client.post('/api/personas', data=b'{}', headers={**headers, 'Content-Encoding': 'lzma'})
+    assert response.status_code == 415
+    response = test_client.post('/api/personas', data=b'not gzip', headers={**headers, 'Content-Encoding': 'gzip'})
+    assert response.status_code == 400
+    truncated = gzip.compress(b'{"name": "x"}')[:-10]
+    response = test_client.post('/api/personas', data=truncated, headers={**headers, 'Content-Encoding': 'gzip'})
+    assert response.status_code == 400
+
+
+def test_decompression_bomb_is_rejected(test_client, headers):
+    bomb = gzip.compress(b" " * (50 * 1024 * 1024))
+    response = test_client.post('/api/personas', data=bomb, headers={**headers, 'Content-Encoding': 'gzip'})
+    assert response.status_code == 413
+    # Stops at the limit rather than inflating the whole body
+    with pytest.raises(DecodedTooLarge):
+        decode_body(bomb, "gzip", 1024)
+
+
+def test_brotli_bomb_is_rejected(test_client, headers, monkeypatch):
+    brotli = pytest.importorskip("brotli")
+    bomb = brotli.compress(b"\0" * (50 * 1024 * 1024), quality=5)
+    assert len(bomb) < 1024
+    response = test_client.post('/api/personas', data=bomb, headers={**headers, 'Content-Encoding': 'br'})
+    assert response.status_code == 413
+
+    outputs = []
+
+    class RecordingDecompressor(brotli.Decompressor):
+        def process(self, *args, **kwargs):
+            output = super().process(*args, **kwargs)
+            outputs.append(len(output))
+            return output
+
+    monkeypatch.setattr(compression.brotli, "Decompressor", RecordingDecompressor)
+    with pytest.raises(DecodedTooLarge):
+        decode_body(bomb, "br", 1024 * 1024)
+    # Stops at the limit, inflating a bounded amount per step
+    assert max(outputs) <= 2 * DECODE_CHUNK and sum(outputs) <= 1024 * 1024 + 2 * DECODE_CHUNK
+    assert decode_body(brotli.compress(b"hello"), "br", 100) == b"hello"
+    with pytest.raises(ValueError):
+        decode_body(brotli.compress(b"hello" * 1000)[:-4], "br", 10000)
+
+
+def test_deflate_accepts_zlib_and_raw_streams():
+    assert decode_body(zlib.compress(b"hello"), "deflate", 100) == b"hello"
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    assert decode_body(raw.compress(b"hello") + raw.flush(), "deflate", 100) == b"hello"
+
+
+def test_responses_are_compressed_when_accepted(test_client, headers):
+    test_client.application.config['COMPRESSION_MIN_SIZE'] = 0
+    try:
+        response = test_client.get('/api/personas', headers={**headers, 'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert isinstance(json.loads(gzip.decompress(response.data)), list)
+
+        response = test_client.get('/api/personas', headers=headers)
+        assert 'Content-Encoding' not in response.headers
+        assert isinstance(json.loads(response.data), list)
+    finally:
+        test_client.application.config['COMPRESSION_MIN_SIZE'] = 1024
+
+
+def test_small_responses_are_not_compressed(test_client, headers):
+    response = test_client.get('/api/render-types', headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert len(response.data) < 1024
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_streamed_responses_are_flushed_per_chunk(test_client):
+    app = test_client.application
+    events = [f"data: event {number}\n\n".encode() for number in range(3)]
+    with app.test_request_context('/api/personas', headers={'Accept-Encoding': 'gzip'}):
+        response = app.process_response(Response(iter(events), mimetype='text/event-stream'))
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(response.response)
+        # Each event can be decoded as soon as its chunk arrives
+        for event in events:
+            assert decompressor.decompress(next(chunks)) == event
+        decompressor.decompress(b"".join(chunks))
+        assert decompressor.eof
@@ -0,0 +1,65 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import responses
+
+from app.export import export_conversations
+from app.model import ConversationHistory, Users, db
+from app.utils import get_single_api_key, insert_api_key
+
+
+def save(user, title, timestamp, messages):
+    conversation = ConversationHistory(user_id=user.id, title=title, timestamp=timestamp)
+    conversation.append_messages(messages)
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
+
+
+def test_export_streams_conversations_in_batches(test_client):
+    owner = Users(username="exportOwner", password="p")
+    other = Users(username="exportOther", password="p")
+    db.session.add_all([owner, other])
+    db.session.commit()
+    start = datetime(2025, 1, 1)
+    for number in range(5):
+        save(owner, f"Chat {number}", start + timedelta(hours=number),
+             [{"role": "user", "content": f"Question {number}"}, {"role": "assistant", "content": "Ünïcode"}])
+    save(owner, "Empty", start - timedelta(days=1), [])
+    save(other, "Not mine", start, [{"role": "user", "content": "Hidden"}])
+
+    chunks = list(export_conversations(owner.id, batch_size=2))
+    assert len(chunks) == 3
+    lines = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    assert [line["title"] for line in lines] == ["Chat 4", "Chat 3", "Chat 2", "Chat 1", "Chat 0", "Empty"]
+    assert lines[0]["messages"] == [{"role": "user", "content": "Question 4"},
+                                    {"role": "assistant", "content": "Ünïcode"}]
+    assert lines[0]["message_count"] == 2 and lines[0]["timestamp"] == "2025-01-01T04:00:00"
+    assert lines[-1]["messages"] == []
+
+
+@responses.activate
+def test_export_endpoint_can_be_gzipped(test_client, monkeypatch):
+    user = Users(username="exportDownloader", password="p")
+    db.session.add(user)
+    db.session.commit()
+    for number in range(3):
+        save(user, f"Download {number}", datetime(2025, 2, 1, number), [{"role": "user", "content": "Hi"}])
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    insert_api_key()
+    responses.add(responses.GET, 'https://api.clerk.com/v1/sessions/exportDownloadSession',
+                  json={'status': 'active', 'user_id': 'exportDownloader'}, status=200)
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    body = {"sessionId": "exportDownloadSession", "userId": "exportDownloader"}
+
+    response = test_client.post('/api/history/export', headers=headers, json=body)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.is_streamed
+    plain = response.data
+    assert [json.loads(line)["title"] for line in plain.splitlines()] == ["Download 2", "Download 1", "Download 0"]
+
+    response = test_client.post('/api/history/export', headers={**headers, 'Accept-Encoding': 'gzip'}, json=body)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain
@@ -0,0 +1,37 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from flask import jsonify, request
+
+from app.jsonprovider import dumps_bytes
+from app.model import ConversationHistory
+from app.utils import get_single_api_key, insert_api_key
+
+
+def test_jsonify_matches_flask_default_conversions(test_client):
+    with test_client.application.test_request_context():
+        response = jsonify({"when": datetime(2024, 1, 2, 3, 4, 5), "price": Decimal("1.50"), 1: "one"})
+    assert response.mimetype == "application/json"
+    assert response.get_json() == {"when": "Tue, 02 Jan 2024 03:04:05 GMT", "price": "1.50", "1": "one"}
+
+
+def test_request_bodies_are_parsed(test_client):
+    with test_client.application.test_request_context(json={"messages": [{"role": "user", "content": "héllo"}]}):
+        assert request.get_json()["messages"][0]["content"] == "héllo"
+
+
+def test_catalog_routes_return_json(test_client):
+    insert_api_key()
+    response = test_client.get('/api/personas', headers={'Authorization': f'Bearer {get_single_api_key()}'})
+    assert response.mimetype == "application/json"
+    assert isinstance(response.get_json(), list)
+
+
+def test_history_document_is_spliced_from_stored_messages(test_client):
+    messages = [{"role": "user", "content": "Ünïcode \"quotes\""},
+                {"role": "assistant", "content": [{"type": "text", "text": "ok"}]}]
+    conversation = ConversationHistory(user_id=1, title="Splice")
+    conversation.append_messages(messages)
+    assert json.loads(conversation.to_dict()["conversation"]) == {"messages": messages}
+    assert json.loads(dumps_bytes(conversation.to_dict())) == conversation.to_dict()
@@ -0,0 +1,13 @@
+from loadtest.driver import percentile
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile(values, 0.07) == 7
+    assert percentile(values, 1.0) == 100
+    assert percentile([3], 0.5) == 3
+    assert percentile([1, 2, 3, 4], 0.5) == 2
+    assert percentile([], 0.5) is None
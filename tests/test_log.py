@@ -0,0 +1,36 @@
+import json
+import logging
+
+from app import log
+from app.log import JsonFormatter, redact
+
+
+def test_redact_hides_prompt_bodies():
+    assert redact("secret prompt") == "<redacted 13 chars>"
+    assert redact([{"role": "user", "content": "hi"}]) == "<redacted 1 messages>"
+    assert redact({"role": "user", "content": "hi"}) == "<redacted user>"
+
+
+def test_redact_passthrough_when_enabled(monkeypatch):
+    monkeypatch.setattr(log, "_log_prompts", True)
+    assert redact("secret prompt") == "secret prompt"
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord("app.api", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+    record.request_id = "abc"
+    record.status = 200
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "hello world"
+    assert entry["request_id"] == "abc"
+    assert entry["status"] == 200
+
+
+def test_request_id_is_echoed(test_client):
+    response = test_client.get('/', headers={'X-Request-ID': 'req-123'})
+    assert response.headers['X-Request-ID'] == 'req-123'
+
+
+def test_request_id_is_generated(test_client):
+    response = test_client.get('/', headers={'X-Request-ID': 'bad id with spaces'})
+    assert len(response.headers['X-Request-ID']) == 32
@@ -0,0 +1,46 @@
+import pytest
+
+from app.metrics import Counter, Histogram, Registry, observe_vendor, VENDOR_TOKENS
+from app.utils import get_single_api_key, insert_api_key
+
+
+def test_histogram_buckets_observations():
+    histogram = Histogram("test_latency", "Test.", ("route",), buckets=(0.1, 1.0), registry=Registry())
+    histogram.observe(0.05, route="a")
+    histogram.observe(0.5, route="a")
+    histogram.observe(5, route="a")
+    values = dict((tuple(k), v) for k, v in histogram.snapshot()["values"])
+    assert values[("a",)] == [1, 1, 1, 5.55, 3]
+
+
+def test_counter_labels():
+    counter = Counter("test_total", "Test.", ("kind",), registry=Registry())
+    counter.inc(kind="x")
+    counter.inc(2, kind="x")
+    assert counter.snapshot()["values"] == [[["x"], 3]]
+
+
+def test_observe_vendor_records_tokens():
+    with observe_vendor("openai", "test-metrics-model") as call:
+        call.record_usage({"input_tokens": 10, "output_tokens": 4})
+    values = dict((tuple(k), v) for k, v in VENDOR_TOKENS.snapshot()["values"])
+    assert values[("openai", "test-metrics-model", "input")] == 10
+    assert values[("openai", "test-metrics-model", "output")] == 4
+
+
+def test_observe_vendor_reraises():
+    with pytest.raises(RuntimeError):
+        with observe_vendor("openai", "test-metrics-model"):
+            raise RuntimeError("vendor down")
+
+
+def test_metrics_endpoint(test_client):
+    insert_api_key()
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    test_client.get('/api/personas', headers=headers)
+    response = test_client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'gptflask_http_requests_total{endpoint="api.api_personas",method="GET",status="200"}' in body
+    assert 'gptflask_db_queries_total{endpoint="api.api_personas"}' in body
+    assert '# TYPE gptflask_http_request_duration_seconds histogram' in body
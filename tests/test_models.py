@@ -2,4 +2,21 @@ from app.model import Users
 
 def test_new_user(test_client):
     user = Users(username='testuser', password='password123', email='test@test.com')
-    assert user.username == 'testuser'
\ No newline at end of file
+    assert user.username == 'testuser'
+
+def test_user_settings_upsert_creates_one_row(test_client):
+    from app.model import UserSettings, db
+    from app.utils import get_or_create_user_settings
+
+    user = Users(username='settingsuser', password='password123')
+    db.session.add(user)
+    db.session.commit()
+
+    created = get_or_create_user_settings(user.id)
+    created.appearance_mode = 'dark'
+    db.session.commit()
+    existing = get_or_create_user_settings(user.id)
+
+    assert existing.id == created.id
+    assert existing.appearance_mode == 'dark'
+    assert UserSettings.query.filter_by(user_id=user.id).count() == 1
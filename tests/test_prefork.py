@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+from app import create_app, metrics, vendors
+from app.config import TestingConfig
+from app.model import APIKey, db
+from app.prefork import after_fork, warm
+
+
+def test_vendor_sdks_configured_once(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.setattr(vendors, "_openai", None)
+    openai = vendors.openai_sdk()
+    openai.api_key = "configured"
+    # Later calls leave the module settings alone.
+    assert vendors.openai_sdk().api_key == "configured"
+
+
+def test_anthropic_client_shared_until_fork(monkeypatch):
+    pytest.importorskip("anthropic")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+    monkeypatch.setattr(vendors, "_anthropic_client", None)
+    client = vendors.anthropic_client()
+    assert vendors.anthropic_client() is client
+    vendors.reset_after_fork()
+    assert vendors.anthropic_client() is not client
+
+
+def test_after_fork_clears_inherited_metrics():
+    metrics.DB_QUERIES.inc(endpoint="api.test")
+    metrics.reset_after_fork()
+    assert metrics.DB_QUERIES.snapshot()["values"] == []
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_worker_serves_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(vendors, "preload", lambda: None)
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'prefork.db'}")
+    flask_app = create_app("testing")
+    warm(flask_app)
+    with flask_app.app_context():
+        db.session.add(APIKey(name="prefork-test", key="prefork-key"))
+        db.session.commit()
+        db.session.remove()
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            after_fork(flask_app)
+            response = flask_app.test_client().get('/api/personas',
+                                                   headers={'Authorization': 'Bearer prefork-key'})
+            status = 0 if response.status_code == 200 else 1
+        finally:
+            sys.stdout.flush()
+            os._exit(status)
+    _, wait_status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(wait_status) == 0
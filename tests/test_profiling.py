@@ -0,0 +1,91 @@
+import os
+import pstats
+
+import pytest
+import responses
+
+from app import create_app
+from app.config import TestingConfig
+from app.model import APIKey, Users, db
+from app.profiling import PROFILE_RESPONSE_HEADER, _prune
+
+
+@pytest.fixture
+def profiling_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, "PROFILE_ENABLED", True)
+    monkeypatch.setattr(TestingConfig, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(TestingConfig, "PROFILE_ENGINE", "cprofile")
+    monkeypatch.setattr(TestingConfig, "PROFILE_API_KEY_NAMES", ["profiler"])
+    flask_app = create_app("testing")
+    ctx = flask_app.app_context()
+    ctx.push()
+    db.session.add_all([APIKey(name="profiler", key="profiler-key"), APIKey(name="other", key="other-key")])
+    db.session.commit()
+    yield flask_app.test_client()
+    db.session.remove()
+    ctx.pop()
+
+
+def test_profiling_disabled_registers_no_hooks(test_client):
+    hooks = [f.__name__ for f in test_client.application.before_request_funcs[None]]
+    assert "start_profile" not in hooks
+
+
+def test_header_profiles_request_for_allowed_key(profiling_client):
+    app = profiling_client.application
+    response = profiling_client.get('/api/render-types',
+                                    headers={'Authorization': 'Bearer profiler-key', 'X-Profile': '1'})
+    assert response.status_code == 200
+    name = response.headers[PROFILE_RESPONSE_HEADER]
+    assert name.endswith(".prof")
+    stats = pstats.Stats(os.path.join(app.config["PROFILE_DIR"], name))
+    assert stats.total_calls > 0
+
+
+def test_header_ignored_for_other_keys(profiling_client):
+    response = profiling_client.get('/api/render-types',
+                                    headers={'Authorization': 'Bearer other-key', 'X-Profile': '1'})
+    assert response.status_code == 200
+    assert PROFILE_RESPONSE_HEADER not in response.headers
+
+
+def test_sample_rate_profiles_without_header(profiling_client):
+    profiling_client.application.config["PROFILE_SAMPLE_RATE"] = 1.0
+    response = profiling_client.get('/api/render-types', headers={'Authorization': 'Bearer other-key'})
+    assert PROFILE_RESPONSE_HEADER in response.headers
+
+
+def test_prune_keeps_newest(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"{i}.prof"
+        path.write_text("x")
+        os.utime(path, (i, i))
+    (tmp_path / "notes.txt").write_text("kept")
+    _prune(str(tmp_path), 2)
+    assert sorted(os.listdir(tmp_path)) == ["3.prof", "4.prof", "notes.txt"]
+
+
+@responses.activate
+def test_admin_can_list_and_download_profiles(profiling_client, monkeypatch):
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    responses.add(responses.GET, 'https://api.clerk.com/v1/sessions/profileSession',
+                  json={'status': 'active', 'user_id': 'profileAdmin'}, status=200)
+    headers = {'Authorization': 'Bearer profiler-key'}
+    name = profiling_client.get('/api/render-types', headers={**headers, 'X-Profile': '1'}) \
+        .headers[PROFILE_RESPONSE_HEADER]
+    body = {"sessionId": "profileSession", "userId": "profileAdmin"}
+
+    response = profiling_client.post('/api/admin/profiles', headers=headers, json=body)
+    assert response.status_code == 403
+
+    Users.query.filter_by(username="profileAdmin").one().is_admin = True
+    db.session.commit()
+    response = profiling_client.post('/api/admin/profiles', headers=headers, json=body)
+    assert response.status_code == 200
+    assert name in [profile["name"] for profile in response.get_json()]
+
+    response = profiling_client.post(f'/api/admin/profiles/{name}', headers=headers, json=body)
+    assert response.status_code == 200
+    assert len(response.data) > 0
+    response = profiling_client.post('/api/admin/profiles/missing.prof', headers=headers, json=body)
+    assert response.status_code == 404
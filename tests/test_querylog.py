@@ -0,0 +1,52 @@
+import json
+import logging
+
+import pytest
+
+from app import querylog
+from app.model import OutputFormat, RenderType, db
+from app.querylog import QueryBudgetExceeded
+from app.utils import get_single_api_key, insert_api_key
+
+
+@pytest.fixture
+def headers(test_client):
+    insert_api_key()
+    return {'Authorization': f'Bearer {get_single_api_key()}'}
+
+
+def test_slow_queries_are_logged_with_route(test_client, headers, monkeypatch, caplog):
+    monkeypatch.setattr(querylog, "_slow_query_threshold", 0)
+    with caplog.at_level(logging.WARNING, logger="app.querylog"):
+        test_client.get('/api/render-types', headers=headers)
+    slow = [record for record in caplog.records if record.getMessage() == "Slow query"]
+    assert slow
+    assert all(record.endpoint == "api.api_render_types" for record in slow)
+    assert any("render_type" in record.statement for record in slow)
+
+
+def test_query_budget_fails_in_strict_mode(test_client, headers, monkeypatch):
+    monkeypatch.setitem(test_client.application.config["QUERY_BUDGETS"], "api.api_render_types", 1)
+    with pytest.raises(QueryBudgetExceeded):
+        test_client.get('/api/render-types', headers=headers)
+
+
+def test_query_budget_warns_when_not_strict(test_client, headers, monkeypatch, caplog):
+    monkeypatch.setitem(test_client.application.config["QUERY_BUDGETS"], "api.api_render_types", 1)
+    monkeypatch.setitem(test_client.application.config, "QUERY_BUDGET_STRICT", False)
+    with caplog.at_level(logging.WARNING, logger="app.querylog"):
+        response = test_client.get('/api/render-types', headers=headers)
+    assert response.status_code == 200
+    assert any(record.getMessage() == "Query budget exceeded" for record in caplog.records)
+
+
+def test_output_formats_do_not_query_per_row(test_client, headers):
+    render_types = [RenderType(name=f"budget-{i}") for i in range(5)]
+    db.session.add_all(OutputFormat(name=f"Budget {i}", prompt="p", render_type=render_types[i % 5])
+                       for i in range(20))
+    db.session.commit()
+    db.session.expunge_all()
+    # Budget is 3 statements: API key, output formats, render types.
+    response = test_client.get('/api/output-formats', headers=headers)
+    assert response.status_code == 200
+    assert {item["render_type_name"] for item in json.loads(response.data)} >= {f"budget-{i}" for i in range(5)}
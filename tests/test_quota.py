@@ -0,0 +1,84 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from app.metrics import observe_vendor
+from app.model import APIVendor, Model, db
+from app.quota import estimate_tokens, model_tier, quota_tracker
+from app.utils import get_single_api_key, insert_api_key
+
+
+def test_estimate_tokens_counts_text_and_images():
+    messages = [
+        {"role": "system", "content": "x" * 400},
+        {"role": "user", "content": [
+            {"type": "text", "text": "y" * 40},
+            {"type": "image_url", "image_url": {"url": "data:...", "detail": "low"}},
+        ]},
+    ]
+    assert estimate_tokens(messages) == (4 + 100) + (4 + 10 + 85)
+
+
+def test_model_tier_matches_prefix(test_client):
+    assert model_tier("claude-3-opus-20240229") == "premium"
+    assert model_tier("gpt-4o-mini") == "standard"
+
+
+@pytest.fixture
+def quota_app(test_client):
+    app = test_client.application
+    app.config['QUOTA_ENABLED'] = True
+    app.config['QUOTA_LIMITS'] = {"standard": {"daily": 5000, "monthly": None}}
+    quota_tracker.clear()
+    yield app
+    app.config['QUOTA_ENABLED'] = False
+    quota_tracker.clear()
+
+
+def chat_body(max_tokens):
+    model = Model.query.filter_by(api_name="quota-model").first()
+    if model is None:
+        vendor = APIVendor(name="openai")
+        db.session.add(vendor)
+        db.session.flush()
+        model = Model(api_name="quota-model", name="Quota Model", api_vendor_id=vendor.id)
+        db.session.add(model)
+        db.session.commit()
+    return {"model": "quota-model", "modelId": model.id, "prompt": "hi", "personaId": None,
+            "outputFormatId": None, "imageData": "", "maxTokens": max_tokens, "budgetTokens": None,
+            "responseHistory": [{"role": "user", "content": "hi"}]}
+
+
+def fake_openai_request(request_dict):
+    with observe_vendor("openai", request_dict["model"]) as call:
+        call.record_usage({"input_tokens": 10, "output_tokens": 90,
+                           "thinking_tokens": 0, "cached_tokens": 0})
+    return {"role": "assistant", "content": "ok"}
+
+
+def test_chat_over_quota_is_rejected(quota_app):
+    insert_api_key()
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    client = quota_app.test_client()
+    with patch('app.api.openai_request', side_effect=fake_openai_request):
+        response = client.post('/api/chat', headers=headers, json=chat_body(4000))
+        assert response.status_code == 200
+
+        # The 4000 token reservation was settled down to the 100 tokens reported.
+        response = client.post('/api/chat', headers=headers, json=chat_body(4000))
+        assert response.status_code == 200
+
+        response = client.post('/api/chat', headers=headers, json=chat_body(6000))
+        assert response.status_code == 429
+        assert response.get_json()["quota"]["period"] == "daily"
+        assert int(response.headers['Retry-After']) > 0
+
+
+def test_reservation_released_when_vendor_not_called(quota_app):
+    with quota_app.test_request_context('/api/chat'):
+        principal = ("api_key", 999)
+        assert quota_tracker.reserve(principal, "standard", 4000) is None
+        assert quota_tracker.reserve(principal, "standard", 2000) is not None
+        quota_tracker.adjust(principal, "standard", 4000, 0)
+        assert quota_tracker.reserve(principal, "standard", 2000) is None
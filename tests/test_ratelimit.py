@@ -0,0 +1,48 @@
+import time
+
+from app.ratelimit import MemoryBackend
+from app.utils import get_single_api_key, insert_api_key
+
+
+def test_memory_backend_enforces_burst():
+    backend = MemoryBackend()
+    results = [backend.consume("k", rate=0.001, burst=3)[0] for _ in range(4)]
+    assert results == [True, True, True, False]
+
+
+def test_memory_backend_keys_are_independent():
+    backend = MemoryBackend()
+    assert backend.consume("a", rate=0.001, burst=1)[0]
+    assert not backend.consume("a", rate=0.001, burst=1)[0]
+    assert backend.consume("b", rate=0.001, burst=1)[0]
+
+
+def test_memory_backend_prunes_refilled_buckets():
+    backend = MemoryBackend(max_keys=1)
+    backend.consume("a", rate=1000, burst=1)
+    time.sleep(0.01)
+    backend.consume("b", rate=0.001, burst=1)
+    assert "a" not in backend._buckets
+    assert "b" in backend._buckets
+
+
+def test_rate_limited_route_returns_429(test_client):
+    app = test_client.application
+    insert_api_key()
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    original_limits = app.config['RATELIMITS']
+    app.config['RATELIMIT_ENABLED'] = True
+    app.config['RATELIMITS'] = {"catalog": {"api_key": (0.001, 2)}}
+    try:
+        first = test_client.get('/api/render-types', headers=headers)
+        assert first.status_code == 200
+        assert first.headers['X-RateLimit-Limit'] == '2'
+        assert first.headers['X-RateLimit-Remaining'] == '1'
+        test_client.get('/api/render-types', headers=headers)
+        limited = test_client.get('/api/render-types', headers=headers)
+        assert limited.status_code == 429
+        assert int(limited.headers['Retry-After']) >= 1
+        assert limited.headers['X-RateLimit-Remaining'] == '0'
+    finally:
+        app.config['RATELIMIT_ENABLED'] = False
+        app.config['RATELIMITS'] = original_limits
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+from flask import g
+
+from app import create_app, replica
+from app.config import TestingConfig
+from app.model import APIKey, Persona, db
+from app.replica import MemoryPins
+
+
+@pytest.fixture
+def replica_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_BINDS", {"replica": f"sqlite:///{tmp_path / 'replica.db'}"})
+    monkeypatch.setattr(TestingConfig, "REPLICA_STICKY_SECONDS", 60)
+    flask_app = create_app("testing")
+    ctx = flask_app.app_context()
+    ctx.push()
+    db.metadata.create_all(db.engines["replica"])
+    db.session.add_all([APIKey(name="replica-test", key="replica-key"), Persona(name="primary", prompt="p")])
+    db.session.commit()
+    with db.engines["replica"].begin() as connection:
+        connection.execute(Persona.__table__.insert(), [{"name": "replica", "prompt": "p"}])
+    yield flask_app.test_client()
+    db.session.remove()
+    ctx.pop()
+
+
+def persona_names(response):
+    return [persona["name"] for persona in json.loads(response.data)]
+
+
+def test_reads_go_to_replica_until_caller_writes(replica_client):
+    headers = {'Authorization': 'Bearer replica-key'}
+    assert persona_names(replica_client.get('/api/personas', headers=headers)) == ["replica"]
+
+    response = replica_client.post('/api/personas', headers=headers, json={"name": "new", "prompt": "p"})
+    assert response.status_code == 201
+
+    # The writer now reads its own write from the primary.
+    assert persona_names(replica_client.get('/api/personas', headers=headers)) == ["primary", "new"]
+
+
+def test_undecorated_routes_use_primary(replica_client):
+    headers = {'Authorization': 'Bearer replica-key'}
+    # The API key only exists on the primary, so auth proves the lookup went there.
+    response = replica_client.get('/api/render-types', headers=headers)
+    assert response.status_code == 200
+
+
+def test_memory_pins_expire(monkeypatch):
+    pins = MemoryPins()
+    pins.pin(["user:1"], 60)
+    assert pins.is_pinned(["user:1", "api_key:2"])
+    assert not pins.is_pinned(["user:2"])
+    pins.pin(["user:3"], -1)
+    assert not pins.is_pinned(["user:3"])
+
+
+def test_users_of_a_shared_api_key_are_pinned_separately(replica_client):
+    with replica_client.application.test_request_context('/api/personas'):
+        g.user_id, g.api_key_id = 1, 5
+        # A Clerk user's write must not pin every other user of the same key
+        assert replica._writer_keys() == ["user:1"]
+        g.user_id = None
+        assert replica._writer_keys() == ["api_key:5"]
+
+
+def test_bulk_import_pins_the_writer(replica_client):
+    headers = {'Authorization': 'Bearer replica-key'}
+    response = replica_client.post('/api/personas/bulk', headers=headers, json=[{"name": "bulk", "prompt": "p"}])
+    assert response.status_code == 200
+    # The bulk statements never flush, but the import still counts as a write
+    assert persona_names(replica_client.get('/api/personas', headers=headers)) == ["primary", "bulk"]
@@ -0,0 +1,129 @@
+import pytest
+import responses
+from sqlalchemy import event
+
+from app import create_app
+from app.model import ConversationHistory, Users, db
+from app.search import conversation_text, reindex_conversations, search_conversations
+from app.utils import get_single_api_key, insert_api_key
+
+
+def save(user, title, *messages):
+    conversation = ConversationHistory(user_id=user.id, title=title)
+    conversation.append_messages([{"role": "user", "content": message} for message in messages])
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
+
+
+@pytest.fixture
+def search_app():
+    flask_app = create_app("testing")
+    ctx = flask_app.app_context()
+    ctx.push()
+    owner = Users(username="searchUser", password="p")
+    other = Users(username="otherUser", password="p")
+    db.session.add_all([owner, other])
+    db.session.commit()
+    yield flask_app, owner, other
+    db.session.remove()
+    ctx.pop()
+
+
+def test_conversation_text_skips_non_text_parts():
+    messages = [
+        {"role": "user", "content": [{"type": "text", "text": "What is this?"},
+                                     {"type": "image_url", "image_url": {"url": "data:..."}}]},
+        {"role": "assistant", "content": "A cat."},
+    ]
+    assert conversation_text(messages) == "What is this?\nA cat."
+
+
+def test_search_ranks_title_matches_and_highlights(search_app):
+    _, owner, other = search_app
+    body_match = save(owner, "Weekend plans", "Which database should the <script> app use?")
+    title_match = save(owner, "Database migrations", "How do I add a column?")
+    save(owner, "Cooking", "Pasta recipes")
+    save(other, "Database tuning", "Someone else's chat")
+
+    results = search_conversations(owner.id, "database")
+    assert [result["id"] for result in results] == [title_match.id, body_match.id]
+    snippet = results[1]["snippet"]
+    assert "<mark>database</mark>" in snippet
+    assert "&lt;script&gt;" in snippet
+
+
+def test_index_follows_updates_and_deletes(search_app):
+    _, owner, _ = search_app
+    conversation = save(owner, "Travel", "Trains to Lisbon")
+    assert search_conversations(owner.id, "lisbon")
+
+    conversation.title = "Porto trip"
+    db.session.commit()
+    assert search_conversations(owner.id, "porto")
+
+    db.session.delete(conversation)
+    db.session.commit()
+    assert search_conversations(owner.id, "lisbon") == []
+
+
+def test_added_messages_are_appended_without_reading_the_chat(search_app):
+    _, owner, _ = search_app
+    conversation = save(owner, "Travel", "Trains to Lisbon")
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        conversation.append_messages([{"role": "assistant", "content": "Ferries to Madeira"},
+                                      {"role": "user", "content": [{"type": "text", "text": "And Porto?"}]}])
+        db.session.commit()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    assert not [statement for statement in statements if "FROM conversation_message" in statement]
+    body = db.session.execute(db.text("SELECT body FROM conversation_search WHERE rowid = :id"),
+                              {"id": conversation.id}).scalar_one()
+    assert body == conversation_text(conversation.message_list())
+    assert [result["id"] for result in search_conversations(owner.id, "madeira porto")] == [conversation.id]
+
+
+def test_operators_in_query_are_plain_words(search_app):
+    _, owner, _ = search_app
+    save(owner, "Logic", "true OR false")
+    assert len(search_conversations(owner.id, 'OR "NEAR( *')) == 0
+    assert len(search_conversations(owner.id, "true OR")) == 1
+
+
+def test_reindex_rebuilds_the_index(search_app):
+    _, owner, _ = search_app
+    save(owner, "Gardening", "Tomatoes")
+    db.session.execute(db.text("DELETE FROM conversation_search"))
+    db.session.commit()
+    assert search_conversations(owner.id, "tomatoes") == []
+    assert reindex_conversations() >= 1
+    assert search_conversations(owner.id, "tomatoes")
+
+
+@responses.activate
+def test_search_endpoint_paginates(search_app, monkeypatch):
+    flask_app, owner, _ = search_app
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    insert_api_key()
+    responses.add(responses.GET, 'https://api.clerk.com/v1/sessions/searchSession',
+                  json={'status': 'active', 'user_id': 'searchUser'}, status=200)
+    for number in range(3):
+        save(owner, f"Kubernetes notes {number}", "pods and services")
+    client = flask_app.test_client()
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    body = {"sessionId": "searchSession", "userId": "searchUser", "query": "kubernetes", "perPage": 2}
+
+    first = client.post('/api/history/search', headers=headers, json=body).get_json()
+    assert len(first["results"]) == 2 and first["hasMore"] is True
+    second = client.post('/api/history/search', headers=headers, json={**body, "page": 2}).get_json()
+    assert len(second["results"]) == 1 and second["hasMore"] is False
+
+    response = client.post('/api/history/search', headers=headers, json={**body, "query": " "})
+    assert response.status_code == 400
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+import responses
+
+from app import create_app, semantic
+from app.config import TestingConfig
+from app.model import ConversationHistory, Users, db
+from app.semantic import HashingEmbedder, ShardedVectorIndex, embed_queue, reindex_semantic, semantic_search
+from app.utils import get_single_api_key, insert_api_key
+
+
+def save(user, title, message):
+    conversation = ConversationHistory(user_id=user.id, title=title)
+    conversation.append_messages([{"role": "user", "content": message}])
+    db.session.add(conversation)
+    db.session.commit()
+    embed_queue.flush()
+    return conversation
+
+
+@pytest.fixture
+def semantic_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, "SEMANTIC_INDEX_DIR", str(tmp_path / "semantic"))
+    # Restored after the test, which turns the index off again for other tests.
+    for name in ("_directory", "_embedder", "_index"):
+        monkeypatch.setattr(semantic, name, getattr(semantic, name))
+    flask_app = create_app("testing")
+    ctx = flask_app.app_context()
+    ctx.push()
+    user = Users(username="semanticUser", password="p")
+    db.session.add(user)
+    db.session.commit()
+    yield flask_app, user
+    db.session.remove()
+    ctx.pop()
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = HashingEmbedder(dim=64)
+    vectors = embedder.embed(["database migrations", "database migration", ""])
+    assert vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0)
+    assert np.allclose(vectors[0], vectors[1])  # stemmed to the same features
+    assert not vectors[2].any()
+    assert np.array_equal(HashingEmbedder(dim=64).embed(["database migrations"])[0], vectors[0])
+
+
+def test_index_overwrites_rows_in_place(tmp_path):
+    index = ShardedVectorIndex(str(tmp_path), dim=2)
+    index.upsert(1, [10, 11], np.array([[1, 0], [0, 1]], dtype=np.float32))
+    index.upsert(1, [10, 12], np.array([[0, 1], [1, 0]], dtype=np.float32))
+    ids, vectors = index.load(1)
+    assert ids.tolist() == [10, 11, 12]
+    assert np.array_equal(vectors, [[0, 1], [0, 1], [1, 0]])
+    assert index.search(1, np.array([1, 0], dtype=np.float32), 1)[0][0] == 12
+    assert index.search(2, np.array([1, 0], dtype=np.float32), 5) == []
+
+
+def test_index_keeps_newest_vector_per_id_in_old_shards(tmp_path):
+    index = ShardedVectorIndex(str(tmp_path), dim=2)
+    vectors_path, ids_path = index._paths(1)
+    # Shards written before rows were overwritten in place appended every save
+    np.array([[1, 0], [0, 1], [0, 1]], dtype=np.float32).tofile(vectors_path)
+    np.array([10, 11, 10], dtype=np.int64).tofile(ids_path)
+    ids, vectors = index.load(1)
+    assert ids.tolist() == [11, 10]
+    assert [conversation_id for conversation_id, _ in index.search(1, np.array([1, 0], dtype=np.float32), 5)] \
+        == [11, 10]
+    assert index.search(2, np.array([1, 0], dtype=np.float32), 5) == []
+
+
+def test_saved_chats_are_embedded_after_commit(semantic_app):
+    _, user = semantic_app
+    migrations = save(user, "Schema changes", "How do we run alembic database migrations safely?")
+    save(user, "Dinner", "A recipe for mushroom risotto")
+    db.session.add(ConversationHistory(user_id=user.id, title="Rolled back"))
+    db.session.flush()
+    db.session.rollback()
+    assert embed_queue.flush() == 0
+
+    matches = semantic_search(user.id, "that chat where we discussed database migration", limit=5)
+    assert matches[0][0] == migrations.id
+    assert len(matches) == 2
+
+
+def test_chat_saved_twice_keeps_one_row(semantic_app):
+    _, user = semantic_app
+    conversation = save(user, "Travel", "Trains across Portugal")
+    conversation.append_messages([{"role": "user", "content": "And ferries to the Azores"}])
+    db.session.commit()
+    db.session.add(ConversationHistory(user_id=user.id, title="Other"))
+    db.session.commit()
+    conversation.title = "Islands"
+    db.session.commit()
+    assert embed_queue.flush() == 2  # one embedding per queued chat, however often it was saved
+
+    ids, _ = semantic._index.load(user.id)
+    assert ids.tolist().count(conversation.id) == 1
+    assert semantic_search(user.id, "ferries azores islands", limit=1)[0][0] == conversation.id
+
+
+def test_relative_index_dir_is_rejected(monkeypatch):
+    monkeypatch.setattr(TestingConfig, "SEMANTIC_INDEX_DIR", "semantic_index")
+    for name in ("_directory", "_embedder", "_index"):
+        monkeypatch.setattr(semantic, name, getattr(semantic, name))
+    with pytest.raises(ValueError, match="absolute"):
+        create_app("testing")
+
+
+def test_reindex_rewrites_shards(semantic_app):
+    _, user = semantic_app
+    kept = save(user, "Gardening", "Tomatoes need sun")
+    deleted = save(user, "Gardening too", "Cucumbers need water")
+    db.session.delete(deleted)
+    db.session.commit()
+    assert reindex_semantic() >= 1
+    assert [conversation_id for conversation_id, _ in semantic_search(user.id, "tomatoes", limit=5)] == [kept.id]
+
+
+@responses.activate
+def test_semantic_search_endpoint(semantic_app, monkeypatch):
+    flask_app, user = semantic_app
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    insert_api_key()
+    responses.add(responses.GET, 'https://api.clerk.com/v1/sessions/semanticSession',
+                  json={'status': 'active', 'user_id': 'semanticUser'}, status=200)
+    travel = save(user, "Trip", "Booking trains across Portugal")
+    deleted = save(user, "Trip 2", "Trains in Spain")
+    db.session.delete(deleted)
+    db.session.commit()
+
+    response = flask_app.test_client().post(
+        '/api/history/semantic-search', headers={'Authorization': f'Bearer {get_single_api_key()}'},
+        json={"sessionId": "semanticSession", "userId": "semanticUser", "query": "train travel", "limit": 5})
+    assert response.status_code == 200
+    assert [result["id"] for result in response.get_json()["results"]] == [travel.id]
@@ -0,0 +1,52 @@
+import json
+
+from app.timing import RequestTiming, span
+from app.utils import get_single_api_key, insert_api_key
+
+
+def test_nested_phase_is_counted_once():
+    timing = RequestTiming()
+    outer = timing.push("vendor")
+    inner = timing.push("vendor")
+    timing.pop(inner)
+    timing.pop(outer)
+    timing.finish()
+    assert timing.phases["vendor"] == outer.duration
+
+
+def test_db_time_is_attributed_to_current_span():
+    timing = RequestTiming()
+    node = timing.push("prompt-build")
+    timing.add_db(0.002)
+    timing.pop(node)
+    timing.finish()
+    assert node.db_queries == 1
+    assert timing.phases["db"] == 0.002
+    assert "db;dur=2.00" in timing.server_timing_header()
+
+
+def test_span_outside_request_is_noop():
+    with span("auth"):
+        pass
+
+
+def test_server_timing_header(test_client):
+    insert_api_key()
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    response = test_client.get('/api/personas', headers=headers)
+    server_timing = response.headers['Server-Timing']
+    assert server_timing.startswith('auth;dur=')
+    assert 'db;dur=' in server_timing
+    assert 'serialize;dur=' in server_timing
+    assert 'total;dur=' in server_timing
+    assert 'X-Timing-Tree' not in response.headers
+
+
+def test_timing_tree_debug_header(test_client):
+    test_client.application.config['SERVER_TIMING_DEBUG'] = True
+    headers = {'Authorization': f'Bearer {get_single_api_key()}', 'X-Timing-Debug': '1'}
+    response = test_client.get('/api/personas', headers=headers)
+    test_client.application.config['SERVER_TIMING_DEBUG'] = False
+    tree = json.loads(response.headers['X-Timing-Tree'])
+    assert tree['name'] == 'request'
+    assert [child['name'] for child in tree['children']] == ['auth', 'serialize']
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+import responses
+
+from app.metrics import observe_vendor
+from app.model import TokenUsage, Users, db
+from app.usage import aggregate_usage, usage_buffer
+from app.utils import get_single_api_key, insert_api_key
+
+
+def test_vendor_calls_are_buffered_until_flush(test_client):
+    usage_buffer.drain()
+    with test_client.application.test_request_context('/api/chat'):
+        with observe_vendor("anthropic", "claude-test") as call:
+            call.record_usage({"input_tokens": 100, "output_tokens": 20,
+                               "thinking_tokens": 0, "cached_tokens": 50})
+    assert TokenUsage.query.filter_by(model_api_name="claude-test").count() == 0
+
+    assert usage_buffer.flush() == 1
+    row = TokenUsage.query.filter_by(model_api_name="claude-test").one()
+    assert row.api_vendor == "anthropic"
+    assert row.input_tokens == 100
+    assert row.cached_tokens == 50
+    assert row.latency_ms is not None
+
+
+def test_calls_without_usage_and_failed_calls_are_recorded(test_client):
+    usage_buffer.drain()
+    with observe_vendor("openai", "dall-e-test"):
+        pass
+    with pytest.raises(TimeoutError):
+        with observe_vendor("openai", "timeout-test"):
+            raise TimeoutError()
+    assert usage_buffer.flush() == 2
+
+    image = TokenUsage.query.filter_by(model_api_name="dall-e-test").one()
+    assert (image.outcome, image.input_tokens, image.output_tokens) == ("ok", 0, 0)
+    failed = TokenUsage.query.filter_by(model_api_name="timeout-test").one()
+    assert failed.outcome == "error" and failed.latency_ms is not None
+
+def test_aggregate_usage_groups_by_model(test_client):
+    now = datetime.utcnow()
+    db.session.add_all([
+        TokenUsage(api_vendor="openai", model_api_name="agg-model", user_id=7,
+                   input_tokens=10, output_tokens=1, timestamp=now),
+        TokenUsage(api_vendor="openai", model_api_name="agg-model", user_id=7,
+                   input_tokens=5, output_tokens=2, timestamp=now),
+        TokenUsage(api_vendor="openai", model_api_name="agg-model", user_id=7,
+                   input_tokens=1000, output_tokens=1000, timestamp=now - timedelta(days=3)),
+    ])
+    db.session.commit()
+
+    results = aggregate_usage(start=now - timedelta(days=1), group_by=["user", "model"])
+    row = next(r for r in results if r["model_api_name"] == "agg-model")
+    assert row["user_id"] == 7
+    assert row["requests"] == 2
+    assert row["input_tokens"] == 15
+    assert row["output_tokens"] == 3
+
+
+@responses.activate
+def test_admin_usage_requires_admin(test_client, monkeypatch):
+    monkeypatch.setenv("CLERK_SECRET", "test")
+    insert_api_key()
+    responses.add(responses.GET, 'https://api.clerk.com/v1/sessions/usageSession',
+                  json={'status': 'active', 'user_id': 'usageUser'}, status=200)
+    headers = {'Authorization': f'Bearer {get_single_api_key()}'}
+    body = {"sessionId": "usageSession", "userId": "usageUser", "groupBy": ["model"]}
+
+    response = test_client.post('/api/admin/usage', headers=headers, json=body)
+    assert response.status_code == 403
+
+    Users.query.filter_by(username="usageUser").one().is_admin = True
+    db.session.commit()
+    response = test_client.post('/api/admin/usage', headers=headers, json=body)
+    assert response.status_code == 200
+    assert any(r["model_api_name"] == "agg-model" for r in response.get_json())
+
+    response = test_client.post('/api/admin/usage', headers=headers, json={**body, "groupBy": ["bogus"]})
+    assert response.status_code == 400
@@ -0,0 +1,15 @@
+"""
+Production entry point: `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+The app is created for $FLASK_ENV (default production) and warmed before the
+server forks its workers, see app/prefork.py. gptflask.py remains the entry
+point for `flask run` and local development.
+"""
+
+import os
+
+from app import create_app
+from app.prefork import warm
+
+app = create_app(os.environ.get("FLASK_ENV", "production"))
+warm(app)